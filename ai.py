@@ -0,0 +1,194 @@
+"""Monte Carlo tree search opponent.
+
+The search is open-loop: tree nodes are keyed by action sequences and
+every iteration replays the path on a fresh clone of the root state with
+its own RNG, so random targets and damage are sampled rather than stored.
+Root parallelization runs independent searches in a process pool and sums
+the root visit counts. The pool is started and warmed when the agent is
+built, and every search stops at its move's deadline, so moves that queue
+behind other callers' work get less time rather than more.
+
+Usage: python ai.py --games 20 --budget 0.15 --workers 4
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import time
+
+from battle_engine import BASIC_ATTACK, BattleState, new_battle, random_policy, step
+
+class Node:
+    __slots__ = ("children", "visits", "value")
+
+    def __init__(self):
+        self.children = {}  # action -> Node
+        self.visits = 0
+        self.value = 0.0  # Total reward for the player who chose the action leading here
+
+def outcome(state):
+    """Reward per player: 1/0 for a finished battle, HP share otherwise"""
+    if state.winner is not None:
+        return [1.0 if i == state.winner else 0.0 for i in range(len(state.players))]
+    hp = [sum(w.hp for w in player.waifus) for player in state.players]
+    total = sum(hp) or 1
+    return [h / total for h in hp]
+
+def search(root_state, time_budget, seed=None, exploration=1.4, rollout_depth=200):
+    """Run MCTS until the deadline; returns {action: (visits, value)} for the root"""
+    deadline = time.perf_counter() + time_budget
+    rng = random.Random(seed)
+    root = Node()
+
+    while True:
+        state = root_state.clone(random.Random(rng.random()))
+        node = root
+        path = []  # (node, player_idx who chose the action into it)
+
+        # Selection and expansion
+        while not state.is_over():
+            legal = state.legal_actions()
+            untried = [a for a in legal if a not in node.children]
+            _, player_idx = state.current_actor()
+            if untried:
+                action = rng.choice(untried)
+                node.children[action] = Node()
+            else:
+                log_n = math.log(node.visits or 1)
+                action = max(legal, key=lambda a: _uct(node.children[a], log_n, exploration))
+            node = node.children[action]
+            path.append((node, player_idx))
+            step(state, action)
+            if untried:
+                break
+
+        # Rollout
+        depth = 0
+        while not state.is_over() and depth < rollout_depth:
+            step(state, random_policy(state))
+            depth += 1
+
+        # Backpropagation
+        reward = outcome(state)
+        root.visits += 1
+        for visited, player_idx in path:
+            visited.visits += 1
+            visited.value += reward[player_idx]
+
+        if time.perf_counter() >= deadline:
+            break
+
+    return {action: (child.visits, child.value) for action, child in root.children.items()}
+
+def _uct(child, log_n, exploration):
+    return child.value / child.visits + exploration * math.sqrt(log_n / child.visits)
+
+def _warm_worker(ready):
+    """Pool initializer: the worker has done its imports and can take searches"""
+    ready.release()
+
+def _search_worker(args):
+    """search() for what is left of the move's time; nothing if the deadline passed in the queue.
+
+    The deadline is on time.monotonic(), which is system-wide on the platforms we run on.
+    """
+    state, deadline, budget, seed, exploration, rollout_depth = args
+    budget = min(budget, deadline - time.monotonic())
+    if budget <= 0:
+        return {}
+    return search(state, budget, seed, exploration, rollout_depth)
+
+class MCTSAgent:
+    """Chooses an action for the current actor of a BattleState within a time budget"""
+
+    # Time reserved for pickling the state and collecting worker results
+    IPC_MARGIN = 0.03
+    # Longest the constructor waits for the workers to start
+    WARM_TIMEOUT = 60
+
+    def __init__(self, time_budget=0.15, workers=None, exploration=1.4, rollout_depth=200):
+        self.time_budget = time_budget
+        self.workers = os.cpu_count() if workers is None else workers
+        self.exploration = exploration
+        self.rollout_depth = rollout_depth
+        self._pool = None
+        if self.workers > 1:
+            # Spawned workers are safe to start from a threaded server process
+            context = multiprocessing.get_context("spawn")
+            ready = context.Semaphore(0)
+            self._pool = context.Pool(self.workers, initializer=_warm_worker, initargs=(ready,))
+            deadline = time.monotonic() + self.WARM_TIMEOUT
+            for _ in range(self.workers):
+                # A worker still starting after this only costs the first moves their search
+                if not ready.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    break
+
+    def choose(self, state):
+        """Best action for the current actor; falls back to a basic attack on timeout"""
+        if len(state.legal_actions()) == 1:
+            return state.legal_actions()[0]
+
+        if self.workers <= 1:
+            stats = search(state, self.time_budget, None, self.exploration, self.rollout_depth)
+        else:
+            budget = max(0.01, self.time_budget - self.IPC_MARGIN)
+            deadline = time.monotonic() + budget
+            seeds = [random.getrandbits(32) for _ in range(self.workers)]
+            tasks = [(state, deadline, budget, seed, self.exploration, self.rollout_depth) for seed in seeds]
+            try:
+                results = self._pool.map_async(_search_worker, tasks).get(timeout=self.time_budget * 2)
+            except multiprocessing.TimeoutError:
+                return BASIC_ATTACK
+            stats = {}
+            for result in results:
+                for action, (visits, value) in result.items():
+                    total_visits, total_value = stats.get(action, (0, 0.0))
+                    stats[action] = (total_visits + visits, total_value + value)
+
+        if not stats:
+            return BASIC_ATTACK
+        return max(stats, key=lambda a: stats[a][0])
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Play the MCTS agent against a random opponent")
+    parser.add_argument("--games", type=int, default=20, help="battles to play")
+    parser.add_argument("--budget", type=float, default=0.15, help="seconds per move")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="search processes")
+    parser.add_argument("--seed", type=int, default=0, help="seed for team draws and the opponent")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    agent = MCTSAgent(args.budget, args.workers)
+    latencies = []
+    wins = 0
+    try:
+        for game in range(args.games):
+            state = new_battle(random.Random(args.seed + game))
+            ai_player = game % 2
+            while not state.is_over() and state.actions_taken < 1000:
+                _, player_idx = state.current_actor()
+                if player_idx == ai_player:
+                    start = time.perf_counter()
+                    action = agent.choose(state)
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    action = random_policy(state)
+                step(state, action)
+            wins += state.winner == ai_player
+    finally:
+        agent.close()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"AI wins: {wins}/{args.games}")
+    print(f"Move latency: p50 {p50:.0f} ms  p99 {p99:.0f} ms over {len(latencies)} moves")
+
+if __name__ == "__main__":
+    main()
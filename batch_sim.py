@@ -0,0 +1,359 @@
+"""Vectorized batch simulator: advances N battles at once with NumPy arrays.
+
+Every per-unit attribute is stored as a (n_battles, 10) array; units 0-4
+belong to Player 1 and 5-9 to Player 2. Each call to step() plays one action
+in every unfinished battle using the same rules as battle_engine.step with
+the uniform random policy.
+
+Status effects expire through a timer wheel, the array counterpart of the
+engine's heap: every live battle has taken the same number of actions, so
+each step's casts are filed under the turn they run out (mod EFFECT_WHEEL)
+and a step reverts only the casts filed under the current turn.
+
+Usage: python batch_sim.py --battles 1000000 --batch 10000 --seed 0 --workers 8
+"""
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from battle_engine import (
+    ABILITY_DEFS, ABILITY_IDS_BY_ROLE, MAX_PER_ROLE, ROLES, ROSTER, TEAM_SIZE,
+)
+
+UNITS = 2 * TEAM_SIZE
+WAR, PRODUCTION, SUPPORT = range(3)
+DAMAGE, HEAL, ATTACK_UP, SHIELD, SPEED_UP, PRODUCTION_UP = range(6)
+EFFECT_CODES = {"damage": DAMAGE, "heal": HEAL, "attack_up": ATTACK_UP, "shield": SHIELD,
+                "speed_up": SPEED_UP, "production_up": PRODUCTION_UP}
+# Effects on all living allies, in the order of their stat in BatchBattles.status
+UNIT_STATUSES = (ATTACK_UP, SHIELD, SPEED_UP)
+POWER, GUARD, SPEED_BONUS = range(len(UNIT_STATUSES))
+STATUS_STRIDE = len(UNIT_STATUSES) * UNITS
+ROUND_KEY = 1 << 20  # Turn order key step per action taken; larger than any speed * UNITS
+
+# Ability templates per role as (role, template) -> effect / cost / scale / duration
+def _template_table(field):
+    return np.array([[field(ABILITY_DEFS[i]) for i in ABILITY_IDS_BY_ROLE[r]] for r in ROLES])
+
+TEMPLATE_EFFECT = _template_table(lambda d: EFFECT_CODES[d.effect])
+TEMPLATE_COST = _template_table(lambda d: d.cost)
+TEMPLATE_SCALE = _template_table(lambda d: d.scale)
+TEMPLATE_DURATION = _template_table(lambda d: d.duration)
+EFFECT_WHEEL = max(d.duration for d in ABILITY_DEFS) + 1
+
+ROSTER_ROLE = np.array([ROLES.index(specialty) for _, specialty in ROSTER])
+
+# Action choices per step
+ABILITY_0, ABILITY_1, ATTACK, SKIP = range(4)
+
+def _draft_teams(n, rng):
+    """Roster ids (n, 10) for two legal teams per battle, each sorted by role"""
+    order = rng.random((n, len(ROSTER))).argsort(axis=1)
+    roles = ROSTER_ROLE[order]
+    rows = np.arange(n)
+    role_count = np.zeros((n, 2, 3), dtype=np.int64)
+    picks = np.zeros((n, 2), dtype=np.int64)
+    teams = np.full((n, 2, TEAM_SIZE), -1, dtype=np.int64)
+    for j in range(len(ROSTER)):
+        cand, role = order[:, j], roles[:, j]
+        # Player 1 drafts first, Player 2 takes whatever Player 1 passes on
+        p1 = (picks[:, 0] < TEAM_SIZE) & (role_count[rows, 0, role] < MAX_PER_ROLE)
+        p2 = ~p1 & (picks[:, 1] < TEAM_SIZE) & (role_count[rows, 1, role] < MAX_PER_ROLE)
+        for p, take in ((0, p1), (1, p2)):
+            r = rows[take]
+            teams[r, p, picks[r, p]] = cand[take]
+            role_count[r, p, role[take]] += 1
+            picks[r, p] += 1
+    return grid_order(teams.reshape(n, UNITS))
+
+def grid_order(roster_id):
+    """Sort each team of a (n, 10) roster id array into grid order (War, Production, Support)"""
+    teams = roster_id.reshape(-1, 2, TEAM_SIZE)
+    teams = np.take_along_axis(teams, ROSTER_ROLE[teams].argsort(axis=2, kind="stable"), axis=2)
+    return teams.reshape(-1, UNITS)
+
+# Lookup tables over 10-bit unit masks: number of set bits and position of the k-th one
+_UNIT_BITS = (1 << np.arange(UNITS)).astype(np.uint16)
+_POPCOUNT = np.array([bin(m).count("1") for m in range(1 << UNITS)], dtype=np.int64)
+_KTH_BIT = np.zeros((1 << UNITS, UNITS), dtype=np.int64)
+for _m in range(1 << UNITS):
+    for _k, _j in enumerate(j for j in range(UNITS) if _m >> j & 1):
+        _KTH_BIT[_m, _k] = _j
+
+TEAM_BITS = np.array([(1 << TEAM_SIZE) - 1, ((1 << TEAM_SIZE) - 1) << TEAM_SIZE], dtype=np.uint16)
+
+def _to_bits(mask):
+    """Pack a (n, 10) bool mask into one 10-bit integer per row"""
+    return mask @ _UNIT_BITS
+
+def _pick_random(bits, rng):
+    """Uniformly choose one set bit per 10-bit mask; returns (unit index, any_set)"""
+    counts = _POPCOUNT[bits]
+    k = (rng.random(len(bits)) * counts).astype(np.int64)
+    return _KTH_BIT[bits, k], counts > 0
+
+class BatchBattles:
+    """Struct-of-arrays state for n_battles independent battles.
+
+    Teams are drafted at random unless `roster_id` gives them explicitly as
+    a (n_battles, 10) array in grid order (see grid_order).
+    """
+
+    def __init__(self, n_battles, rng, roster_id=None):
+        n = n_battles
+        self.rng = rng
+        self.roster_id = _draft_teams(n, rng) if roster_id is None else roster_id
+        self.role = ROSTER_ROLE[self.roster_id]
+        self.team = np.repeat([0, 1], TEAM_SIZE)
+        self.max_hp = 100
+        self.actions_taken = 0
+        self.winner = np.full(n, -1, dtype=np.int64)
+
+        # Per-battle arrays below only cover battles still in progress;
+        # `battle_id` maps each live row back to its slot in `winner`
+        self.battle_id = np.arange(n)
+        self.speed = rng.integers(85, 116, size=(n, UNITS))
+        self.hp = np.full((n, UNITS), self.max_hp, dtype=np.int64)
+        self.alive = np.full(n, (1 << UNITS) - 1, dtype=np.uint16)  # bitmask of living units
+        self.producers = _to_bits(self.role == PRODUCTION)
+
+        # Two abilities for the active (specialty) slot of each unit
+        templates = rng.random((n, UNITS, 4)).argsort(axis=2)[:, :, :2]
+        role = self.role[:, :, None]
+        self.ability_effect = TEMPLATE_EFFECT[role, templates]
+        self.ability_cost = TEMPLATE_COST[role, templates]
+        self.ability_duration = TEMPLATE_DURATION[role, templates]
+        self.ability_value = np.where(
+            self.ability_effect == DAMAGE,
+            rng.integers(15, 26, size=templates.shape),
+            rng.integers(1, 4, size=templates.shape),
+        ) * TEMPLATE_SCALE[role, templates]
+
+        self.points = np.full((n, 2), 5, dtype=np.int64)
+        # Status effects: current (power, guard, speed bonus) per unit, production bonus
+        # per player, and per wheel slot the casts that run out at that turn as
+        # (rows, stats, (m, 10) gains) or (rows, None, teams, amounts) for production
+        self.status = np.zeros((n, len(UNIT_STATUSES), UNITS), dtype=np.int64)
+        self.production_bonus = np.zeros((n, 2), dtype=np.int64)
+        self.wheel = [[] for _ in range(EFFECT_WHEEL)]
+
+        # Turn order as in timeline.ActionTimeline: the living unit with the lowest
+        # (actions taken, -speed, initial rank) acts next, packed into one integer
+        # key that is updated as units act and change speed. The stable sort on
+        # -speed keeps Player 1 first on ties, like compute_turn_order.
+        rank = (-self.speed).argsort(axis=1, kind="stable").argsort(axis=1)
+        self.order_key = -self.speed * UNITS + rank
+        self.living = np.ones((n, UNITS), dtype=bool)
+        # Team of the previous actor; production is due when the turn changes hands
+        self.last_team = np.full(n, -1, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self._generate_production()
+
+    _LIVE_ARRAYS = ("battle_id", "speed", "hp", "alive", "producers", "ability_effect", "ability_cost",
+                    "ability_duration", "ability_value", "points", "status", "production_bonus",
+                    "order_key", "living", "last_team", "done")
+
+    def _compact(self):
+        """Drop finished battles from the per-battle arrays"""
+        keep = ~self.done
+        for name in self._LIVE_ARRAYS:
+            setattr(self, name, getattr(self, name)[keep])
+        # Casts still pending refer to rows by their old index
+        new_row = np.cumsum(keep) - 1
+        for casts in self.wheel:
+            for i, (rows, *rest) in enumerate(casts):
+                live = keep[rows]
+                casts[i] = (new_row[rows[live]], *(None if a is None else a[live] for a in rest))
+
+    # Multi-axis fancy indexing is slow in NumPy, so the hot paths below index
+    # flattened views with precomputed offsets instead
+
+    def _actors(self):
+        """Flat unit index (row * 10 + unit) and team of each battle's current actor"""
+        actor = np.where(self.living, self.order_key, np.iinfo(np.int64).max).argmin(axis=1)
+        return np.arange(len(actor)) * UNITS + actor, actor // TEAM_SIZE
+
+    def _generate_production(self):
+        """Grant production points for battles whose turn changes hands"""
+        unit, team = self._actors()
+        slot = unit // UNITS * 2 + team
+        producers = _POPCOUNT[self.alive & self.producers & TEAM_BITS[team]]
+        due = self.last_team != team
+        self.points.ravel()[slot] += np.where(due, 2 * producers + self.production_bonus.ravel()[slot], 0)
+        self._unit, self._team = unit, team
+
+    def _damage(self, rows, actor, team, amount):
+        """Hit a random living enemy in each of `rows`, after the actor's power and the target's guard"""
+        target, found = _pick_random(self.alive[rows] & TEAM_BITS[1 - team], self.rng)
+        cell = rows[found] * UNITS + target[found]
+        status = self.status.ravel()
+        power = status[actor[found] // UNITS * STATUS_STRIDE + POWER * UNITS + actor[found] % UNITS]
+        guard = status[rows[found] * STATUS_STRIDE + GUARD * UNITS + target[found]]
+        damage = np.maximum(0, amount[found] * (100 + power) // 100 - guard)
+        hp = self.hp.ravel()
+        hp[cell] = np.maximum(0, hp[cell] - damage)
+
+    def _heal(self, rows, team, amount):
+        """Heal a random injured living ally in each of `rows`"""
+        hp = self.hp[rows]
+        injured = _to_bits((hp > 0) & (hp < self.max_hp)) & TEAM_BITS[team]
+        target, found = _pick_random(injured, self.rng)
+        cell = rows[found] * UNITS + target[found]
+        hp = self.hp.ravel()
+        hp[cell] = np.minimum(self.max_hp, hp[cell] + amount[found])
+
+    def _apply_statuses(self, rows, team, effect, amount, duration):
+        """Raise the casters' allies' (or player's) stats and file the reversal under the expiry turn"""
+        expires = (self.actions_taken + duration) % EFFECT_WHEEL
+        on_units = effect != PRODUCTION_UP
+        if on_units.any():
+            r, stat = rows[on_units], effect[on_units] - ATTACK_UP
+            allies = ((self.alive[r] & TEAM_BITS[team[on_units]])[:, None] & _UNIT_BITS) != 0
+            gain = allies * amount[on_units][:, None]
+            self._add_status(r, stat, gain)
+            self._file(expires[on_units], r, stat, gain)
+        on_player = ~on_units
+        if on_player.any():
+            r, t = rows[on_player], team[on_player]
+            self.production_bonus[r, t] += amount[on_player]
+            self._file(expires[on_player], r, None, t, amount[on_player])
+
+    def _file(self, expires, rows, stat, *amounts):
+        """Queue casts (per row) for reversal at their expiry slot"""
+        for slot in np.unique(expires):
+            cast = expires == slot
+            self.wheel[slot].append((rows[cast], None if stat is None else stat[cast], *(a[cast] for a in amounts)))
+
+    def _add_status(self, rows, stat, gain):
+        self.status[rows, stat] += gain
+        speed = stat == SPEED_BONUS
+        if speed.any():
+            self.order_key[rows[speed]] -= gain[speed] * UNITS
+
+    def _expire_statuses(self):
+        """Revert the status effects that run out at the current turn"""
+        casts = self.wheel[self.actions_taken % EFFECT_WHEEL]
+        for rows, stat, *rest in casts:
+            if stat is None:
+                team, amount = rest
+                self.production_bonus[rows, team] -= amount
+            else:
+                self._add_status(rows, stat, -rest[0])
+        casts.clear()
+
+    def step(self):
+        """Play one action in every unfinished battle"""
+        # Finished battles linger until they are a quarter of the arrays, then get dropped
+        if self.done.sum() * 4 > len(self.done):
+            self._compact()
+            self._unit, self._team = self._actors()
+        n = len(self.done)
+        if n == 0:
+            return
+        rows = np.arange(n)
+        unit, team = self._unit, self._team
+        cost = self.ability_cost.reshape(-1, 2)[unit]
+        points = self.points.ravel()
+        slot = rows * 2 + team
+
+        # Uniform over affordable abilities plus attack and skip; finished battles skip
+        afford = points[slot][:, None] >= cost
+        k = (self.rng.random(n) * (afford.sum(axis=1) + 2)).astype(np.int64)
+        choice = np.where(afford[:, 0], k, k + 1)
+        choice = np.where(afford[:, 1] | (choice < ABILITY_1), choice, choice + 1)
+        choice[self.done] = SKIP
+
+        # Abilities: pay the cost, then resolve by effect
+        uses = choice <= ABILITY_1
+        ability = unit * 2 + np.where(uses, choice, 0)
+        points[slot[uses]] -= self.ability_cost.ravel()[ability[uses]]
+        effect = np.where(uses, self.ability_effect.ravel()[ability], -1)
+        value = self.ability_value.ravel()[ability]
+
+        hit = effect == DAMAGE
+        self._damage(rows[hit], unit[hit], team[hit], value[hit])
+        heal = effect == HEAL
+        self._heal(rows[heal], team[heal], value[heal])
+        status = effect >= ATTACK_UP
+        if status.any():
+            self._apply_statuses(rows[status], team[status], effect[status], value[status],
+                                 self.ability_duration.ravel()[ability[status]])
+        attack = choice == ATTACK
+        self._damage(rows[attack], unit[attack], team[attack],
+                     self.rng.integers(10, 21, size=int(attack.sum())))
+
+        # Victory: a team with no living units loses
+        self.living = self.hp > 0
+        self.alive = _to_bits(self.living)
+        p1_alive = (self.alive & TEAM_BITS[0]) != 0
+        p2_alive = (self.alive & TEAM_BITS[1]) != 0
+        finished = ~self.done & ~(p1_alive & p2_alive)
+        self.winner[self.battle_id[finished]] = np.where(p1_alive[finished], 0, 1)
+        self.done |= finished
+
+        self.actions_taken += 1
+        self.last_team = team
+        self.order_key.ravel()[unit] += ROUND_KEY
+        self._expire_statuses()
+        self._generate_production()
+
+    def run(self, max_actions=1000):
+        """Step until every battle finishes; unfinished battles stay at -1 (draw)"""
+        while self.actions_taken < max_actions and not self.done.all():
+            self.step()
+        return self.winner
+
+    def character_results(self):
+        """Per-roster-character (picks, wins) arrays"""
+        picks = np.bincount(self.roster_id.ravel(), minlength=len(ROSTER))
+        won = (self.winner[:, None] == self.team)
+        wins = np.bincount(self.roster_id[won], minlength=len(ROSTER))
+        return picks, wins
+
+def run_batch(args):
+    """Play one batch; returns (outcome counts [draw, p1, p2], picks, wins)"""
+    n_battles, seed, max_actions = args
+    batch = BatchBattles(n_battles, np.random.default_rng(seed))
+    winner = batch.run(max_actions)
+    picks, wins = batch.character_results()
+    return np.bincount(winner + 1, minlength=3), picks, wins
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized Waifu Battle Arena simulator")
+    parser.add_argument("--battles", type=int, default=1000000, help="number of battles to play")
+    parser.add_argument("--batch", type=int, default=10000, help="battles advanced together")
+    parser.add_argument("--seed", type=int, default=0, help="seed for numpy.random.Generator")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--max-actions", type=int, default=1000, help="actions before a battle is a draw")
+    args = parser.parse_args()
+
+    sizes = [args.batch] * (args.battles // args.batch)
+    if args.battles % args.batch:
+        sizes.append(args.battles % args.batch)
+    # Independent child streams per batch keep results reproducible for any worker count
+    seeds = np.random.SeedSequence(args.seed).spawn(len(sizes))
+    tasks = [(size, seed, args.max_actions) for size, seed in zip(sizes, seeds)]
+
+    picks = np.zeros(len(ROSTER), dtype=np.int64)
+    wins = np.zeros(len(ROSTER), dtype=np.int64)
+    outcomes = np.zeros(3, dtype=np.int64)
+
+    start = time.perf_counter()
+    with Pool(args.workers) as pool:
+        for batch_outcomes, batch_picks, batch_wins in pool.imap_unordered(run_batch, tasks):
+            outcomes += batch_outcomes
+            picks += batch_picks
+            wins += batch_wins
+    elapsed = time.perf_counter() - start
+    print(f"Battles: {args.battles} in {elapsed:.2f}s ({args.battles / elapsed * 60:,.0f} battles/min)")
+    print(f"Player 1 wins: {outcomes[1]}  Player 2 wins: {outcomes[2]}  Draws: {outcomes[0]}")
+    print("Character win rates:")
+    for (name, specialty), n, w in zip(ROSTER, picks, wins):
+        rate = w / n if n else 0.0
+        print(f"  {name:<6} {specialty:<10} picks {n:>9}  win rate {rate:6.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,591 @@
+import json
+import os
+import random
+from collections import namedtuple
+
+from status import StatusEffects
+from timeline import ActionTimeline
+
+# Game classes shared by the Streamlit app and the headless simulators
+ROLES = ["War", "Production", "Support"]
+
+ROSTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "roster.json")
+ABILITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "abilities.json")
+
+def load_roster(path=ROSTER_PATH):
+    """Read roster definitions as (name, specialty) pairs from a JSON data file"""
+    with open(path, encoding="utf-8") as f:
+        return [(entry["name"], entry["specialty"]) for entry in json.load(f)]
+
+# Static roster: (name, specialty)
+ROSTER = load_roster()
+
+TEAM_SIZE = 5
+MAX_PER_ROLE = 3
+MAX_LARGE_TEAM_SIZE = 100  # Large battles: units per team
+MAX_TEAMS = 8  # Large battles: teams on the field
+
+# Actions accepted by step(); an int selects one of the actor's active abilities
+BASIC_ATTACK = "attack"
+SKIP_TURN = "skip"
+
+# Timed status effects: effect -> (stat it raises, who receives it). "allies"
+# are the caster's living waifus, "player" is the caster's player.
+STATUS_EFFECTS = {
+    "attack_up": ("power", "allies"),  # Percent bonus to damage dealt
+    "shield": ("guard", "allies"),  # Damage absorbed from every hit
+    "speed_up": ("speed", "allies"),
+    "production_up": ("production_bonus", "player"),  # Extra points per production grant
+}
+
+# Shared, immutable ability definitions (flyweights); waifus refer to them by index.
+# effect_type is the broad kind (damage, heal or buff), effect the exact effect;
+# an effect's strength is the rolled value times scale, lasting duration turns.
+AbilityDef = namedtuple("AbilityDef", ["name", "role", "cost", "effect_type", "effect", "scale", "duration"])
+
+def load_abilities(path=ABILITIES_PATH):
+    """Read ability definitions from a JSON data file"""
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    definitions = []
+    for entry in entries:
+        effect = entry["effect"]
+        if effect not in ("damage", "heal") and effect not in STATUS_EFFECTS:
+            raise ValueError(f"Unknown effect for {entry['name']}: {effect}")
+        effect_type = effect if effect in ("damage", "heal") else "buff"
+        definitions.append(AbilityDef(entry["name"], entry["role"], entry["cost"], effect_type, effect,
+                                      entry.get("scale", 1), entry.get("duration", 0)))
+    return tuple(definitions)
+
+# Order matters: replay logs store abilities by their index
+ABILITY_DEFS = load_abilities()
+ABILITY_IDS_BY_ROLE = {
+    role: tuple(i for i, d in enumerate(ABILITY_DEFS) if d.role == role) for role in ROLES
+}
+ROLE_INDEX = {role: i for i, role in enumerate(ROLES)}
+ABILITIES_PER_ROLE = 2
+
+def roll_ability_value(effect_type, rng=random):
+    """Random strength for a newly granted ability"""
+    return rng.randint(15, 25) if effect_type == "damage" else rng.randint(1, 3)
+
+class Ability:
+    """A waifu's copy of an ability: shared definition plus its rolled value"""
+    __slots__ = ("definition", "owner", "value")
+
+    def __init__(self, definition, owner, value):
+        self.definition = definition
+        self.owner = owner  # Name of the waifu holding this ability
+        self.value = value
+
+    @property
+    def name(self):
+        return f"{self.owner}'s {self.definition.name}"
+
+    @property
+    def role(self):
+        return self.definition.role  # War, Production, or Support
+
+    @property
+    def cost(self):
+        return self.definition.cost  # Production points required
+
+    @property
+    def effect_type(self):
+        return self.definition.effect_type  # damage, buff, heal
+
+    @property
+    def effect(self):
+        return self.definition.effect  # damage, heal or one of STATUS_EFFECTS
+
+    @property
+    def strength(self):
+        return self.value * self.definition.scale
+
+    def __str__(self):
+        return f"{self.role} ability: {self.name} (Cost: {self.cost})"
+
+class Waifu:
+    __slots__ = ("name", "specialty", "speed", "ability_ids", "ability_values",
+                 "current_position", "hp", "max_hp", "power", "guard")
+
+    # Every waifu has the same base stats, so they are shared at class level
+    stats = {"War": 8, "Production": 8, "Support": 8}
+
+    def __init__(self, name, specialty, speed=None, rng=random):
+        self.name = name
+        self.specialty = specialty  # One of the roles
+        self.speed = rng.randint(85, 115) if speed is None else speed  # Random speed for turn order
+        self.ability_ids, self.ability_values = self._generate_abilities(rng)
+        self.current_position = None  # Position in battle grid
+        self.hp = 100  # Health points
+        self.max_hp = 100
+        self.power = 0  # Percent damage bonus from status effects
+        self.guard = 0  # Damage absorbed per hit from status effects
+
+    def _generate_abilities(self, rng):
+        """Pick 2 random abilities for each role as (definition ids, rolled values)"""
+        ids = []
+        values = []
+        for role in ROLES:
+            for ability_id in rng.sample(ABILITY_IDS_BY_ROLE[role], ABILITIES_PER_ROLE):
+                ids.append(ability_id)
+                values.append(roll_ability_value(ABILITY_DEFS[ability_id].effect_type, rng))
+        return tuple(ids), tuple(values)
+
+    @property
+    def abilities(self):
+        return {role: self.get_active_abilities(role) for role in ROLES}
+
+    def get_stat(self, current_slot):
+        base = self.stats[current_slot]
+        if current_slot == self.specialty:
+            return base + 1
+        return base
+
+    def get_active_abilities(self, slot):
+        return [self.get_ability(slot, i) for i in range(ABILITIES_PER_ROLE)]
+
+    def get_ability(self, slot, index):
+        i = ROLE_INDEX[slot] * ABILITIES_PER_ROLE + index
+        return Ability(ABILITY_DEFS[self.ability_ids[i]], self.name, self.ability_values[i])
+
+    def ability_cost(self, slot, index):
+        """Cost of an ability without materializing it"""
+        return ABILITY_DEFS[self.ability_ids[ROLE_INDEX[slot] * ABILITIES_PER_ROLE + index]].cost
+
+    def clone(self):
+        """Independent copy sharing the immutable ability data"""
+        copy = Waifu.__new__(Waifu)
+        copy.name = self.name
+        copy.specialty = self.specialty
+        copy.speed = self.speed
+        copy.ability_ids = self.ability_ids
+        copy.ability_values = self.ability_values
+        copy.current_position = self.current_position
+        copy.hp = self.hp
+        copy.max_hp = self.max_hp
+        copy.power = self.power
+        copy.guard = self.guard
+        return copy
+
+    def __str__(self):
+        return f"{self.name} ({self.specialty}) - W:{self.stats['War']} P:{self.stats['Production']} S:{self.stats['Support']}"
+
+class Player:
+    __slots__ = ("name", "waifus", "production_points", "production_rate", "production_bonus")
+
+    def __init__(self, name):
+        self.name = name
+        self.waifus = []
+        self.production_points = 5  # Start with some points
+        self.production_rate = 0  # Points per turn from production waifus
+        self.production_bonus = 0  # Extra points per turn from status effects
+
+    def add_waifu(self, waifu):
+        self.waifus.append(waifu)
+
+    def calculate_production_rate(self):
+        """Calculate production points generated per turn"""
+        base_rate = 0
+        for waifu in self.waifus:
+            if waifu.specialty == "Production" and waifu.hp > 0:
+                base_rate += 2  # Base production per production waifu
+        self.production_rate = base_rate + self.production_bonus
+        return self.production_rate
+
+    def generate_production_points(self):
+        """Generate production points at start of turn"""
+        generated = self.calculate_production_rate()
+        self.production_points += generated
+        return generated
+
+    def clone(self, mapping):
+        """Copy with cloned waifus; records old -> new player and waifus in `mapping`"""
+        copy = Player.__new__(Player)
+        mapping[self] = copy
+        copy.name = self.name
+        copy.waifus = []
+        for waifu in self.waifus:
+            mapping[waifu] = waifu.clone()
+            copy.waifus.append(mapping[waifu])
+        copy.production_points = self.production_points
+        copy.production_rate = self.production_rate
+        copy.production_bonus = self.production_bonus
+        return copy
+
+# Result of a single combat action; target/amount are None when nothing was hit
+Event = namedtuple("Event", ["kind", "actor", "ability", "target", "amount"])
+
+def match_rng(seed, stream):
+    """Independent, reproducible RNG for one purpose (setup, combat, ...) within a match"""
+    return random.Random(f"{seed}:{stream}")
+
+def build_roster(rng=random):
+    """Create fresh Waifu objects for the whole roster"""
+    return [Waifu(name, specialty, rng=rng) for name, specialty in ROSTER]
+
+def arrange_grid(waifus, slots=TEAM_SIZE):
+    """Order a team by role (War, Production, Support) into grid slots"""
+    waifus_by_role = {"War": [], "Production": [], "Support": []}
+    for waifu in waifus:
+        waifus_by_role[waifu.specialty].append(waifu)
+
+    grid = []
+    for role in ROLES:
+        grid.extend(waifus_by_role[role])
+    for j, waifu in enumerate(grid):
+        waifu.current_position = j
+    return grid + [None] * (slots - len(grid))
+
+def compute_turn_order(players):
+    """Turn order as (waifu, player_idx) pairs sorted by speed (highest first)"""
+    all_waifus = []
+    for player_idx, player in enumerate(players):
+        for waifu in player.waifus:
+            all_waifus.append((waifu, player_idx))
+    all_waifus.sort(key=lambda x: x[0].speed, reverse=True)
+    return all_waifus
+
+def build_timeline(players):
+    """Action timeline seeded with the speed-sorted turn order"""
+    return ActionTimeline(compute_turn_order(players))
+
+def production_due(timeline):
+    """Whether the player about to act generates production points first"""
+    _, player_idx = timeline.current()
+    return timeline.last_player_idx != player_idx
+
+def finish_action(timeline, event=None):
+    """Drop a target the action defeated and move the timeline to the next actor"""
+    if event is not None and event.target is not None and event.target.hp <= 0:
+        timeline.remove(event.target)
+    timeline.advance()
+
+class UnitSet:
+    """Set with O(1) add, discard and uniform random choice"""
+    __slots__ = ("items", "_pos")
+
+    def __init__(self, items=()):
+        self.items = []
+        self._pos = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self._pos:
+            self._pos[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item):
+        i = self._pos.pop(item, None)
+        if i is None:
+            return
+        # Swap the last item into the hole
+        last = self.items.pop()
+        if last is not item:
+            self.items[i] = last
+            self._pos[last] = i
+
+    def choice(self, rng=random):
+        return rng.choice(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self._pos
+
+    def __iter__(self):
+        return iter(self.items)
+
+class TeamUnits:
+    """Living and injured units of one team, kept current as HP changes.
+
+    All combat HP changes go through set_hp() so targeting and victory
+    checks never have to scan the grid.
+    """
+    __slots__ = ("alive", "injured")
+
+    def __init__(self, waifus):
+        self.alive = UnitSet(w for w in waifus if w and w.hp > 0)
+        self.injured = UnitSet(w for w in self.alive if w.hp < w.max_hp)
+
+    def set_hp(self, waifu, hp):
+        waifu.hp = hp
+        if hp > 0:
+            self.alive.add(waifu)
+        else:
+            self.alive.discard(waifu)
+        if 0 < hp < waifu.max_hp:
+            self.injured.add(waifu)
+        else:
+            self.injured.discard(waifu)
+
+    def is_defeated(self):
+        return not self.alive
+
+def build_teams(battle_grid):
+    """Per-player TeamUnits for a battle grid"""
+    return [TeamUnits(battle_grid[f'player{i + 1}']) for i in range(len(battle_grid))]
+
+def hit(target, team, damage, attacker):
+    """Damage `target` after the attacker's power and the target's guard; returns the damage dealt"""
+    damage = max(0, damage * (100 + attacker.power) // 100 - target.guard)
+    team.set_hp(target, max(0, target.hp - damage))
+    return damage
+
+def modify_stat(units, stat, amount, timeline):
+    """Add `amount` to a stat of each unit; speed changes also reorder the timeline"""
+    if stat == "speed":
+        for unit in units:
+            timeline.set_speed(unit, unit.speed + amount)
+    else:
+        for unit in units:
+            setattr(unit, stat, getattr(unit, stat) + amount)
+
+def expire_effects(effects, turn, timeline):
+    """Revert every status effect that has run out by `turn`"""
+    for units, stat, amount in effects.expire(turn):
+        modify_stat(units, stat, -amount, timeline)
+
+def pick_enemy(teams, player_idx, rng=random):
+    """(random living unit of any other team, its TeamUnits), or (None, None) if there is none"""
+    if len(teams) == 2:
+        enemies = teams[1 - player_idx]
+        return (enemies.alive.choice(rng), enemies) if enemies.alive else (None, None)
+    # Uniform over all living enemies: pick a team weighted by its survivors
+    living = sum(len(team.alive) for i, team in enumerate(teams) if i != player_idx)
+    if not living:
+        return None, None
+    pick = rng.randrange(living)
+    for i, team in enumerate(teams):
+        if i != player_idx:
+            if pick < len(team.alive):
+                return team.alive.items[pick], team
+            pick -= len(team.alive)
+
+def _damage_effect(ability, actor, player_idx, state):
+    target, enemies = pick_enemy(state.teams, player_idx, state.rng)
+    if target is not None:
+        return Event("damage", actor, ability, target, hit(target, enemies, ability.strength, actor))
+    return Event("damage", actor, ability, None, None)
+
+def _heal_effect(ability, actor, player_idx, state):
+    allies = state.teams[player_idx]
+    if allies.injured:
+        target = allies.injured.choice(state.rng)
+        heal = ability.strength
+        allies.set_hp(target, min(target.max_hp, target.hp + heal))
+        return Event("heal", actor, ability, target, heal)
+    return Event("heal", actor, ability, None, None)
+
+def _status_effect(ability, actor, player_idx, state):
+    stat, recipients = STATUS_EFFECTS[ability.effect]
+    if recipients == "allies":
+        units = tuple(state.teams[player_idx].alive.items)
+    else:
+        units = (state.players[player_idx],)
+    amount = ability.strength
+    modify_stat(units, stat, amount, state.turn_order)
+    state.effects.add(state.actions_taken + ability.definition.duration, units, stat, amount)
+    return Event(ability.effect, actor, ability, None, amount)
+
+# Dispatch table compiled once from the ability data: definition -> effect handler
+EFFECT_HANDLERS = {"damage": _damage_effect, "heal": _heal_effect}
+EFFECT_HANDLERS.update((effect, _status_effect) for effect in STATUS_EFFECTS)
+ABILITY_HANDLERS = {definition: EFFECT_HANDLERS[definition.effect] for definition in ABILITY_DEFS}
+
+def resolve_ability(ability, actor, player_idx, state):
+    """Apply an ability's effect to the battle; the caller pays the cost.
+
+    `state` is a BattleState, or anything with its teams, players, rng,
+    turn_order, effects and actions_taken (e.g. replay.LogState).
+    """
+    return ABILITY_HANDLERS[ability.definition](ability, actor, player_idx, state)
+
+def resolve_basic_attack(actor, player_idx, teams, rng=random):
+    """Hit a random living enemy for 10-20 damage"""
+    target, enemies = pick_enemy(teams, player_idx, rng)
+    if target is not None:
+        return Event("attack", actor, None, target, hit(target, enemies, rng.randint(10, 20), actor))
+    return Event("attack", actor, None, None, None)
+
+def find_winner(teams):
+    """Index of the last team with living waifus, or None while two or more remain"""
+    winner = None
+    for player_idx, team in enumerate(teams):
+        if team.alive:
+            if winner is not None:
+                return None
+            winner = player_idx
+    return winner
+
+def random_team(pool, rng=random, size=TEAM_SIZE, max_per_role=MAX_PER_ROLE):
+    """Draw a legal team from `pool` respecting the per-role cap"""
+    role_count = {role: 0 for role in ROLES}
+    team = []
+    for waifu in rng.sample(pool, len(pool)):
+        if role_count[waifu.specialty] < max_per_role:
+            team.append(waifu)
+            role_count[waifu.specialty] += 1
+            if len(team) == size:
+                break
+    return team
+
+class BattleState:
+    """Explicit state of one battle, independent of any UI session"""
+
+    def __init__(self, players, rng=None, recorder=None, events=None):
+        self.players = players
+        self.rng = rng or random.Random()
+        self.battle_grid = {
+            f'player{i + 1}': arrange_grid(player.waifus, max(TEAM_SIZE, len(player.waifus)))
+            for i, player in enumerate(players)
+        }
+        self.turn_order = build_timeline(players)
+        self.actions_taken = 0
+        self.teams = build_teams(self.battle_grid)
+        self.winner = find_winner(self.teams)
+        self.effects = StatusEffects()
+        self.events = events  # Optional events.EventBus that every action is published to
+        self.recorder = recorder  # Optional replay log writer (see replay.ReplayWriter)
+        self._begin_turn()
+
+    @classmethod
+    def from_parts(cls, players, battle_grid, teams, turn_order, rng=None, actions_taken=0, effects=None):
+        """Wrap existing battle objects (e.g. the app's session state) without copying.
+
+        Unlike __init__, this does not start a turn: production for the
+        current actor is assumed to have been granted already.
+        """
+        state = cls.__new__(cls)
+        state.players = players
+        state.rng = rng or random.Random()
+        state.battle_grid = battle_grid
+        state.turn_order = turn_order
+        state.actions_taken = actions_taken
+        state.teams = teams
+        state.winner = find_winner(teams)
+        state.effects = effects if effects is not None else StatusEffects()
+        state.events = None
+        state.recorder = None
+        return state
+
+    def clone(self, rng=None):
+        """Deep copy of the battle for search; shares only immutable data"""
+        mapping = {}
+        players = [player.clone(mapping) for player in self.players]
+        grid = {key: [mapping[w] if w else None for w in slots] for key, slots in self.battle_grid.items()}
+        return BattleState.from_parts(players, grid, build_teams(grid), self.turn_order.clone(mapping),
+                                      rng, self.actions_taken, self.effects.clone(mapping))
+
+    def current_actor(self):
+        """(waifu, player_idx) whose turn it is"""
+        return self.turn_order.current()
+
+    def legal_actions(self):
+        """Actions the current actor may take"""
+        waifu, player_idx = self.current_actor()
+        points = self.players[player_idx].production_points
+        actions = [i for i in range(ABILITIES_PER_ROLE)
+                   if points >= waifu.ability_cost(waifu.specialty, i)]
+        return actions + [BASIC_ATTACK, SKIP_TURN]
+
+    def is_over(self):
+        return self.winner is not None
+
+    def _begin_turn(self):
+        if production_due(self.turn_order):
+            _, player_idx = self.current_actor()
+            player = self.players[player_idx]
+            generated = player.generate_production_points()
+            if generated > 0:
+                if self.events is not None:
+                    self.events.publish(self.actions_taken, player_idx, Event("production", player, None, None, generated))
+                if self.recorder is not None:
+                    self.recorder.production(self.actions_taken, player_idx, generated)
+
+def step(state, action):
+    """Apply one action for the current actor and advance to the next turn"""
+    if state.is_over():
+        raise ValueError("Battle is already over")
+
+    waifu, player_idx = state.current_actor()
+    player = state.players[player_idx]
+
+    event = None
+    if action == BASIC_ATTACK:
+        event = resolve_basic_attack(waifu, player_idx, state.teams, state.rng)
+    elif action != SKIP_TURN:
+        ability = waifu.get_ability(waifu.specialty, action)
+        if player.production_points < ability.cost:
+            raise ValueError("Not enough production points!")
+        player.production_points -= ability.cost
+        event = resolve_ability(ability, waifu, player_idx, state)
+    if state.events is not None:
+        state.events.publish(state.actions_taken, player_idx, event or Event("skip", waifu, None, None, None))
+    if state.recorder is not None:
+        state.recorder.action(state.actions_taken, waifu, player_idx, action, event)
+
+    state.actions_taken += 1
+    state.winner = find_winner(state.teams)
+    finish_action(state.turn_order, event)
+    expire_effects(state.effects, state.actions_taken, state.turn_order)
+    if not state.is_over():
+        state._begin_turn()
+    return state
+
+def new_battle(rng=None):
+    """Set up a battle between two random legal teams drawn from a fresh roster"""
+    rng = rng or random.Random()
+    pool = build_roster(rng)
+    players = [Player("Player 1"), Player("Player 2")]
+    for player in players:
+        for waifu in random_team(pool, rng):
+            player.add_waifu(waifu)
+            pool.remove(waifu)
+    return BattleState(players, rng)
+
+def build_armies(team_count, team_size, rng=random):
+    """Teams of numbered roster copies for large battles ("Mary 1", "Mary 2", ...).
+
+    Each team cycles through the whole roster in its own random order, so
+    roles stay balanced; every unit on the field has a unique name.
+    """
+    copies = {}
+    teams = []
+    for _ in range(team_count):
+        order = rng.sample(ROSTER, len(ROSTER))
+        team = []
+        for i in range(team_size):
+            name, specialty = order[i % len(order)]
+            copies[name] = copies.get(name, 0) + 1
+            team.append(Waifu(f"{name} {copies[name]}", specialty, rng=rng))
+        teams.append(team)
+    return teams
+
+def new_large_battle(team_count=2, team_size=MAX_LARGE_TEAM_SIZE, rng=None, events=None):
+    """Set up a large battle between `team_count` teams of `team_size` generated waifus"""
+    if not 2 <= team_count <= MAX_TEAMS:
+        raise ValueError(f"A large battle needs 2 to {MAX_TEAMS} teams")
+    if not 1 <= team_size <= MAX_LARGE_TEAM_SIZE:
+        raise ValueError(f"Teams hold 1 to {MAX_LARGE_TEAM_SIZE} waifus")
+    rng = rng or random.Random()
+    players = []
+    for i, army in enumerate(build_armies(team_count, team_size, rng)):
+        player = Player(f"Team {i + 1}")
+        for waifu in army:
+            player.add_waifu(waifu)
+        players.append(player)
+    return BattleState(players, rng, events=events)
+
+def random_policy(state):
+    """Pick uniformly among the current actor's legal actions"""
+    return state.rng.choice(state.legal_actions())
+
+def play_battle(state, policy=random_policy, max_actions=1000):
+    """Run a battle to completion; returns the winner index or None on a draw"""
+    while not state.is_over() and state.actions_taken < max_actions:
+        step(state, policy(state))
+    return state.winner
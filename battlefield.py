@@ -0,0 +1,126 @@
+"""Batched battlefield renderer for large battles.
+
+A 100v100 (or 8-team) battle has too many units for one card element each,
+so the whole field is a single canvas. Python packs the units into a
+compact state array, two bytes per unit:
+
+    byte 0  role index (bits 0-1), current actor (bit 2), buffed (bit 3)
+    byte 1  HP scaled to 1..255, 0 when defeated
+
+Units are stored team after team in grid order (War, Production, Support),
+base64-encoded into a small, fixed page that draws them. A rerun only
+changes the state array: 400 bytes for a 100v100 battle.
+"""
+import base64
+import json
+
+from battle_engine import ROLE_INDEX
+
+CELL = 24  # Canvas pixels per unit
+COLUMNS = 25  # Units per row of a team's block
+LABEL_HEIGHT = 22  # Pixels above each team's block for its name and headcount
+
+TEAM_COLORS = ("#4488ff", "#ff4444", "#44cc66", "#ffcc33", "#cc66ff", "#33cccc", "#ff8844", "#cccccc")
+
+def encode_units(grids, current=None):
+    """Compact state array of every slot in `grids` (one grid per team), base64-encoded"""
+    data = bytearray()
+    for grid in grids:
+        for waifu in grid:
+            if waifu is None:
+                data += b"\0\0"
+                continue
+            flags = ROLE_INDEX[waifu.specialty]
+            if waifu is current:
+                flags |= 4
+            if waifu.power or waifu.guard:
+                flags |= 8
+            data.append(flags)
+            data.append(-(-waifu.hp * 255 // waifu.max_hp) if waifu.hp > 0 else 0)
+    return base64.b64encode(bytes(data)).decode("ascii")
+
+def battlefield_height(team_count, team_size):
+    """Canvas height in pixels; the page uses the same layout"""
+    rows = -(-team_size // COLUMNS)
+    return team_count * (LABEL_HEIGHT + rows * CELL) + 4
+
+def render_battlefield(team_names, team_size, state):
+    """Self-contained HTML page drawing the encoded units of each named team"""
+    return (_PAGE
+            .replace("__NAMES__", json.dumps(team_names))
+            .replace("__SIZE__", str(team_size))
+            .replace("__STATE__", json.dumps(state))
+            .replace("__COLORS__", json.dumps(TEAM_COLORS))
+            .replace("__CELL__", str(CELL))
+            .replace("__COLUMNS__", str(COLUMNS))
+            .replace("__LABEL__", str(LABEL_HEIGHT))
+            .replace("__HEIGHT__", str(battlefield_height(len(team_names), team_size))))
+
+_PAGE = """<!DOCTYPE html>
+<html><body style="margin:0;background:transparent;font:12px 'Courier New',monospace;color:#fff">
+<canvas id="field" height="__HEIGHT__"></canvas>
+<div id="tip" style="position:fixed;display:none;background:#000c;padding:2px 6px;border-radius:4px"></div>
+<script>
+const NAMES = __NAMES__, SIZE = __SIZE__, COLORS = __COLORS__;
+const CELL = __CELL__, COLUMNS = __COLUMNS__, LABEL = __LABEL__;
+const ROLES = ["War", "Production", "Support"], ROLE_COLORS = ["#aa3333", "#aa6633", "#3344aa"];
+const units = Uint8Array.from(atob(__STATE__), c => c.charCodeAt(0));
+const rows = Math.ceil(SIZE / COLUMNS);
+const canvas = document.getElementById("field"), tip = document.getElementById("tip");
+canvas.width = COLUMNS * CELL + 2;
+const ctx = canvas.getContext("2d");
+
+function cellAt(team, i) {
+  return [1 + (i % COLUMNS) * CELL, team * (LABEL + rows * CELL) + LABEL + Math.floor(i / COLUMNS) * CELL];
+}
+
+function draw() {
+  for (let team = 0; team < NAMES.length; team++) {
+    let alive = 0;
+    for (let i = 0; i < SIZE; i++) {
+      const flags = units[2 * (team * SIZE + i)], hp = units[2 * (team * SIZE + i) + 1];
+      const [x, y] = cellAt(team, i);
+      if (hp === 0) {
+        ctx.fillStyle = "#2a2a2a";
+        ctx.fillRect(x + 1, y + 1, CELL - 2, CELL - 2);
+        continue;
+      }
+      alive++;
+      ctx.fillStyle = ROLE_COLORS[flags & 3];
+      ctx.fillRect(x + 1, y + 1, CELL - 2, CELL - 2);
+      ctx.fillStyle = hp > 153 ? "#44ff44" : hp > 76 ? "#ffff44" : "#ff4444";
+      ctx.fillRect(x + 2, y + CELL - 6, Math.ceil((CELL - 4) * hp / 255), 3);
+      if (flags & 8) {
+        ctx.fillStyle = "#ffcc33";
+        ctx.fillRect(x + CELL - 7, y + 3, 4, 4);
+      }
+      if (flags & 4) {
+        ctx.strokeStyle = "#ffffff";
+        ctx.lineWidth = 2;
+        ctx.strokeRect(x + 1, y + 1, CELL - 2, CELL - 2);
+      }
+    }
+    ctx.fillStyle = COLORS[team % COLORS.length];
+    ctx.fillText(NAMES[team] + "  " + alive + "/" + SIZE, 2, team * (LABEL + rows * CELL) + LABEL - 7);
+  }
+}
+
+canvas.addEventListener("mousemove", e => {
+  const band = LABEL + rows * CELL, team = Math.floor(e.offsetY / band);
+  const row = Math.floor((e.offsetY - team * band - LABEL) / CELL), col = Math.floor((e.offsetX - 1) / CELL);
+  const i = row * COLUMNS + col;
+  if (team >= NAMES.length || row < 0 || col < 0 || col >= COLUMNS || i >= SIZE) {
+    tip.style.display = "none";
+    return;
+  }
+  const flags = units[2 * (team * SIZE + i)], hp = units[2 * (team * SIZE + i) + 1];
+  tip.textContent = NAMES[team] + " · " + ROLES[flags & 3] + " · " + (hp ? Math.round(hp / 2.55) + "% HP" : "defeated");
+  tip.style.left = (e.clientX + 12) + "px";
+  tip.style.top = (e.clientY + 12) + "px";
+  tip.style.display = "block";
+});
+canvas.addEventListener("mouseleave", () => { tip.style.display = "none"; });
+draw();
+</script>
+</body></html>
+"""
@@ -0,0 +1,286 @@
+"""Load test: concurrent sessions playing whole games against a real app server.
+
+Starts `streamlit run waifu2.py` on a free port, with scratch match, ladder
+and replay storage. For each concurrency level it then connects that many
+headless sessions. They speak the browser's websocket protocol: a click is
+a rerun request carrying the button's trigger value. Each session clicks
+through the real flow of main():
+
+    start screen -> team selection (both players take the suggested picks)
+    -> battle setup -> battle (basic attacks) -> results screen
+
+AppTest cannot do this. It runs the script in the calling thread, so its
+sessions cannot run side by side. It also skips the server's websocket,
+session and message layers, which concurrent players load as much as the
+script does.
+
+Reported per level:
+- rerun latency percentiles per phase, from click to script_finished as
+  the client sees it;
+- completed reruns per second;
+- the server's RSS, and its growth per connected session.
+Process-wide caches (win-probability solutions, rendered cards) also grow
+with the matches played, up to their bounds. Warm-up matches fill them
+first, so the per-session figure is mostly session state.
+Throughput saturates at the last level that still added SATURATION_GAIN
+over the level before it; past it, more sessions only add latency.
+
+Usage:
+    python -m benchmarks.load --levels 1,2,4,8,16 --output load.json
+    python -m benchmarks.load --levels 8 --think 0.5   (players pause between clicks)
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+from battle_engine import TEAM_SIZE
+from benchmarks.suite import APP_PATH
+
+SATURATION_GAIN = 0.1  # Relative throughput gain below which a level counts as saturated
+PERCENTILES = (50, 95, 99)
+PHASES = ("start", "team_selection", "battle_setup", "battle")
+SERVER_TIMEOUT = 60  # Seconds to wait for the server to come up
+RSS_SAMPLE_INTERVAL = 0.2
+
+FINISHED = (0, 3)  # ScriptFinishedStatus: FINISHED_SUCCESSFULLY, FINISHED_FRAGMENT_RUN_SUCCESSFULLY
+
+class SessionError(RuntimeError):
+    pass
+
+class Session:
+    """One headless browser session: sends clicks, tracks the buttons on screen"""
+
+    def __init__(self, ws, think):
+        self.ws = ws
+        self.think = think
+        self.page_hash = ""
+        self.buttons = {}  # label -> (widget id, fragment id, disabled)
+        self.timings = defaultdict(list)  # phase -> seconds per rerun
+
+    async def rerun(self, phase, widget_id=None, fragment_id=""):
+        """Request a rerun (a click on `widget_id`) and wait until it has finished"""
+        msg = BackMsg()
+        request = msg.rerun_script
+        request.page_script_hash = self.page_hash
+        if widget_id is not None:
+            widget = request.widget_states.widgets.add()
+            widget.id = widget_id
+            widget.trigger_value = True
+        if fragment_id:
+            request.fragment_id = fragment_id
+        start = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        while True:
+            reply = ForwardMsg()
+            reply.ParseFromString(await self.ws.recv())
+            kind = reply.WhichOneof("type")
+            if kind == "new_session":
+                # A script run starts; a fragment run redraws only its own buttons
+                self.page_hash = reply.new_session.page_script_hash or self.page_hash
+                fragments = set(reply.new_session.fragment_ids_this_run)
+                self.buttons = {label: button for label, button in self.buttons.items()
+                                if fragments and button[1] not in fragments}
+            elif kind == "delta" and reply.delta.WhichOneof("type") == "new_element":
+                element = reply.delta.new_element
+                if element.WhichOneof("type") == "button":
+                    self.buttons[element.button.label] = (element.button.id, reply.delta.fragment_id,
+                                                          element.button.disabled)
+                elif element.WhichOneof("type") == "exception":
+                    raise SessionError(f"{phase}: {element.exception.type}: {element.exception.message}")
+            elif kind == "script_finished" and reply.script_finished in FINISHED:
+                break
+        self.timings[phase].append(time.perf_counter() - start)
+        if self.think:
+            await asyncio.sleep(self.think)
+
+    def find(self, text):
+        """(widget id, fragment id) of the enabled button whose label contains `text`, or None"""
+        for label, (widget_id, fragment_id, disabled) in self.buttons.items():
+            if text in label and not disabled:
+                return widget_id, fragment_id
+        return None
+
+    async def click(self, phase, text):
+        button = self.find(text)
+        if button is None:
+            raise SessionError(f"{phase}: no {text!r} button among {list(self.buttons)}")
+        await self.rerun(phase, *button)
+
+    async def play(self, max_actions):
+        """Play one hotseat match from the start screen to the results screen"""
+        await self.rerun("start")
+        await self.click("start", "ENTER BATTLE")
+        for confirm in ("Confirm Team", "Start Battle"):
+            for _ in range(TEAM_SIZE):
+                await self.click("team_selection", "Take Suggestion")
+            await self.click("team_selection", confirm)
+        await self.click("battle_setup", "Start Battle")
+        for _ in range(max_actions):
+            if self.find("Watch Replay"):
+                return
+            await self.click("battle", "Basic Attack")
+        raise SessionError(f"battle: no winner after {max_actions} actions")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port, scratch):
+    """`streamlit run` the app on `port`, storing matches, ladder and replays under `scratch`"""
+    env = dict(os.environ,
+               WAIFU_MATCH_DB=os.path.join(scratch, "matches.db"),
+               WAIFU_LADDER_DB=os.path.join(scratch, "ladder.db"),
+               WAIFU_REPLAY_DIR=os.path.join(scratch, "replays"))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.port", str(port),
+         "--server.headless", "true", "--browser.gatherUsageStats", "false",
+         "--server.fileWatcherType", "none"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"Server did not answer within {SERVER_TIMEOUT}s")
+
+def rss_bytes(pid):
+    """Resident set size of a process (Linux), or None where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+async def connect(url):
+    return await websockets.connect(url, subprotocols=["streamlit"], max_size=None)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted `values`"""
+    return values[min(len(values) - 1, max(0, -(-pct * len(values) // 100) - 1))]
+
+async def run_level(url, pid, sessions, think, max_actions):
+    """Play `sessions` concurrent matches; latency, throughput and memory of the level"""
+    baseline = rss_bytes(pid)
+    peak = baseline
+    connections = await asyncio.gather(*(connect(url) for _ in range(sessions)))
+    players = [Session(ws, think) for ws in connections]
+    try:
+        start = time.perf_counter()
+        games = asyncio.gather(*(player.play(max_actions) for player in players))
+        while not games.done():
+            await asyncio.wait([games], timeout=RSS_SAMPLE_INTERVAL)
+            rss = rss_bytes(pid)
+            if rss is not None:
+                peak = max(peak, rss)
+        games.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        for player in players:
+            await player.ws.close()
+
+    timings = defaultdict(list)
+    for player in players:
+        for phase, values in player.timings.items():
+            timings[phase].extend(values)
+    reruns = sum(len(values) for values in timings.values())
+    latency = {}
+    for phase in PHASES:
+        values = sorted(timings[phase])
+        if values:
+            latency[phase] = {f"p{pct}": percentile(values, pct) * 1000 for pct in PERCENTILES}
+    return {
+        "sessions": sessions,
+        "reruns": reruns,
+        "seconds": elapsed,
+        "throughput": reruns / elapsed,
+        "latency_ms": latency,
+        "rss_mb": peak / 2**20 if peak is not None else None,
+        "rss_per_session_mb": (peak - baseline) / sessions / 2**20 if peak is not None else None,
+    }
+
+def saturation_point(levels):
+    """Sessions of the last level that added SATURATION_GAIN throughput, or None if none stopped gaining"""
+    for previous, level in zip(levels, levels[1:]):
+        if level["throughput"] < previous["throughput"] * (1 + SATURATION_GAIN):
+            return previous["sessions"]
+    return None
+
+def print_level(level):
+    rss = (f"RSS {level['rss_mb']:.0f} MB, {level['rss_per_session_mb']:+.2f} MB/session"
+           if level["rss_mb"] is not None else "RSS n/a")
+    print(f"{level['sessions']:>4} sessions: {level['throughput']:7.1f} reruns/s "
+          f"({level['reruns']} in {level['seconds']:.1f}s), {rss}")
+    for phase, values in level["latency_ms"].items():
+        print(f"       {phase:<15}" + "".join(f"  p{pct} {values[f'p{pct}']:7.1f} ms" for pct in PERCENTILES))
+
+async def run_all(args, port, pid):
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    for _ in range(args.warmup):  # Imports, shared resources and caches, before anything is measured
+        await run_level(url, pid, 1, 0, args.max_actions)
+    levels = []
+    for sessions in args.levels:
+        level = await run_level(url, pid, sessions, args.think, args.max_actions)
+        print_level(level)
+        levels.append(level)
+    return levels
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the app with concurrent headless sessions")
+    parser.add_argument("--levels", default="1,2,4,8,16",
+                        help="comma-separated concurrent session counts, run in order")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="seconds a player pauses after each rerun (0: click as fast as the server answers)")
+    parser.add_argument("--max-actions", type=int, default=1000, help="battle actions before a match counts as stuck")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured matches played first")
+    parser.add_argument("--port", type=int, default=0, help="server port (default: a free one)")
+    parser.add_argument("--output", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+    args.levels = [int(level) for level in args.levels.split(",")]
+
+    port = args.port or free_port()
+    with tempfile.TemporaryDirectory() as scratch:
+        server = start_server(port, scratch)
+        try:
+            levels = asyncio.run(run_all(args, port, server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+
+    saturation = saturation_point(levels)
+    if saturation is None:
+        print(f"Throughput still gaining at {levels[-1]['sessions']} sessions; try higher levels")
+    else:
+        print(f"Throughput saturates at about {saturation} concurrent session(s)")
+    if args.output:
+        report = {
+            "meta": {"python": sys.version.split()[0], "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "think": args.think},
+            "levels": levels,
+            "saturation_sessions": saturation,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
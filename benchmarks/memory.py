@@ -0,0 +1,72 @@
+"""Memory benchmark: bytes held per game session and per in-flight battle.
+
+Usage: python -m benchmarks.memory --sessions 1000 --battles 1000
+"""
+import argparse
+import itertools
+import random
+import tracemalloc
+from collections import deque
+
+from battle_engine import TEAM_SIZE, BattleState, new_battle
+from catalog import build_catalog
+from replay import ReplayWriter
+from storage import MatchHandle, new_token
+from waifu2 import COMBAT_LOG_LINES, new_combat_log, new_session_state
+
+# Shared by every session, like get_shared_catalog() in the app
+SHARED_CATALOG = build_catalog()
+
+def new_session(seed=0):
+    """The objects init_session_state keeps for one browser session before its battle"""
+    return new_session_state(SHARED_CATALOG, seed)
+
+def battle_session(seed=0):
+    """A session whose teams are picked from its roster and whose battle has started"""
+    session = new_session(seed)
+    roster = session["roster"]
+    for character in list(roster.available())[:2 * TEAM_SIZE]:
+        player_idx = 0 if len(session["players"][0].waifus) < TEAM_SIZE else 1
+        session["players"][player_idx].add_waifu(roster.take(character.id))
+        session["role_counts"][player_idx][character.specialty] += 1
+    battle = BattleState(session["players"], session["combat_rng"])
+    replay_log = ReplayWriter()
+    replay_log.start(seed, session["players"])
+    events, stats = new_combat_log()
+    session.update(
+        battle_grid=battle.battle_grid, teams=battle.teams, turn_order=battle.turn_order,
+        effects=battle.effects, replay_log=replay_log, match=MatchHandle(new_token(), seed),
+        combat_log=events, combat_stats=stats, combat_log_seen=0,
+        combat_log_lines=deque(maxlen=COMBAT_LOG_LINES),
+    )
+    session["flow"].transition("team_selection")
+    session["flow"].transition("battle_setup")
+    session["flow"].transition("battle")
+    return session
+
+def bytes_per_object(factory, count):
+    """Average traced allocation size of `count` live objects built by `factory`"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [factory() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return (after - before) / count
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-session and per-battle memory")
+    parser.add_argument("--sessions", type=int, default=1000, help="sessions to hold at once")
+    parser.add_argument("--battles", type=int, default=1000, help="battles to hold at once")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the global RNG")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rng = random.Random(args.seed)
+    seeds = itertools.count(args.seed)
+    print(f"Bytes per session:           {bytes_per_object(lambda: new_session(next(seeds)), args.sessions):,.0f}")
+    print(f"Bytes per session in battle: {bytes_per_object(lambda: battle_session(next(seeds)), args.sessions):,.0f}")
+    print(f"Bytes per battle:            {bytes_per_object(lambda: new_battle(rng), args.battles):,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Benchmark suite: engine micro-benchmarks, battle throughput and app reruns.
+
+Results are written as JSON; pass --baseline to compare against an earlier
+run and exit non-zero when anything regressed by more than --tolerance.
+
+Usage:
+    python -m benchmarks.suite --output bench.json --save-baseline
+    python -m benchmarks.suite --output bench.json --baseline benchmarks/baseline.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from battle_engine import (
+    Waifu, build_timeline, new_battle, play_battle, resolve_ability, resolve_basic_attack,
+)
+from catalog import RosterOverlay, build_catalog
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "waifu2.py")
+PAGE_SIZE = 10  # As in the app
+STORAGE_VARIABLES = ("WAIFU_MATCH_DB", "WAIFU_LADDER_DB", "WAIFU_REPLAY_DIR")
+
+def per_call(fn, inputs, repeat=7):
+    """Best-of-`repeat` microseconds per call of fn(*args) over fresh `inputs()`"""
+    best = float("inf")
+    for _ in range(repeat):
+        args_list = inputs()
+        gc.disable()  # As timeit does; collections otherwise land in random samples
+        try:
+            start = time.perf_counter()
+            for args in args_list:
+                fn(*args)
+            best = min(best, (time.perf_counter() - start) / len(args_list))
+        finally:
+            gc.enable()
+    return best * 1e6
+
+def _battles(count, seed=0):
+    rng = random.Random(seed)
+    return [new_battle(random.Random(rng.random())) for _ in range(count)]
+
+def micro_benchmarks(n=5000):
+    """Microseconds per call of the hot engine and roster functions"""
+    catalog = build_catalog()
+    rng = random.Random(0)
+    results = {}
+
+    results["waifu_init"] = per_call(Waifu, lambda: [("Mary", "War", None, rng)] * n)
+
+    # build_timeline does not mutate its input, so the same teams can be reused
+    players = [[battle.players] for battle in _battles(n // 10)]
+    results["calculate_turn_order"] = per_call(build_timeline, lambda: players * 10)
+
+    overlay = RosterOverlay(catalog, rng)
+    for character in list(overlay.available())[:4]:
+        overlay.take(character.id)
+    pages = [(0, PAGE_SIZE, None, "Roster", ""), (0, PAGE_SIZE, "War", "Speed", ""),
+             (0, PAGE_SIZE, None, "Name", "a")]
+    results["get_available_waifus"] = per_call(overlay.page, lambda: pages * (n // len(pages)))
+
+    def abilities():
+        args = []
+        for battle in _battles(n // 10):
+            waifu, player_idx = battle.current_actor()
+            ability = waifu.get_ability(waifu.specialty, 0)
+            args.append((ability, waifu, player_idx, battle))
+        return args
+    results["use_ability"] = per_call(resolve_ability, abilities)
+
+    def attacks():
+        return [(*battle.current_actor(), battle.teams, battle.rng) for battle in _battles(n // 10)]
+    results["basic_attack"] = per_call(resolve_basic_attack, attacks)
+
+    return {name: {"value": value, "unit": "us", "better": "lower"} for name, value in results.items()}
+
+def throughput_benchmark(battles=300):
+    """Complete headless battles per second with the random policy"""
+    states = _battles(battles, seed=1)
+    start = time.perf_counter()
+    for state in states:
+        play_battle(state)
+    rate = battles / (time.perf_counter() - start)
+    return {"battle_throughput": {"value": rate, "unit": "battles/s", "better": "higher"}}
+
+def _count_elements(node):
+    children = getattr(node, "children", None)
+    if not children:
+        return 1
+    return sum(_count_elements(child) for child in children.values())
+
+def _click(at, label):
+    next(b for b in at.button if label in b.label).click().run()
+
+@contextmanager
+def scratch_storage():
+    """Point the app's match, ladder and replay storage at a temporary directory"""
+    saved = {name: os.environ.get(name) for name in STORAGE_VARIABLES}
+    with tempfile.TemporaryDirectory() as scratch:
+        os.environ.update(WAIFU_MATCH_DB=os.path.join(scratch, "matches.db"),
+                          WAIFU_LADDER_DB=os.path.join(scratch, "ladder.db"),
+                          WAIFU_REPLAY_DIR=os.path.join(scratch, "replays"))
+        try:
+            yield scratch
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+def app_benchmarks(reruns=5):
+    """Rerun latency (ms) and element count of each screen, driven by AppTest"""
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("streamlit is not installed; skipping app benchmarks", file=sys.stderr)
+        return {}
+
+    # The storage modules read these when the app first imports them
+    with scratch_storage():
+        return _app_benchmarks(AppTest, reruns)
+
+def _app_benchmarks(AppTest, reruns):
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.run()
+    screens = {}
+
+    def measure(name):
+        times = []
+        for _ in range(reruns):
+            start = time.perf_counter()
+            at.run()
+            times.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(f"{name} raised: {at.exception}")
+        times.sort()
+        screens[f"{name}_rerun"] = {"value": times[len(times) // 2] * 1000, "unit": "ms", "better": "lower"}
+        screens[f"{name}_elements"] = {"value": _count_elements(at.main), "unit": "elements", "better": "lower"}
+
+    measure("start_screen")
+    _click(at, "ENTER BATTLE")
+    measure("team_selection_screen")
+    for _ in range(2):
+        for _ in range(5):
+            next(b for b in at.button if b.key and b.key.startswith("select_all") and not b.disabled).click().run()
+        at.button[-1].click().run()
+    measure("battle_setup_screen")
+    _click(at, "Start Battle")
+    measure("battle_screen")
+    return screens
+
+def run_all(args):
+    results = {}
+    results.update(micro_benchmarks(args.calls))
+    results.update(throughput_benchmark(args.battles))
+    if not args.skip_app:
+        results.update(app_benchmarks(args.reruns))
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+def compare(current, baseline, tolerance):
+    """Names of benchmarks that got worse than the baseline by more than `tolerance`"""
+    regressions = []
+    for name, base in baseline["results"].items():
+        result = current["results"].get(name)
+        if result is None:
+            continue
+        old, new = base["value"], result["value"]
+        if result["unit"] == "elements":
+            worse = new > old  # Element counts are deterministic
+        elif result["better"] == "lower":
+            worse = new > old * (1 + tolerance)
+        else:
+            worse = new < old * (1 - tolerance)
+        change = (new - old) / old if old else 0.0
+        print(f"  {'REGRESSION' if worse else 'ok':<10} {name:<30} {old:>12.2f} -> {new:>12.2f} "
+              f"{result['unit']:<10} ({change:+.0%})")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--output", default="bench.json", help="where to write results")
+    parser.add_argument("--baseline", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write results to {BASELINE_PATH}")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--calls", type=int, default=5000, help="calls per micro-benchmark")
+    parser.add_argument("--battles", type=int, default=300, help="battles for the throughput benchmark")
+    parser.add_argument("--reruns", type=int, default=5, help="reruns timed per screen")
+    parser.add_argument("--skip-app", action="store_true", help="skip the AppTest benchmarks")
+    args = parser.parse_args()
+
+    report = run_all(args)
+    for name, result in report["results"].items():
+        print(f"  {name:<30} {result['value']:>12.2f} {result['unit']}")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.baseline}:")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import random
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import islice
+
+from battle_engine import ROLES, ROSTER, Waifu
+
+class CharacterDef(namedtuple("CharacterDef", ["id", "name", "specialty"])):
+    """Immutable roster entry shared by every session"""
+    __slots__ = ()
+
+    def get_stat(self, current_slot):
+        base = Waifu.stats[current_slot]
+        if current_slot == self.specialty:
+            return base + 1
+        return base
+
+# Sort orders offered by RosterOverlay.available(); "Speed" depends on
+# per-session rolls, so it is built by the overlay rather than the catalog
+SORT_KEYS = {
+    "Roster": None,
+    "Speed": None,
+    "Stat": lambda c: (-c.get_stat(c.specialty), c.name),
+    "Name": lambda c: c.name.lower(),
+}
+
+class RosterCatalog:
+    """Indexed, read-only view of the roster definitions.
+
+    Built once per process and shared by all sessions; per-session state
+    (picks, rolled speeds) lives in a RosterOverlay.
+    """
+
+    def __init__(self, definitions):
+        self.characters = tuple(definitions)
+        self.by_name = {c.name: c for c in self.characters}
+        self.by_specialty = {role: tuple(c for c in self.characters if c.specialty == role) for role in ROLES}
+
+        # Pre-sorted orders per specialty (None = all)
+        self._sorted = {}
+        for label, key in SORT_KEYS.items():
+            if label == "Speed":
+                continue
+            ordered = self.characters if key is None else tuple(sorted(self.characters, key=key))
+            self._sorted[(label, None)] = ordered
+            for role in ROLES:
+                self._sorted[(label, role)] = tuple(c for c in ordered if c.specialty == role)
+
+        # Sorted lowercase names for prefix search
+        self._search_keys = tuple(sorted((c.name.lower(), c.id) for c in self.characters))
+
+    def __len__(self):
+        return len(self.characters)
+
+    def ordered(self, sort="Roster", specialty=None):
+        return self._sorted[(sort, specialty)]
+
+    def search(self, query):
+        """Characters whose name starts with `query` (case-insensitive), in name order"""
+        query = query.lower()
+        i = bisect_left(self._search_keys, (query,))
+        while i < len(self._search_keys) and self._search_keys[i][0].startswith(query):
+            yield self.characters[self._search_keys[i][1]]
+            i += 1
+
+def build_catalog(roster=ROSTER):
+    """Catalog over (name, specialty) pairs; ids are positions in the roster"""
+    return RosterCatalog(CharacterDef(i, name, specialty) for i, (name, specialty) in enumerate(roster))
+
+class RosterOverlay:
+    """Per-session state layered over a shared RosterCatalog.
+
+    Stores only what differs between sessions: a rolled speed per character
+    (one byte each), the set of taken character ids, and Waifu objects for
+    characters that have actually been picked.
+    """
+
+    SPEED_MIN = 85
+
+    def __init__(self, catalog, rng=random):
+        self.catalog = catalog
+        self.rng = rng  # Rolls speeds now and abilities for each pick
+        self.speeds = array("B", (rng.randint(85, 115) - self.SPEED_MIN for _ in range(len(catalog))))
+        self.taken = set()
+        self.taken_by_specialty = {role: 0 for role in ROLES}
+        self.waifus = {}  # character id -> Waifu, materialized on pick
+        self._speed_order = None
+
+    def speed(self, character_id):
+        return self.speeds[character_id] + self.SPEED_MIN
+
+    def take(self, character_id):
+        """Mark a character as picked and return its Waifu"""
+        character = self.catalog.characters[character_id]
+        if character_id not in self.taken:
+            self.taken.add(character_id)
+            self.taken_by_specialty[character.specialty] += 1
+        if character_id not in self.waifus:
+            self.waifus[character_id] = Waifu(character.name, character.specialty, self.speed(character_id), self.rng)
+        return self.waifus[character_id]
+
+    def release(self, character_id):
+        """Return a picked character to the pool"""
+        if character_id in self.taken:
+            self.taken.discard(character_id)
+            self.taken_by_specialty[self.catalog.characters[character_id].specialty] -= 1
+
+    def count_available(self, specialty=None):
+        if specialty is None:
+            return len(self.catalog) - len(self.taken)
+        return len(self.catalog.by_specialty[specialty]) - self.taken_by_specialty[specialty]
+
+    def _ordered(self, sort, specialty):
+        if sort != "Speed":
+            return self.catalog.ordered(sort, specialty)
+        # Speed order depends on this session's rolls; sort once on first use
+        if self._speed_order is None:
+            self._speed_order = sorted(self.catalog.characters, key=lambda c: (-self.speeds[c.id], c.name))
+        if specialty is None:
+            return self._speed_order
+        return (c for c in self._speed_order if c.specialty == specialty)
+
+    def available(self, specialty=None, sort="Roster", query=""):
+        """Lazily iterate untaken characters, optionally filtered and sorted"""
+        if query:
+            source = (c for c in self.catalog.search(query) if specialty is None or c.specialty == specialty)
+        else:
+            source = self._ordered(sort, specialty)
+        return (c for c in source if c.id not in self.taken)
+
+    def page(self, page, page_size, specialty=None, sort="Roster", query=""):
+        """One page (0-based) of available characters"""
+        start = page * page_size
+        return list(islice(self.available(specialty, sort, query), start, start + page_size))
@@ -0,0 +1,220 @@
+"""Draft advisor: best next pick by alpha-beta search over the remaining picks.
+
+Player 1 makes all of its picks first, then Player 2. Leaves are scored
+with a fast strength estimate that only looks at roles, the team's
+production (which decides whether abilities are affordable) and speed,
+so among available characters of one role only the fastest is worth
+considering. That keeps the branching factor at the number of roles no
+matter how large the roster is. A transposition table keyed on the two
+teams' picked characters removes repeated positions; iterative deepening
+with greedy completion of the remaining picks keeps every answer within
+the time budget.
+
+Status effects are not scored: buff abilities (attack_up, shield,
+speed_up, production_up) add nothing to a role's profile, so roles whose
+kits lean on buffs are undervalued.
+
+Usage: python draft.py --roster-size 500
+"""
+import argparse
+import random
+import time
+from collections import namedtuple
+
+from battle_engine import ABILITY_DEFS, ABILITY_IDS_BY_ROLE, MAX_PER_ROLE, ROLES, TEAM_SIZE
+
+Candidate = namedtuple("Candidate", ["id", "name", "specialty", "speed"])
+Recommendation = namedtuple("Recommendation", ["candidate", "score", "depth"])
+
+ATTACK_DAMAGE = 15  # Mean of 10-20
+ABILITY_DAMAGE = 20  # Mean of 15-25
+ABILITY_HEAL = 20  # Mean value 2, times 10
+UNIT_HP = 100
+SPEED_WEIGHT = 0.001  # Score per point of speed advantage; initiative matters little over a battle
+
+def role_profile(role, income):
+    """Expected (damage, healing) per action of a unit under the random policy.
+
+    Abilities are drawn uniformly from the role's templates. Without
+    production income they soon become unaffordable, leaving attack/skip.
+    Buff abilities count as neither; their effect on later turns is not scored.
+    """
+    if not income:
+        return ATTACK_DAMAGE / 2, 0.0
+    templates = [ABILITY_DEFS[i].effect_type for i in ABILITY_IDS_BY_ROLE[role]]
+    slot_damage = templates.count("damage") / len(templates) * ABILITY_DAMAGE
+    slot_heal = templates.count("heal") / len(templates) * ABILITY_HEAL
+    return (ATTACK_DAMAGE + 2 * slot_damage) / 4, 2 * slot_heal / 4
+
+PROFILES = {(role, income): role_profile(role, income) for role in ROLES for income in (False, True)}
+
+def evaluate(teams):
+    """Score in [-1, 1] from Player 1's view for two lists of (specialty, speed)"""
+    stats = []
+    for team in teams:
+        income = any(specialty == "Production" for specialty, _ in team)
+        damage = heal = 0.0
+        for specialty, _ in team:
+            d, h = PROFILES[(specialty, income)]
+            damage += d
+            heal += h
+        stats.append((damage, heal, len(team) * UNIT_HP, sum(speed for _, speed in team)))
+    (d0, h0, hp0, s0), (d1, h1, hp1, s1) = stats
+    # Rounds each team survives against the other's net damage
+    t0 = hp0 / max(d1 - h0, 1.0)
+    t1 = hp1 / max(d0 - h1, 1.0)
+    score = (t0 - t1) / (t0 + t1) if t0 + t1 else 0.0
+    return max(-1.0, min(1.0, score + SPEED_WEIGHT * (s0 - s1)))
+
+class DraftSearch:
+    """One advisor query: the position after the picks made so far"""
+
+    def __init__(self, candidates, teams, team_size=TEAM_SIZE, max_per_role=MAX_PER_ROLE):
+        self.team_size = team_size
+        self.max_per_role = max_per_role
+        # Per role, fastest first; the search only ever takes the fastest remaining
+        self.pools = {role: sorted((c for c in candidates if c.specialty == role), key=lambda c: (-c.speed, c.id))
+                      for role in ROLES}
+        self.teams = [list(team) for team in teams]
+        self.taken = {role: 0 for role in ROLES}  # Picks made from the top of each pool during the search
+        self.table = {}  # (picked ids P1, picked ids P2) -> (depth, score, bound)
+        self.deadline = None
+
+    def _picker(self, teams):
+        return 0 if len(teams[0]) < self.team_size else 1
+
+    def _moves(self, team, taken):
+        """Fastest available character of each role the picker may still take"""
+        moves = []
+        for role in ROLES:
+            if (taken[role] < len(self.pools[role])
+                    and sum(specialty == role for specialty, _ in team) < self.max_per_role):
+                moves.append(self.pools[role][taken[role]])
+        return moves
+
+    def _greedy_value(self):
+        """Score after completing the remaining picks greedily (one-ply best for each picker)"""
+        teams = [list(self.teams[0]), list(self.teams[1])]
+        taken = dict(self.taken)
+        while len(teams[1]) < self.team_size:
+            player = self._picker(teams)
+            moves = self._moves(teams[player], taken)
+            if not moves:
+                break
+            sign = 1 if player == 0 else -1
+            best = max(moves, key=lambda c: sign * evaluate(
+                [teams[0] + [(c.specialty, c.speed)], teams[1]] if player == 0
+                else [teams[0], teams[1] + [(c.specialty, c.speed)]]))
+            teams[player].append((best.specialty, best.speed))
+            taken[best.specialty] += 1
+        return evaluate(teams)
+
+    def _play(self, player, candidate):
+        self.teams[player].append((candidate.specialty, candidate.speed))
+        self.taken[candidate.specialty] += 1
+
+    def _undo(self, player, candidate):
+        self.teams[player].pop()
+        self.taken[candidate.specialty] -= 1
+
+    def _search(self, picked, depth, alpha, beta):
+        if time.perf_counter() > self.deadline:
+            raise TimeoutError
+        player = self._picker(self.teams)
+        moves = self._moves(self.teams[player], self.taken) if len(self.teams[1]) < self.team_size else []
+        if not moves:
+            return evaluate(self.teams)
+        if depth == 0:
+            return self._greedy_value()
+
+        entry = self.table.get(picked)
+        if entry is not None and entry[0] >= depth:
+            _, score, bound = entry
+            if bound == 0 or (bound > 0 and score >= beta) or (bound < 0 and score <= alpha):
+                return score
+
+        original_alpha, original_beta = alpha, beta
+        best = -2.0 if player == 0 else 2.0
+        for candidate in moves:
+            child = (picked[0] | 1 << candidate.id, picked[1]) if player == 0 else (picked[0], picked[1] | 1 << candidate.id)
+            self._play(player, candidate)
+            try:
+                score = self._search(child, depth - 1, alpha, beta)
+            finally:
+                self._undo(player, candidate)
+            if player == 0:
+                best = max(best, score)
+                alpha = max(alpha, score)
+            else:
+                best = min(best, score)
+                beta = min(beta, score)
+            if alpha >= beta:
+                break
+        # Exact unless a cutoff happened; lower bound = fail-high, upper bound = fail-low
+        bound = 1 if best >= original_beta else -1 if best <= original_alpha else 0
+        self.table[picked] = (depth, best, bound)
+        return best
+
+    def best_pick(self, time_budget):
+        """Recommendation for the current picker, or None if nothing can be picked"""
+        self.deadline = time.perf_counter() + time_budget
+        player = self._picker(self.teams)
+        moves = self._moves(self.teams[player], self.taken)
+        if not moves or len(self.teams[1]) >= self.team_size:
+            return None
+        sign = 1 if player == 0 else -1
+        # Depth 0 (greedy completion) is always available if time runs out
+        scored = [(self._score_after(player, c, self._greedy_value), c) for c in moves]
+        score, candidate = max(scored, key=lambda sc: sign * sc[0])
+        best = Recommendation(candidate, score, 0)
+
+        remaining = 2 * self.team_size - len(self.teams[0]) - len(self.teams[1])
+        for depth in range(1, remaining + 1):
+            try:
+                scored = []
+                for candidate in moves:
+                    picked = (1 << candidate.id, 0) if player == 0 else (0, 1 << candidate.id)
+                    search = lambda: self._search(picked, depth - 1, -2.0, 2.0)
+                    scored.append((self._score_after(player, candidate, search), candidate))
+            except TimeoutError:
+                break
+            score, candidate = max(scored, key=lambda sc: sign * sc[0])
+            best = Recommendation(candidate, score, depth)
+        return best
+
+    def _score_after(self, player, candidate, score):
+        self._play(player, candidate)
+        try:
+            return score()
+        finally:
+            self._undo(player, candidate)
+
+def recommend(candidates, teams, time_budget=0.08, team_size=TEAM_SIZE, max_per_role=MAX_PER_ROLE):
+    """Best next pick given available Candidates and both teams' (specialty, speed) picks.
+
+    The score is from Player 1's view (positive favours Player 1).
+    """
+    return DraftSearch(candidates, teams, team_size, max_per_role).best_pick(time_budget)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time draft advisor queries on a synthetic roster")
+    parser.add_argument("--roster-size", type=int, default=500, help="characters in the roster")
+    parser.add_argument("--budget", type=float, default=0.08, help="seconds per query")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pool = [Candidate(i, f"C{i}", rng.choice(ROLES), rng.randint(85, 115)) for i in range(args.roster_size)]
+    teams = [[], []]
+    for _ in range(2 * TEAM_SIZE):
+        start = time.perf_counter()
+        pick = recommend(pool, teams, args.budget)
+        elapsed = time.perf_counter() - start
+        player = 0 if len(teams[0]) < TEAM_SIZE else 1
+        print(f"Player {player + 1} takes {pick.candidate.name} ({pick.candidate.specialty}, "
+              f"speed {pick.candidate.speed}): score {pick.score:+.3f}, depth {pick.depth}, {elapsed * 1000:.1f} ms")
+        teams[player].append((pick.candidate.specialty, pick.candidate.speed))
+        pool.remove(pick.candidate)
+
+if __name__ == "__main__":
+    main()
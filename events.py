@@ -0,0 +1,121 @@
+"""Combat event bus: every action and production grant of a battle, in order.
+
+Publishers (battle_engine.step, the Streamlit app, replay.LogState) call
+EventBus.publish(); the entry is stored in a fixed-capacity ring buffer
+and handed to every subscriber (running stats, analytics, ...) as it
+happens. Readers that poll, like the app's combat log panel, keep a
+sequence cursor and ask for the entries after it with since().
+
+Entries hold names and numbers only, never the units themselves, so a
+match's log costs at most EVENT_LOG_CAPACITY small tuples however long the
+battle runs and keeps no defeated unit alive.
+"""
+from collections import namedtuple
+
+EVENT_LOG_CAPACITY = 256  # Entries kept per match; older ones are overwritten
+
+# kind: damage, heal, a status effect (battle_engine.STATUS_EFFECTS), attack,
+# skip or production. actor is the acting waifu's name (the player's name for
+# production); ability and target are None when the action had none.
+LogEntry = namedtuple("LogEntry", ["seq", "turn", "player_idx", "kind", "actor", "ability", "target", "amount"])
+
+class EventRing:
+    """Fixed-capacity ring buffer of entries numbered by a running sequence"""
+    __slots__ = ("slots", "next_seq")
+
+    def __init__(self, capacity=EVENT_LOG_CAPACITY):
+        self.slots = [None] * capacity
+        self.next_seq = 0  # Sequence number of the next entry
+
+    def append(self, entry):
+        self.slots[self.next_seq % len(self.slots)] = entry
+        self.next_seq += 1
+
+    def since(self, seq):
+        """(entries after the first `seq`, number of those already overwritten)"""
+        first = max(seq, self.next_seq - len(self.slots))
+        capacity = len(self.slots)
+        return [self.slots[i % capacity] for i in range(first, self.next_seq)], first - seq
+
+    def __len__(self):
+        return min(self.next_seq, len(self.slots))
+
+    def __iter__(self):
+        return iter(self.since(0)[0])
+
+class EventBus:
+    """Publishes combat events to subscribers and keeps the latest in a ring"""
+
+    def __init__(self, capacity=EVENT_LOG_CAPACITY):
+        self.ring = EventRing(capacity)
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """Call `callback(entry)` for every entry published from now on"""
+        self.subscribers.append(callback)
+
+    def publish(self, turn, player_idx, event):
+        """Record a battle_engine.Event; returns its LogEntry"""
+        entry = LogEntry(
+            self.ring.next_seq, turn, player_idx, event.kind, event.actor.name,
+            event.ability.name if event.ability is not None else None,
+            event.target.name if event.target is not None else None,
+            event.amount,
+        )
+        self.ring.append(entry)
+        for callback in self.subscribers:
+            callback(entry)
+        return entry
+
+    def since(self, seq):
+        return self.ring.since(seq)
+
+    @property
+    def next_seq(self):
+        return self.ring.next_seq
+
+def describe_entry(entry):
+    """Human-readable combat message for a log entry"""
+    if entry.kind == "damage" and entry.target:
+        return f"💥 {entry.actor} used {entry.ability}! {entry.target} takes {entry.amount} damage!"
+    if entry.kind == "heal" and entry.target:
+        return f"💚 {entry.actor} used {entry.ability}! {entry.target} heals {entry.amount} HP!"
+    if entry.kind == "heal":
+        return f"💚 {entry.actor} used {entry.ability}, but nobody needed healing."
+    if entry.kind == "attack_up":
+        return f"🔥 {entry.actor} used {entry.ability}! Allies deal +{entry.amount}% damage!"
+    if entry.kind == "shield":
+        return f"🛡️ {entry.actor} used {entry.ability}! Allies block {entry.amount} damage per hit!"
+    if entry.kind == "speed_up":
+        return f"💨 {entry.actor} used {entry.ability}! Allies gain {entry.amount} speed!"
+    if entry.kind == "production_up":
+        return f"🏗️ {entry.actor} used {entry.ability}! +{entry.amount} production per turn!"
+    if entry.kind == "attack" and entry.target:
+        return f"⚔️ {entry.actor} attacks {entry.target} for {entry.amount} damage!"
+    if entry.kind == "attack":
+        return f"⚔️ {entry.actor} attacks, but no enemy is left standing."
+    if entry.kind == "production":
+        return f"💰 {entry.actor} generated {entry.amount} production points!"
+    if entry.kind == "skip":
+        return f"⏭️ {entry.actor} skips the turn."
+    return f"{entry.actor} used {entry.ability}, but it had no target."
+
+class CombatStats:
+    """Running per-player totals; subscribe `record` to an EventBus"""
+
+    def __init__(self, players=2):
+        self.damage = [0] * players
+        self.healing = [0] * players
+        self.production = [0] * players
+        self.actions = [0] * players
+
+    def record(self, entry):
+        if entry.kind == "production":
+            self.production[entry.player_idx] += entry.amount
+            return
+        self.actions[entry.player_idx] += 1
+        if entry.target is not None:
+            if entry.kind == "heal":
+                self.healing[entry.player_idx] += entry.amount
+            else:
+                self.damage[entry.player_idx] += entry.amount
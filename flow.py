@@ -0,0 +1,65 @@
+"""Game flow of the Streamlit app as an explicit state machine.
+
+Streamlit reruns the whole script on every interaction, so anything done
+while rendering a screen is repeated on each rerun. GameFlow keeps side
+effects out of rendering:
+
+- A session moves between phases only along TRANSITIONS. The caller's
+  side effects for a transition (grid setup, turn order, starting the
+  replay log, ...) run when the transition is taken. Asking for the
+  phase the session is already in is a no-op, so a repeated request does
+  not set the battle up twice.
+- Per-turn side effects, like granting production points, go through
+  once() keyed on the battle's turn id, so reruns of the same turn skip
+  them.
+"""
+
+PHASES = ("start", "team_selection", "battle_setup", "battle", "replay", "large_battle", "spectate")
+
+# phase -> phases reachable from it. start -> battle resumes a stored match;
+# team_selection -> battle is an online match, set up by the match server.
+TRANSITIONS = {
+    "start": ("team_selection", "battle", "large_battle", "spectate"),
+    "team_selection": ("battle_setup", "battle"),
+    "battle_setup": ("battle",),
+    "battle": ("replay",),
+    "replay": ("battle",),
+    "large_battle": (),
+    "spectate": (),
+}
+
+class GameFlow:
+    """Current phase and battle turn of one session, and which per-turn effects have run"""
+    __slots__ = ("phase", "turn", "_done")
+
+    def __init__(self, phase="start"):
+        self.phase = phase
+        self.turn = 0  # Actions taken in the current battle; the turn id of per-turn effects
+        self._done = {}  # effect name -> turn id it last ran for
+
+    def transition(self, phase, enter=None):
+        """Move to `phase`, calling `enter()` first; False if the session is already there"""
+        if phase == self.phase:
+            return False
+        if phase not in TRANSITIONS[self.phase]:
+            raise ValueError(f"Cannot go from {self.phase} to {phase}")
+        if enter is not None:
+            enter()
+        self.phase = phase
+        return True
+
+    def once(self, effect, fn, *args):
+        """Call `fn(*args)` unless `effect` already ran this turn; returns whether it ran"""
+        if self._done.get(effect) == self.turn:
+            return False
+        self._done[effect] = self.turn
+        fn(*args)
+        return True
+
+    def mark_done(self, effect):
+        """Record `effect` as already applied this turn (e.g. restored from a replay log)"""
+        self._done[effect] = self.turn
+
+    def end_turn(self):
+        """Advance the turn id; per-turn effects become due again"""
+        self.turn += 1
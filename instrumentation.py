@@ -0,0 +1,310 @@
+"""Opt-in per-rerun instrumentation for the Streamlit app.
+
+Enabled by the WAIFU_METRICS environment variable, a comma-separated list
+of sinks:
+
+    file        JSON line per rerun in a rotating file (WAIFU_METRICS_FILE,
+                default metrics/reruns.jsonl)
+    prometheus  histograms in Prometheus text format on
+                http://localhost:WAIFU_METRICS_PORT/metrics (default 9464)
+
+Each rerun records its game phase, wall time, time spent in instrumented
+functions (spans), Streamlit elements emitted and bytes sent, and the
+change in allocated memory blocks. Pickling the whole session state is
+too slow to do on every rerun, so its size is recorded every
+WAIFU_METRICS_STATE_EVERY reruns (default 20) and is null in the others.
+WAIFU_METRICS_TRACEMALLOC=1 also records the peak traced memory of the
+rerun (tracemalloc is process-wide, so concurrent sessions share it).
+
+Elements and bytes are counted by wrapping the private `_enqueue` callback
+of Streamlit's script run context. On a Streamlit version without it
+they are recorded as null, and everything else is still measured.
+
+When WAIFU_METRICS is unset, `instrumented` returns functions unchanged and
+`rerun_metrics` does nothing.
+
+Usage: python instrumentation.py metrics/reruns.jsonl  (p50/p99 per phase)
+"""
+import argparse
+import glob
+import itertools
+import json
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+import tracemalloc
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+SINKS = {sink.strip() for sink in os.environ.get("WAIFU_METRICS", "").split(",") if sink.strip()}
+ENABLED = bool(SINKS)
+METRICS_FILE = os.environ.get("WAIFU_METRICS_FILE", os.path.join("metrics", "reruns.jsonl"))
+METRICS_PORT = int(os.environ.get("WAIFU_METRICS_PORT", "9464"))
+TRACE_ALLOCATIONS = os.environ.get("WAIFU_METRICS_TRACEMALLOC") == "1"
+STATE_EVERY = max(1, int(os.environ.get("WAIFU_METRICS_STATE_EVERY", "20")))  # Reruns per session-state size sample
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+class Histogram:
+    """Cumulative-bucket histogram per label value, as Prometheus expects"""
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self.series = {}  # label value -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, label_value, value):
+        series = self.series.setdefault(label_value, [0] * (len(self.buckets) + 2))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, series in sorted(self.series.items()):
+            label = f'{self.label}="{label_value}"'
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_count{{{label}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{label}}} {series[-1]:g}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {
+            "rerun": Histogram("waifu_rerun_seconds", "Wall time of a script rerun", "phase", LATENCY_BUCKETS),
+            "span": Histogram("waifu_span_seconds", "Wall time inside an instrumented function", "span",
+                              LATENCY_BUCKETS),
+            "elements": Histogram("waifu_rerun_elements", "Streamlit elements emitted per rerun", "phase",
+                                  COUNT_BUCKETS),
+            "sent": Histogram("waifu_rerun_sent_bytes", "Bytes of messages sent to the browser per rerun", "phase",
+                              BYTES_BUCKETS),
+            "state": Histogram("waifu_session_state_bytes", "Pickled session state size after a rerun", "phase",
+                               BYTES_BUCKETS),
+            "blocks": Histogram("waifu_rerun_allocated_blocks", "Change in allocated memory blocks per rerun",
+                                "phase", COUNT_BUCKETS),
+            "peak": Histogram("waifu_rerun_peak_traced_bytes", "Peak traced memory during a rerun", "phase",
+                              BYTES_BUCKETS),
+        }
+
+    def record(self, sample):
+        with self.lock:
+            phase = sample["phase"]
+            self.histograms["rerun"].observe(phase, sample["seconds"])
+            for name, seconds in sample["spans"].items():
+                self.histograms["span"].observe(name, seconds)
+            if sample["elements"] is not None:
+                self.histograms["elements"].observe(phase, sample["elements"])
+                self.histograms["sent"].observe(phase, sample["sent_bytes"])
+            if sample["state_bytes"] is not None:
+                self.histograms["state"].observe(phase, sample["state_bytes"])
+            self.histograms["blocks"].observe(phase, max(0, sample["allocated_blocks"]))
+            if sample.get("peak_traced_bytes") is not None:
+                self.histograms["peak"].observe(phase, sample["peak_traced_bytes"])
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for histogram in self.histograms.values():
+                if histogram.series:
+                    lines.extend(histogram.render())
+            return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+_local = threading.local()
+_setup_lock = threading.Lock()
+_file_log = None
+_server = None
+_reruns = itertools.count()
+
+def _start_sinks():
+    """Open the rotating file and start the metrics endpoint, once per process"""
+    global _file_log, _server
+    with _setup_lock:
+        if "file" in SINKS and _file_log is None:
+            os.makedirs(os.path.dirname(METRICS_FILE) or ".", exist_ok=True)
+            handler = RotatingFileHandler(METRICS_FILE, maxBytes=5 * 1024 * 1024, backupCount=5)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _file_log = logging.getLogger("waifu.metrics")
+            _file_log.propagate = False
+            _file_log.setLevel(logging.INFO)
+            _file_log.addHandler(handler)
+        if "prometheus" in SINKS and _server is None:
+            _server = ThreadingHTTPServer(("127.0.0.1", METRICS_PORT), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="waifu-metrics", daemon=True).start()
+        if TRACE_ALLOCATIONS and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def instrumented(fn):
+    """Record the wall time of `fn` as a span of the current rerun"""
+    if not ENABLED:
+        return fn
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        rerun = getattr(_local, "rerun", None)
+        if rerun is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            rerun.spans[fn.__name__] = rerun.spans.get(fn.__name__, 0.0) + time.perf_counter() - start
+    return wrapper
+
+def _state_size(session_state):
+    """Pickled size of the picklable session-state values"""
+    total = 0
+    for key in list(session_state.keys()):
+        try:
+            total += len(pickle.dumps(session_state[key], pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            continue
+    return total
+
+class _NullRerun:
+    phase = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class RerunMetrics:
+    """Context manager around one script run; set `.phase` once it is known"""
+
+    def __init__(self, session_state):
+        self.session_state = session_state
+        self.phase = "start"
+        self.spans = {}
+        self.elements = 0
+        self.sent_bytes = 0
+        self._ctx = None
+        self._enqueue = None
+
+    def _count(self, msg):
+        if msg.HasField("delta") and msg.delta.HasField("new_element"):
+            self.elements += 1
+        self.sent_bytes += msg.ByteSize()
+        self._enqueue(msg)
+
+    def __enter__(self):
+        _start_sinks()
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        self._ctx = get_script_run_ctx()
+        # Every emitted element passes through the context's (private) enqueue callback
+        self._enqueue = getattr(self._ctx, "_enqueue", None)
+        if self._enqueue is not None:
+            self._ctx._enqueue = self._count
+        else:
+            self.elements = self.sent_bytes = None
+        _local.rerun = self
+        if TRACE_ALLOCATIONS:
+            tracemalloc.reset_peak()
+        self._blocks = sys.getallocatedblocks()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        _local.rerun = None
+        if self._enqueue is not None:
+            self._ctx._enqueue = self._enqueue
+        sample = {
+            "time": time.time(),
+            "phase": self.phase,
+            "seconds": seconds,
+            "spans": self.spans,
+            "elements": self.elements,
+            "sent_bytes": self.sent_bytes,
+            "state_bytes": _state_size(self.session_state) if next(_reruns) % STATE_EVERY == 0 else None,
+            "allocated_blocks": sys.getallocatedblocks() - self._blocks,
+            # st.rerun() ends a run early by raising; those runs are marked
+            "interrupted": exc[0] is not None,
+        }
+        if TRACE_ALLOCATIONS:
+            sample["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        REGISTRY.record(sample)
+        if _file_log is not None:
+            _file_log.info(json.dumps(sample))
+        return False
+
+def rerun_metrics(session_state):
+    """Instrument one rerun of the app or of a fragment (a no-op unless WAIFU_METRICS is set).
+
+    Nested uses, e.g. a fragment rendered inside a full rerun, belong to the outer rerun.
+    """
+    if not ENABLED or getattr(_local, "rerun", None) is not None:
+        return _NullRerun()
+    return RerunMetrics(session_state)
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def median_of(samples, key):
+    """Median of a sample field over the samples that recorded it, or None"""
+    values = [s[key] for s in samples if s.get(key) is not None]
+    return percentile(values, 0.5) if values else None
+
+def _column(value, width, scale):
+    return f"{'-':>{width}}" if value is None else f"{value / scale:>{width}.{0 if scale == 1 else 1}f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize rerun metrics per game phase")
+    parser.add_argument("path", nargs="?", default=METRICS_FILE, help="metrics file (rotated files are included)")
+    args = parser.parse_args()
+
+    by_phase = {}
+    spans = {}
+    for path in sorted(glob.glob(args.path + "*")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                sample = json.loads(line)
+                by_phase.setdefault(sample["phase"], []).append(sample)
+                for name, seconds in sample["spans"].items():
+                    spans.setdefault(name, []).append(seconds)
+
+    print(f"{'phase':<16} {'reruns':>7} {'p50 ms':>8} {'p99 ms':>8} {'elements':>9} {'sent KB':>8} {'state KB':>9}")
+    for phase, samples in sorted(by_phase.items()):
+        seconds = [s["seconds"] * 1000 for s in samples]
+        elements = median_of(samples, "elements")
+        sent = median_of(samples, "sent_bytes")
+        state = median_of(samples, "state_bytes")
+        print(f"{phase:<16} {len(samples):>7} {percentile(seconds, 0.5):>8.1f} {percentile(seconds, 0.99):>8.1f} "
+              f"{_column(elements, 9, 1)} {_column(sent, 8, 1024)} {_column(state, 9, 1024)}")
+    print(f"\n{'span':<24} {'calls':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, values in sorted(spans.items()):
+        ms = [v * 1000 for v in values]
+        print(f"{name:<24} {len(ms):>7} {percentile(ms, 0.5):>8.2f} {percentile(ms, 0.99):>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Elo ladder: finished match results, player ratings and character stats in SQLite.
+
+record() queues a result and returns immediately; a background thread
+writes queued results in batched transactions, as storage.MatchStore does
+for saves. Results are keyed by match token, so recording a match twice
+(a redrawn results screen, a finished match resumed from its URL) counts
+it once.
+
+Ratings are updated incrementally: the writer keeps the ratings it has
+seen in memory, applies the Elo update of each new result in order and
+writes every touched row once per batch. Reads never aggregate over the
+results table; they are served from tables kept current by the writer:
+
+    players            rating, games and wins per player, indexed by rating
+    characters         picks and wins per character
+    character_players  picks and wins per (character, player), indexed by
+                       (character, wins) for a character's top players
+    totals             running match count
+
+so the leaderboard is an index range scan however many matches are stored.
+
+Usage: python ladder.py [ladder.db] --top 20
+       python ladder.py --bench 1000000   (record random results, then time the queries)
+"""
+import argparse
+import logging
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from battle_engine import ROSTER, TEAM_SIZE
+
+DB_PATH = os.environ.get("WAIFU_LADDER_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ladder.db"))
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0  # Most rating points one match can move
+BATCH_WINDOW = 0.05  # Seconds the writer waits to batch more results into one transaction
+BATCH_SIZE = 512
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    token TEXT PRIMARY KEY,
+    winner TEXT NOT NULL,
+    loser TEXT NOT NULL,
+    finished REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS players_by_rating ON players (rating DESC);
+CREATE TABLE IF NOT EXISTS characters (
+    name TEXT PRIMARY KEY,
+    picks INTEGER NOT NULL,
+    wins INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS character_players (
+    character TEXT NOT NULL,
+    player TEXT NOT NULL,
+    picks INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    PRIMARY KEY (character, player)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS character_players_by_wins ON character_players (character, wins DESC);
+CREATE TABLE IF NOT EXISTS totals (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO totals VALUES ('matches', 0);
+"""
+
+# Teams are tuples of character (roster) names
+MatchResult = namedtuple("MatchResult", ["token", "winner", "loser", "winner_team", "loser_team", "finished"])
+Standing = namedtuple("Standing", ["name", "rating", "games", "wins"])
+CharacterStats = namedtuple("CharacterStats", ["name", "picks", "wins", "pick_rate", "win_rate"])
+
+log = logging.getLogger(__name__)
+
+def expected_score(rating, opponent):
+    """Probability that a player rated `rating` beats one rated `opponent`"""
+    return 1.0 / (1.0 + 10.0 ** ((opponent - rating) / 400.0))
+
+def elo_update(winner_rating, loser_rating, k=K_FACTOR):
+    """New (winner, loser) ratings after one match"""
+    change = k * (1.0 - expected_score(winner_rating, loser_rating))
+    return winner_rating + change, loser_rating - change
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MiB: the per-character rows of a busy ladder stay cached
+    conn.executescript(SCHEMA)
+    return conn
+
+class Ladder:
+    """Ladder with a background writer; share one per process"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._read = connect(path)
+        self._read_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._ratings = {}  # Writer thread only: player -> current rating
+        self._writer = threading.Thread(target=self._write_loop, name="ladder", daemon=True)
+        self._writer.start()
+
+    def record(self, result):
+        """Queue a MatchResult; returns immediately"""
+        self._queue.put(result)
+
+    def leaderboard(self, limit=10, offset=0):
+        """Standings by rating, best first"""
+        with self._read_lock:
+            rows = self._read.execute("SELECT name, rating, games, wins FROM players "
+                                      "ORDER BY rating DESC LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        return [Standing(*row) for row in rows]
+
+    def standing(self, name):
+        """Standing of one player, or None if they have no recorded match"""
+        with self._read_lock:
+            row = self._read.execute("SELECT name, rating, games, wins FROM players WHERE name = ?",
+                                     (name,)).fetchone()
+        return Standing(*row) if row is not None else None
+
+    def characters(self):
+        """CharacterStats of every picked character, best win rate first"""
+        with self._read_lock:
+            matches = self._read.execute("SELECT value FROM totals WHERE key = 'matches'").fetchone()[0]
+            rows = self._read.execute("SELECT name, picks, wins FROM characters").fetchall()
+        stats = [CharacterStats(name, picks, wins, picks / max(matches, 1), wins / picks)
+                 for name, picks, wins in rows]
+        return sorted(stats, key=lambda s: s.win_rate, reverse=True)
+
+    def top_players(self, character, limit=10):
+        """(player, picks, wins) of the players with the most wins using `character`"""
+        with self._read_lock:
+            return self._read.execute("SELECT player, picks, wins FROM character_players WHERE character = ? "
+                                      "ORDER BY wins DESC LIMIT ?", (character, limit)).fetchall()
+
+    def matches(self):
+        """Number of recorded matches"""
+        with self._read_lock:
+            return self._read.execute("SELECT value FROM totals WHERE key = 'matches'").fetchone()[0]
+
+    def flush(self):
+        """Block until every queued result is written"""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._read.close()
+
+    def _write_loop(self):
+        conn = connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + BATCH_WINDOW
+            while batch[-1] is not None and len(batch) < BATCH_SIZE:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            results = [item for item in batch if item is not None]
+            try:
+                if results:
+                    with conn:
+                        self._apply(conn, results)
+            except sqlite3.Error:
+                log.exception("Failed to record %d match result(s)", len(results))
+                self._ratings.clear()  # The batch was rolled back; reload ratings from the database
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if batch[-1] is None:
+                conn.close()
+                return
+
+    def _apply(self, conn, results):
+        """Write one batch: new results only, every touched row once"""
+        tokens = [result.token for result in results]
+        placeholders = ",".join("?" * len(tokens))
+        seen = {row[0] for row in conn.execute(f"SELECT token FROM results WHERE token IN ({placeholders})", tokens)}
+        fresh = []
+        for result in results:
+            if result.token not in seen:
+                seen.add(result.token)
+                fresh.append(result)
+        if not fresh:
+            return
+
+        names = {name for result in fresh for name in (result.winner, result.loser)} - self._ratings.keys()
+        if names:
+            placeholders = ",".join("?" * len(names))
+            self._ratings.update(conn.execute(f"SELECT name, rating FROM players WHERE name IN ({placeholders})",
+                                              list(names)))
+        ratings = self._ratings
+        players = {}  # name -> [games, wins]
+        characters = {}  # name -> [picks, wins]
+        character_players = {}  # (character, player) -> [picks, wins]
+        for result in fresh:
+            ratings[result.winner], ratings[result.loser] = elo_update(
+                ratings.get(result.winner, INITIAL_RATING), ratings.get(result.loser, INITIAL_RATING))
+            for player, team, won in ((result.winner, result.winner_team, 1), (result.loser, result.loser_team, 0)):
+                counts = players.setdefault(player, [0, 0])
+                counts[0] += 1
+                counts[1] += won
+                for character in team:
+                    counts = characters.setdefault(character, [0, 0])
+                    counts[0] += 1
+                    counts[1] += won
+                    counts = character_players.setdefault((character, player), [0, 0])
+                    counts[0] += 1
+                    counts[1] += won
+
+        conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?)",
+                         [(r.token, r.winner, r.loser, r.finished) for r in fresh])
+        conn.executemany("INSERT INTO players VALUES (?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+                         "rating = excluded.rating, games = games + excluded.games, wins = wins + excluded.wins",
+                         [(name, ratings[name], games, wins) for name, (games, wins) in players.items()])
+        conn.executemany("INSERT INTO characters VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+                         "picks = picks + excluded.picks, wins = wins + excluded.wins",
+                         [(name, picks, wins) for name, (picks, wins) in characters.items()])
+        conn.executemany("INSERT INTO character_players VALUES (?, ?, ?, ?) ON CONFLICT (character, player) "
+                         "DO UPDATE SET picks = picks + excluded.picks, wins = wins + excluded.wins",
+                         [(c, p, picks, wins) for (c, p), (picks, wins) in character_players.items()])
+        conn.execute("UPDATE totals SET value = value + ? WHERE key = 'matches'", (len(fresh),))
+
+def _bench(count, players, seed):
+    """Record `count` random results into a scratch database, then time the read queries"""
+    rng = random.Random(seed)
+    names = [f"player{i}" for i in range(players)]
+    roster = [name for name, _ in ROSTER]
+    with tempfile.TemporaryDirectory() as tmp:
+        ladder = Ladder(os.path.join(tmp, "ladder.db"))
+        start = time.perf_counter()
+        for i in range(count):
+            winner, loser = rng.sample(names, 2)
+            teams = rng.sample(roster, 2 * TEAM_SIZE)
+            ladder.record(MatchResult(f"bench{i}", winner, loser, tuple(teams[:TEAM_SIZE]),
+                                      tuple(teams[TEAM_SIZE:]), time.time()))
+        ladder.flush()
+        elapsed = time.perf_counter() - start
+        print(f"{count:,} results in {elapsed:.1f}s ({count / elapsed:,.0f}/s), {ladder.matches():,} recorded")
+
+        for label, query in (("leaderboard top 20", lambda: ladder.leaderboard(20)),
+                             ("leaderboard page 50", lambda: ladder.leaderboard(20, 1000)),
+                             ("top players of a character", lambda: ladder.top_players(roster[0])),
+                             ("character table", ladder.characters)):
+            times = []
+            for _ in range(50):
+                start = time.perf_counter()
+                query()
+                times.append(time.perf_counter() - start)
+            times.sort()
+            print(f"{label:<28} p50 {times[25] * 1000:.2f} ms  p99 {times[-1] * 1000:.2f} ms")
+        ladder.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the ladder, or benchmark it")
+    parser.add_argument("path", nargs="?", default=DB_PATH, help="ladder database")
+    parser.add_argument("--top", type=int, default=20, help="standings to list")
+    parser.add_argument("--bench", type=int, default=0, metavar="RESULTS",
+                        help="record this many random results into a scratch database and time the queries")
+    parser.add_argument("--players", type=int, default=10000, help="distinct players in the benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.bench:
+        _bench(args.bench, args.players, args.seed)
+        return
+
+    ladder = Ladder(args.path)
+    print(f"{ladder.matches():,} matches")
+    for rank, standing in enumerate(ladder.leaderboard(args.top), 1):
+        print(f"{rank:>4}. {standing.name:<24} {standing.rating:7.1f}  {standing.wins}/{standing.games} won")
+    ladder.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+"""Authoritative match server for networked two-player games.
+
+The server owns every match: the draft (each pick is claimed here, first
+come first served), the combat RNG and the battle itself. Clients submit
+picks and actions and receive the battle as replay-log deltas (see
+replay.py), i.e. the bytes appended since the client's cursor, which they
+apply to their own LogState. Production is granted by the server when a
+turn begins, so client reruns cannot grant it twice.
+
+Protocol: newline-delimited JSON over TCP, one response per request.
+
+    {"op": "create"}                                    -> match, seat, token, seed
+    {"op": "join", "match"}                             -> seat, token, seed
+    {"op": "pick", "match", "token", "character"}       -> sync payload
+    {"op": "act", "match", "token", "turn", "action"}   -> sync payload
+    {"op": "sync", "match", "token", "cursor", "version", "wait"} -> sync payload
+
+A sync with `wait` is held until the match changes (long poll). Failures
+come back as {"ok": false, "error": ...}. LocalMatchServer runs the same
+server on a background event loop in this process, for tests and
+single-process deployments.
+
+Usage:
+    python match_server.py --port 8765
+    python match_server.py --bench 2000   (concurrent random matches over localhost)
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import random
+import secrets
+import socket
+import threading
+import time
+from functools import partial
+
+from battle_engine import MAX_PER_ROLE, ROLES, TEAM_SIZE, BattleState, Player, match_rng, step
+from catalog import RosterOverlay, build_catalog
+from events import CombatStats, EventBus
+from replay import LogState, ReplayWriter, load_replay
+
+MAX_WAIT = 10.0  # Longest a sync may be held, in seconds
+MATCH_TTL = 3600  # Idle seconds before a match is dropped
+CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # No 0/O or 1/I
+CODE_LENGTH = 6
+
+class MatchError(Exception):
+    """A request the server rejected"""
+
+class Match:
+    """Authoritative state of one networked match"""
+
+    def __init__(self, code, seed, catalog):
+        self.code = code
+        self.seed = seed  # Shared with clients: it decides the roster's speeds
+        # Combat rolls come from a seed the clients never see, so they cannot be predicted
+        self.combat_rng = match_rng(random.SystemRandom().getrandbits(63), "combat")
+        self.roster = RosterOverlay(catalog, match_rng(seed, "setup"))
+        self.tokens = [secrets.token_urlsafe(12), None]
+        self.players = [Player("Player 1"), Player("Player 2")]
+        self.picks = [[], []]
+        self.role_counts = [{role: 0 for role in ROLES} for _ in range(2)]
+        self.log = ReplayWriter()
+        self.state = None  # BattleState once both teams are complete
+        self.version = 0
+        self.changed = asyncio.Event()
+        self.touched = time.monotonic()
+
+    def seat(self, token):
+        if token is None or token not in self.tokens:
+            raise MatchError("Not a player in this match")
+        return self.tokens.index(token)
+
+    def notify(self):
+        """Bump the version and wake every held sync"""
+        self.version += 1
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def pick(self, seat, character_id):
+        if character_id in self.picks[seat]:
+            return  # A retried request
+        if self.state is not None:
+            raise MatchError("The draft is over")
+        if not 0 <= character_id < len(self.roster.catalog):
+            raise MatchError("Unknown character")
+        if len(self.picks[seat]) >= TEAM_SIZE:
+            raise MatchError("Your team is full")
+        if character_id in self.roster.taken:
+            raise MatchError("Already picked by your opponent")
+        specialty = self.roster.catalog.characters[character_id].specialty
+        if self.role_counts[seat][specialty] >= MAX_PER_ROLE:
+            raise MatchError(f"Max {MAX_PER_ROLE} per role")
+
+        self.players[seat].add_waifu(self.roster.take(character_id))
+        self.picks[seat].append(character_id)
+        self.role_counts[seat][specialty] += 1
+        if all(len(picks) == TEAM_SIZE for picks in self.picks):
+            self.log.start(self.seed, self.players)
+            self.state = BattleState(self.players, self.combat_rng, recorder=self.log)
+        self.notify()
+
+    def act(self, seat, turn, action):
+        if self.state is None:
+            raise MatchError("The battle has not started")
+        if self.state.is_over():
+            raise MatchError("The battle is over")
+        if turn != self.state.actions_taken:
+            raise MatchError("That turn has already been played")
+        if self.state.current_actor()[1] != seat:
+            raise MatchError("Not your turn")
+        if action not in self.state.legal_actions():
+            raise MatchError("Illegal action")
+        step(self.state, action)
+        self.notify()
+
+    def payload(self, cursor):
+        data = self.log.getvalue(cursor)
+        return {
+            "ok": True,
+            "version": self.version,
+            "joined": self.tokens[1] is not None,
+            "picks": self.picks,
+            "cursor": cursor + len(data),
+            "log": base64.b64encode(data).decode("ascii"),
+        }
+
+class MatchServer:
+    """Every live match of one process; all methods run on its event loop"""
+
+    def __init__(self, catalog=None, ttl=MATCH_TTL):
+        self.catalog = catalog or build_catalog()
+        self.ttl = ttl
+        self.matches = {}
+
+    async def handle(self, request):
+        """Response for one decoded request"""
+        try:
+            handler = self.OPS.get(request.get("op")) if isinstance(request, dict) else None
+            if handler is None:
+                raise MatchError("Unknown operation")
+            return await handler(self, request)
+        except MatchError as e:
+            return {"ok": False, "error": str(e)}
+        except (KeyError, TypeError, ValueError) as e:
+            return {"ok": False, "error": f"Bad request: {e!r}"}
+
+    def _match(self, request):
+        match = self.matches.get(request["match"])
+        if match is None:
+            raise MatchError("Unknown match")
+        match.touched = time.monotonic()
+        return match
+
+    def _cursor(self, request, match):
+        cursor = int(request.get("cursor", 0))
+        if not 0 <= cursor <= len(match.log.buffer):
+            raise MatchError("Bad cursor")
+        return cursor
+
+    async def create(self, request):
+        code = None
+        while code is None or code in self.matches:
+            code = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+        match = self.matches[code] = Match(code, random.SystemRandom().getrandbits(63), self.catalog)
+        return {"ok": True, "match": code, "seat": 0, "token": match.tokens[0], "seed": match.seed}
+
+    async def join(self, request):
+        match = self._match(request)
+        if match.tokens[1] is not None:
+            raise MatchError("Match is full")
+        match.tokens[1] = secrets.token_urlsafe(12)
+        match.notify()
+        return {"ok": True, "match": match.code, "seat": 1, "token": match.tokens[1], "seed": match.seed}
+
+    async def pick(self, request):
+        match = self._match(request)
+        cursor = self._cursor(request, match)
+        match.pick(match.seat(request["token"]), int(request["character"]))
+        return match.payload(cursor)
+
+    async def act(self, request):
+        match = self._match(request)
+        cursor = self._cursor(request, match)
+        action = request["action"]
+        match.act(match.seat(request["token"]), int(request["turn"]), action if isinstance(action, str) else int(action))
+        return match.payload(cursor)
+
+    async def sync(self, request):
+        match = self._match(request)
+        match.seat(request["token"])
+        cursor = self._cursor(request, match)
+        wait = min(float(request.get("wait", 0)), MAX_WAIT)
+        if wait > 0 and request.get("version") == match.version:
+            changed = match.changed
+            try:
+                await asyncio.wait_for(changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return match.payload(cursor)
+
+    OPS = {"create": create, "join": join, "pick": pick, "act": act, "sync": sync}
+
+    async def reap(self, interval=60):
+        """Drop matches nobody has touched for `ttl` seconds; runs forever"""
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.monotonic() - self.ttl
+            for code in [code for code, match in self.matches.items() if match.touched < cutoff]:
+                del self.matches[code]
+
+async def _serve_connection(server, reader, writer):
+    try:
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"ok": False, "error": "Malformed request"}
+            else:
+                response = await server.handle(request)
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve(server, host="127.0.0.1", port=8765):
+    """Listen for clients; returns the asyncio Server"""
+    asyncio.get_running_loop().create_task(server.reap())
+    return await asyncio.start_server(partial(_serve_connection, server), host, port)
+
+class MatchClient:
+    """Blocking TCP client; give each session its own, since requests on it are answered in order"""
+
+    def __init__(self, host, port, timeout=MAX_WAIT + 5):
+        self.address = (host, port)
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def request(self, op, **fields):
+        message = json.dumps({"op": op, **fields}).encode() + b"\n"
+        with self._lock:
+            # One reconnect: every operation is safe to repeat
+            for _ in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = socket.create_connection(self.address, self.timeout)
+                        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        self._file = self._sock.makefile("rb")
+                    self._sock.sendall(message)
+                    line = self._file.readline()
+                    if line:
+                        return json.loads(line)
+                except OSError:
+                    pass
+                self.close()
+        raise ConnectionError(f"Match server at {self.address[0]}:{self.address[1]} is unreachable")
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+class LocalMatchServer:
+    """MatchServer on a background event loop in this process"""
+
+    def __init__(self, catalog=None):
+        self.server = MatchServer(catalog)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="match-server", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.server.reap(), self.loop)
+
+    def client(self):
+        return LocalClient(self)
+
+class LocalClient:
+    """Same interface as MatchClient, without the network"""
+
+    def __init__(self, local):
+        self.local = local
+
+    def request(self, op, **fields):
+        request = json.loads(json.dumps({"op": op, **fields}))  # The same encoding as over the wire
+        return asyncio.run_coroutine_threadsafe(self.local.server.handle(request), self.local.loop).result()
+
+class OnlineMatch:
+    """One player's view of a networked match, kept in step with the server"""
+
+    def __init__(self, client, code, seat, token, seed):
+        self.client = client
+        self.code = code
+        self.seat = seat
+        self.token = token
+        self.seed = seed
+        self.version = None
+        self.joined = False
+        self.picks = [[], []]
+        self.cursor = 0
+        self.log = ReplayWriter()  # Everything received so far, for the replay screen
+        self.log_state = None  # LogState once the battle has started
+        self.events = EventBus()  # Every record received, for the combat log panel
+        self.stats = CombatStats()
+        self.events.subscribe(self.stats.record)
+
+    @classmethod
+    def create(cls, client):
+        response = _checked(client.request("create"))
+        return cls(client, response["match"], response["seat"], response["token"], response["seed"])
+
+    @classmethod
+    def join(cls, client, code):
+        response = _checked(client.request("join", match=code.strip().upper()))
+        return cls(client, response["match"], response["seat"], response["token"], response["seed"])
+
+    def sync(self, wait=0.0):
+        """Fetch changes, holding the request up to `wait` seconds for one; True if anything changed"""
+        return self.apply(self._request("sync", version=self.version, wait=wait))
+
+    def pick(self, character_id):
+        """Claim a character; raises MatchError if the server refuses"""
+        self.apply(self._request("pick", character=character_id))
+
+    def act(self, action):
+        """Play an action for this player's current unit; raises MatchError if the server refuses"""
+        self.apply(self._request("act", turn=self.log_state.actions_taken, action=action))
+
+    def _request(self, op, **fields):
+        return self.client.request(op, match=self.code, token=self.token, cursor=self.cursor, **fields)
+
+    def apply(self, response):
+        """Take in a sync payload; True if the match changed since the last one"""
+        _checked(response)
+        changed = response["version"] != self.version
+        self.version = response["version"]
+        self.joined = response["joined"]
+        self.picks = response["picks"]
+        data = base64.b64decode(response["log"])
+        if data:
+            self.log.extend(data)
+            if self.log_state is None:
+                replay = load_replay(self.log.getvalue())
+                self.log_state = LogState(replay.units, self.events)
+                for record in replay.actions:
+                    self.log_state.apply(record)
+            else:
+                self.log_state.extend(data)
+            self.cursor = response["cursor"]
+        return changed
+
+    @property
+    def opponent_picks(self):
+        return self.picks[1 - self.seat]
+
+    def state(self):
+        """BattleState as of the last sync, or None before the battle starts"""
+        return self.log_state.state() if self.log_state is not None else None
+
+def _checked(response):
+    if not response["ok"]:
+        raise MatchError(response["error"])
+    return response
+
+async def _bench_player(host, port, code, creator, catalog, rng, latencies, think, max_actions, ramp):
+    """One random player over its own connection: draft, then play until the battle ends.
+
+    The creator publishes the match code through the `code` future; the other player awaits it.
+    Before each action the player thinks for up to 2 * `think` seconds.
+    """
+    if creator:
+        await asyncio.sleep(rng.uniform(0, ramp))  # Matches arrive spread over `ramp` seconds
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def request(op, **fields):
+        writer.write(json.dumps({"op": op, **fields}).encode() + b"\n")
+        await writer.drain()
+        return json.loads(await reader.readline())
+
+    if creator:
+        response = _checked(await request("create"))
+        code.set_result(response["match"])
+    else:
+        response = _checked(await request("join", match=await code))
+    view = OnlineMatch(None, response["match"], response["seat"], response["token"], response["seed"])
+    fields = {"match": view.code, "token": view.token}
+
+    ids = list(range(len(catalog)))
+    rng.shuffle(ids)
+    while len(view.picks[view.seat]) < TEAM_SIZE:
+        mine = [catalog.characters[i].specialty for i in view.picks[view.seat]]
+        taken = set(view.picks[0] + view.picks[1])
+        choice = next(i for i in ids if i not in taken and mine.count(catalog.characters[i].specialty) < MAX_PER_ROLE)
+        response = await request("pick", character=choice, cursor=view.cursor, **fields)
+        if response["ok"]:
+            view.apply(response)
+        else:
+            view.apply(await request("sync", cursor=view.cursor, **fields))  # Lost a race; refresh picks
+
+    while True:
+        state = view.state()
+        if state is not None and (state.is_over() or state.actions_taken >= max_actions):
+            break
+        if state is not None and state.current_actor()[1] == view.seat:
+            await asyncio.sleep(rng.uniform(0, 2 * think))
+            start = time.perf_counter()
+            response = await request("act", turn=state.actions_taken, action=rng.choice(state.legal_actions()),
+                                     cursor=view.cursor, **fields)
+            latencies.append(time.perf_counter() - start)
+            view.apply(response)
+        else:
+            view.apply(await request("sync", cursor=view.cursor, version=view.version, wait=MAX_WAIT, **fields))
+    writer.close()
+    return view.code
+
+async def _bench(host, port, matches, seed, think, max_actions, ramp):
+    """Act round trips (seconds) and elapsed time of `matches` concurrent random matches"""
+    catalog = build_catalog()
+    rng = random.Random(seed)
+    latencies = []
+    players = []
+    for _ in range(matches):
+        code = asyncio.get_running_loop().create_future()
+        for creator in (True, False):
+            players.append(_bench_player(host, port, code, creator, catalog, random.Random(rng.random()), latencies,
+                                         think, max_actions, ramp))
+    start = time.perf_counter()
+    await asyncio.gather(*players)
+    return latencies, time.perf_counter() - start
+
+def _run_server(host, port):
+    async def main():
+        tcp = await serve(MatchServer(), host, port)
+        async with tcp:
+            await tcp.serve_forever()
+    asyncio.run(main())
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the match server, or load-test one")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--bench", type=int, default=0, metavar="MATCHES",
+                        help="start a server and play this many concurrent random matches against it")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds a bench player waits before acting")
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which bench matches start")
+    parser.add_argument("--max-actions", type=int, default=1000, help="bench matches stop after this many actions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.bench:
+        print(f"Match server listening on {args.host}:{args.port}")
+        _run_server(args.host, args.port)
+        return
+
+    server = multiprocessing.Process(target=_run_server, args=(args.host, args.port), daemon=True)
+    server.start()
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection((args.host, args.port), 1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        latencies, elapsed = asyncio.run(_bench(args.host, args.port, args.bench, args.seed, args.think,
+                                                   args.max_actions, args.ramp))
+    finally:
+        server.terminate()
+    latencies.sort()
+    print(f"{args.bench} concurrent matches, {len(latencies):,} actions in {elapsed:.1f}s "
+          f"({len(latencies) / elapsed:,.0f} actions/s)")
+    print(f"Act round trip: p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
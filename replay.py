@@ -0,0 +1,254 @@
+"""Compact binary replay log for battles.
+
+A log is a header, one setup record per unit (everything the seeded
+setup rolled) and an append-only stream of fixed-size action records:
+
+    turn (u32) | actor (u8) | action (u8) | target (u8) | delta (i16)
+
+Actors and targets are unit indices: player_idx * TEAM_SIZE + position in
+the player's pick order. Outcomes are logged rather than recomputed, so
+rebuild_state() needs no RNG and reproduces exactly what happened,
+including production grants, which get their own records. Status effects
+need no RNG either and are re-applied from the ability used.
+
+Usage: python replay.py replays/<seed>.wbr --turn 40
+"""
+import argparse
+import os
+import struct
+from collections import namedtuple
+
+from battle_engine import (
+    ABILITIES_PER_ROLE, BASIC_ATTACK, ROLES, SKIP_TURN, STATUS_EFFECTS, TEAM_SIZE, BattleState, Event, Player,
+    Waifu, arrange_grid, build_teams, build_timeline, expire_effects, finish_action, resolve_ability,
+)
+from status import StatusEffects
+
+REPLAY_DIR = os.environ.get("WAIFU_REPLAY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "replays"))
+
+MAGIC = b"WBRP"
+VERSION = 2  # 2: status effects (logs of version 1 were played without them)
+
+HEADER = struct.Struct("<4sBQB")  # magic, version, seed, unit count
+UNIT = struct.Struct("<B16sBB6B6B")  # player, name, specialty, speed, ability ids, ability values
+ACTION = struct.Struct("<IBBBh")  # turn, actor, action, target, delta
+
+# Action codes; ability codes are the ability index (0..ABILITIES_PER_ROLE-1)
+ATTACK = ABILITIES_PER_ROLE
+SKIP = ATTACK + 1
+PRODUCTION = SKIP + 1  # actor = first unit of the player, delta = points generated
+NO_TARGET = 255
+
+UnitRecord = namedtuple("UnitRecord", ["player_idx", "name", "specialty", "speed", "ability_ids", "ability_values"])
+ActionRecord = namedtuple("ActionRecord", ["turn", "actor", "action", "target", "delta"])
+Replay = namedtuple("Replay", ["seed", "units", "actions"])
+
+def action_code(action):
+    """Log code for an action accepted by battle_engine.step()"""
+    if action == BASIC_ATTACK:
+        return ATTACK
+    if action == SKIP_TURN:
+        return SKIP
+    return action
+
+class ReplayWriter:
+    """Appends a battle's records to memory and, optionally, to a file.
+
+    Pass it to BattleState as `recorder`, or call production()/action()
+    directly from code that resolves actions itself (the Streamlit app).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.buffer = bytearray()
+        self._units = {}  # waifu -> unit index
+
+    def start(self, seed, players):
+        """Write the header and setup records; call once before the first turn"""
+        units = []
+        for player_idx, player in enumerate(players):
+            for position, waifu in enumerate(player.waifus):
+                self._units[waifu] = player_idx * TEAM_SIZE + position
+                name = waifu.name.encode("utf-8")
+                if len(name) > 16:
+                    raise ValueError(f"Name too long for the replay log: {waifu.name}")
+                units.append(UNIT.pack(player_idx, name, ROLES.index(waifu.specialty), waifu.speed,
+                                       *waifu.ability_ids, *waifu.ability_values))
+        self._write(HEADER.pack(MAGIC, VERSION, seed, len(units)) + b"".join(units), "wb")
+
+    def production(self, turn, player_idx, generated):
+        self._write(ACTION.pack(turn, player_idx * TEAM_SIZE, PRODUCTION, NO_TARGET, generated))
+
+    def action(self, turn, waifu, player_idx, action, event=None):
+        """Record an action and its outcome (HP change of the target, if any)"""
+        target, delta = NO_TARGET, 0
+        if event is not None and event.target is not None:
+            target = self._units[event.target]
+            delta = event.amount if event.kind == "heal" else -event.amount
+        self._write(ACTION.pack(turn, self._units[waifu], action_code(action), target, delta))
+
+    @classmethod
+    def resume(cls, data, players, path=None):
+        """Writer that continues the log `data` for the players rebuilt from it"""
+        writer = cls(path)
+        for player_idx, player in enumerate(players):
+            for position, waifu in enumerate(player.waifus):
+                writer._units[waifu] = player_idx * TEAM_SIZE + position
+        writer._write(data, "wb")
+        return writer
+
+    def extend(self, data):
+        """Append records encoded elsewhere (e.g. received from a match server)"""
+        self._write(data)
+
+    def getvalue(self, start=0):
+        return bytes(self.buffer[start:])
+
+    def _write(self, data, mode="ab"):
+        self.buffer += data
+        if self.path is not None:
+            with open(self.path, mode) as f:
+                f.write(data)
+
+def replay_path(seed):
+    os.makedirs(REPLAY_DIR, exist_ok=True)
+    return os.path.join(REPLAY_DIR, f"{seed}.wbr")
+
+def load_replay(data):
+    """Parse a replay log (bytes) into a Replay"""
+    magic, version, seed, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a replay log (or an unsupported version)")
+    offset = HEADER.size
+    units = []
+    for _ in range(count):
+        fields = UNIT.unpack_from(data, offset)
+        player_idx, name, specialty, speed = fields[:4]
+        ids = fields[4:4 + len(ROLES) * ABILITIES_PER_ROLE]
+        values = fields[4 + len(ids):]
+        units.append(UnitRecord(player_idx, name.rstrip(b"\0").decode("utf-8"), ROLES[specialty], speed, ids, values))
+        offset += UNIT.size
+    # A partially written trailing record (e.g. a crash mid-append) is ignored
+    end = offset + (len(data) - offset) // ACTION.size * ACTION.size
+    actions = [ActionRecord(*fields) for fields in ACTION.iter_unpack(data[offset:end])]
+    return Replay(seed, units, actions)
+
+def _restore_waifu(unit):
+    waifu = Waifu.__new__(Waifu)
+    waifu.name = unit.name
+    waifu.specialty = unit.specialty
+    waifu.speed = unit.speed
+    waifu.ability_ids = tuple(unit.ability_ids)
+    waifu.ability_values = tuple(unit.ability_values)
+    waifu.current_position = None
+    waifu.hp = 100
+    waifu.max_hp = 100
+    waifu.power = 0
+    waifu.guard = 0
+    return waifu
+
+class LogState:
+    """Battle rebuilt from a replay log's setup records, advanced one action record at a time.
+
+    With an events.EventBus, every applied record is also published to it.
+    """
+
+    def __init__(self, units, events=None):
+        self.players = [Player(f"Player {i + 1}") for i in range(max(u.player_idx for u in units) + 1)]
+        self.units = {}
+        for unit in units:
+            waifu = _restore_waifu(unit)
+            self.units[unit.player_idx * TEAM_SIZE + len(self.players[unit.player_idx].waifus)] = waifu
+            self.players[unit.player_idx].add_waifu(waifu)
+        self.battle_grid = {f'player{i + 1}': arrange_grid(player.waifus) for i, player in enumerate(self.players)}
+        self.teams = build_teams(self.battle_grid)
+        self.turn_order = build_timeline(self.players)
+        self.actions_taken = 0
+        self.effects = StatusEffects()
+        self.rng = None  # Outcomes come from the log; resolve_ability is only used for status effects
+        self.events = events
+
+    def apply(self, record):
+        player_idx = record.actor // TEAM_SIZE
+        if record.action == PRODUCTION:
+            player = self.players[player_idx]
+            player.production_points += record.delta
+            if self.events is not None:
+                self.events.publish(record.turn, player_idx, Event("production", player, None, None, record.delta))
+            return
+
+        waifu = self.units[record.actor]
+        if self.turn_order.current() != (waifu, player_idx):
+            raise ValueError(f"Replay does not match the battle at turn {record.turn}")
+        self.actions_taken = record.turn
+        event = None
+        if record.action < ATTACK:
+            ability = waifu.get_ability(waifu.specialty, record.action)
+            self.players[player_idx].production_points -= ability.cost
+            if ability.effect in STATUS_EFFECTS:
+                event = resolve_ability(ability, waifu, player_idx, self)
+        if record.target != NO_TARGET:
+            target = self.units[record.target]
+            hp = min(target.max_hp, max(0, target.hp + record.delta))
+            self.teams[record.target // TEAM_SIZE].set_hp(target, hp)
+            event = Event("replay", waifu, None, target, abs(record.delta))
+        if self.events is not None:
+            self.events.publish(record.turn, player_idx, self._event(waifu, record, event))
+        finish_action(self.turn_order, event)
+        self.actions_taken = record.turn + 1
+        expire_effects(self.effects, self.actions_taken, self.turn_order)
+
+    @staticmethod
+    def _event(waifu, record, outcome):
+        """The engine's Event for an action record, as step() would have published it"""
+        if outcome is not None and outcome.kind != "replay":
+            return outcome  # A status effect, resolved by the engine itself
+        target, amount = (outcome.target, outcome.amount) if outcome is not None else (None, None)
+        if record.action == ATTACK:
+            return Event("attack", waifu, None, target, amount)
+        if record.action == SKIP:
+            return Event("skip", waifu, None, None, None)
+        ability = waifu.get_ability(waifu.specialty, record.action)
+        return Event(ability.effect_type, waifu, ability, target, amount)
+
+    def extend(self, data):
+        """Apply whole action records encoded in `data` (bytes following the setup records)"""
+        for fields in ACTION.iter_unpack(data):
+            self.apply(ActionRecord(*fields))
+
+    def state(self):
+        return BattleState.from_parts(self.players, self.battle_grid, self.teams, self.turn_order,
+                                      actions_taken=self.actions_taken, effects=self.effects)
+
+def rebuild_state(replay, turn=None, events=None):
+    """BattleState just before action `turn` (default: the end of the log).
+
+    Production granted at the start of `turn` is included, matching the
+    state a player sees when it is their move. No RNG is used. Records
+    applied are published to `events`, if given.
+    """
+    log_state = LogState(replay.units, events)
+    for record in replay.actions:
+        if turn is not None and (record.turn > turn or (record.turn == turn and record.action != PRODUCTION)):
+            break
+        log_state.apply(record)
+    return log_state.state()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild a battle from a replay log")
+    parser.add_argument("path", help="replay file")
+    parser.add_argument("--turn", type=int, default=None, help="action to stop before (default: end)")
+    args = parser.parse_args()
+
+    with open(args.path, "rb") as f:
+        replay = load_replay(f.read())
+    state = rebuild_state(replay, args.turn)
+    print(f"Seed {replay.seed}: {len(replay.actions)} records, state before action {state.actions_taken}")
+    for player in state.players:
+        team = ", ".join(f"{w.name} {w.hp}/{w.max_hp}" for w in player.waifus)
+        print(f"{player.name} ({player.production_points} pts): {team}")
+    if state.winner is not None:
+        print(f"Winner: {state.players[state.winner].name}")
+
+if __name__ == "__main__":
+    main()
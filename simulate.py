@@ -0,0 +1,51 @@
+"""Bulk battle simulator: plays many headless battles across a process pool.
+
+Usage: python simulate.py --battles 1000000 --workers 8
+"""
+import argparse
+import os
+import random
+import time
+from multiprocessing import Pool
+
+from battle_engine import new_battle, play_battle
+
+def run_chunk(args):
+    """Play `count` battles seeded from `seed`; returns [p1 wins, p2 wins, draws]"""
+    seed, count, max_actions = args
+    rng = random.Random(seed)
+    results = [0, 0, 0]
+    for _ in range(count):
+        winner = play_battle(new_battle(rng), max_actions=max_actions)
+        results[2 if winner is None else winner] += 1
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Waifu Battle Arena battles")
+    parser.add_argument("--battles", type=int, default=100000, help="number of battles to play")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk", type=int, default=1000, help="battles per task")
+    parser.add_argument("--seed", type=int, default=0, help="base seed")
+    parser.add_argument("--max-actions", type=int, default=1000, help="actions before a battle is a draw")
+    args = parser.parse_args()
+
+    tasks = []
+    remaining = args.battles
+    while remaining > 0:
+        count = min(args.chunk, remaining)
+        tasks.append((args.seed + len(tasks), count, args.max_actions))
+        remaining -= count
+
+    totals = [0, 0, 0]
+    start = time.perf_counter()
+    with Pool(args.workers) as pool:
+        for results in pool.imap_unordered(run_chunk, tasks):
+            for i, n in enumerate(results):
+                totals[i] += n
+    elapsed = time.perf_counter() - start
+
+    print(f"Battles: {args.battles} in {elapsed:.2f}s ({args.battles / elapsed:,.0f} battles/s)")
+    print(f"Player 1 wins: {totals[0]}  Player 2 wins: {totals[1]}  Draws: {totals[2]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Spectator fan-out: any number of sessions watching a match, read-only.
+
+The session playing a match publishes its replay log (see replay.py) to
+the process-wide SpectatorHub as turns are played. The match's channel
+takes only the bytes appended since the last publish, applies them once
+to its own LogState and freezes the result into a Frame: plain tuples of
+what a viewer draws. Viewers never touch battle objects. They poll the
+channel's version and redraw from its latest frame, through the app's
+cached renderers, so a turn costs one decode and one frame however many
+sessions watch.
+
+A late joiner gets the current frame (the snapshot) and the channel's
+combat log ring (the backlog, see events.py).
+"""
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from battle_engine import find_winner
+from events import CombatStats, EventBus
+from match_server import CODE_ALPHABET, CODE_LENGTH
+from replay import LogState, load_replay
+
+CHANNEL_TTL = 3600  # Idle seconds before a channel is dropped
+UPCOMING_ACTIONS = 10  # Upcoming actions kept in a frame
+
+# players: (name, production points) per player; formations: card tuples per
+# player (see formation_cards); upcoming: (name, speed, specialty, player_idx)
+# per action; winner: player index or None
+Frame = namedtuple("Frame", ["turn", "players", "formations", "upcoming", "winner"])
+
+def formation_cards(grid):
+    """Card tuples a formation is drawn from: (name, hp, max_hp, speed, specialty, power, guard)"""
+    return tuple((w.name, w.hp, w.max_hp, w.speed, w.specialty, w.power, w.guard) for w in grid if w)
+
+def watch_code(token):
+    """Public spectator code of a stored match (the token itself would let viewers play it)"""
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    return "".join(CODE_ALPHABET[b % len(CODE_ALPHABET)] for b in digest[:CODE_LENGTH])
+
+class MatchChannel:
+    """One broadcast match: its state rebuilt from the published log, and the latest frame"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.size = 0  # Log bytes taken in so far
+        self.events = EventBus()
+        self.stats = CombatStats()
+        self.events.subscribe(self.stats.record)
+        self.state = None  # LogState once the log's setup records have arrived
+        self.frame = None
+        self.version = 0
+        self.touched = time.monotonic()
+
+    def update(self, writer):
+        """Take in what `writer` (a ReplayWriter) appended since the last update; True if anything was new"""
+        with self.lock:
+            data = writer.getvalue(self.size)
+            if not data:
+                return False
+            if self.state is None:
+                replay = load_replay(data)
+                self.state = LogState(replay.units, self.events)
+                for record in replay.actions:
+                    self.state.apply(record)
+            else:
+                self.state.extend(data)
+            self.size += len(data)
+            self.frame = self._freeze()
+            self.version += 1
+            self.touched = time.monotonic()
+            return True
+
+    def _freeze(self):
+        state = self.state
+        winner = find_winner(state.teams)
+        upcoming = () if winner is not None else tuple(
+            (w.name, w.speed, w.specialty, player_idx)
+            for w, player_idx in state.turn_order.upcoming(UPCOMING_ACTIONS))
+        return Frame(
+            state.actions_taken,
+            tuple((player.name, player.production_points) for player in state.players),
+            tuple(formation_cards(state.battle_grid[f'player{i + 1}']) for i in range(len(state.players))),
+            upcoming,
+            winner,
+        )
+
+class SpectatorHub:
+    """Every broadcast match of this process, by spectator code"""
+
+    def __init__(self, ttl=CHANNEL_TTL):
+        self.ttl = ttl
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def publish(self, code, writer):
+        """Broadcast the new part of a match's replay log; repeating a publish is a no-op"""
+        channel = self.channels.get(code)
+        if channel is not None:
+            return channel.update(writer)
+        # Viewers can find a channel only once it has a frame to draw
+        channel = MatchChannel()
+        if not channel.update(writer):
+            return False
+        with self.lock:
+            self._reap()
+            existing = self.channels.setdefault(code, channel)
+        return existing is channel or existing.update(writer)
+
+    def watch(self, code):
+        """Channel for a spectator code, or None if no such match is being broadcast"""
+        channel = self.channels.get(code.strip().upper())
+        return channel if channel is not None and channel.frame is not None else None
+
+    def _reap(self):
+        cutoff = time.monotonic() - self.ttl
+        for code in [code for code, channel in self.channels.items() if channel.touched < cutoff]:
+            del self.channels[code]
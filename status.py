@@ -0,0 +1,42 @@
+import heapq
+
+class StatusEffects:
+    """Timed stat modifiers (attack up, shield, speed up, ...) of one battle.
+
+    Each application is one heap entry keyed on the turn it runs out, so
+    ending a turn pops only the effects expiring then: O(k log n) for k
+    expiring effects, however many are active. An application covers all
+    the units it was cast on; applications stack, and each one is reverted
+    by exactly the amount it added.
+    """
+
+    def __init__(self):
+        self._heap = []  # (expires, id, units, stat, amount)
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, expires, units, stat, amount):
+        """Schedule the removal of `amount` from `stat` of each of `units` at turn `expires`"""
+        heapq.heappush(self._heap, (expires, self._next_id, units, stat, amount))
+        self._next_id += 1
+
+    def expire(self, turn):
+        """(units, stat, amount) of every effect that has run out by `turn`, removed from the schedule"""
+        heap = self._heap
+        if not heap or heap[0][0] > turn:
+            return ()
+        expired = []
+        while heap and heap[0][0] <= turn:
+            _, _, units, stat, amount = heapq.heappop(heap)
+            expired.append((units, stat, amount))
+        return expired
+
+    def clone(self, mapping):
+        """Copy with units (waifus and players) replaced through `mapping` (old -> new)"""
+        copy = StatusEffects.__new__(StatusEffects)
+        copy._heap = [(expires, i, tuple(mapping[unit] for unit in units), stat, amount)
+                      for expires, i, units, stat, amount in self._heap]
+        copy._next_id = self._next_id
+        return copy
@@ -0,0 +1,221 @@
+"""Durable match storage in SQLite, so live games survive refreshes and restarts.
+
+A match is stored as its replay log (see replay.py), which is everything
+needed to rebuild the battle, plus the combat RNG state so that resumed
+play continues the same random stream. Each save appends only the log
+records written since the previous save (a delta row); every
+SNAPSHOT_EVERY saves the full log is written as a new snapshot and the
+deltas are dropped.
+
+Saves are queued and written by a background thread in batched
+transactions, so a turn never waits on the disk. The database runs in WAL
+mode, so reads (resuming a match) do not block the writer. The store
+counts queued saves per token, so a resume waits only for its own match's
+saves, never for those of the other sessions.
+
+Usage: python storage.py [matches.db]  (lists stored matches)
+"""
+import argparse
+import logging
+import os
+import queue
+import secrets
+import sqlite3
+import struct
+import threading
+import time
+from collections import namedtuple
+
+DB_PATH = os.environ.get("WAIFU_MATCH_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "matches.db"))
+SNAPSHOT_EVERY = 32  # Deltas between full snapshots
+BATCH_WINDOW = 0.05  # Seconds the writer waits to batch more saves into one transaction
+BATCH_SIZE = 256
+
+RNG_STATE = struct.Struct("<625I?d")  # Mersenne Twister state, gauss_next flag and value
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    token TEXT PRIMARY KEY,
+    seed INTEGER NOT NULL,
+    ai_player INTEGER,
+    snapshot BLOB NOT NULL,
+    rng BLOB NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deltas (
+    token TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (token, offset)
+) WITHOUT ROWID;
+"""
+
+SavedMatch = namedtuple("SavedMatch", ["handle", "log", "rng_state"])
+
+log = logging.getLogger(__name__)
+
+def pack_rng_state(state):
+    """Bytes for random.Random.getstate()"""
+    version, internal, gauss_next = state
+    return RNG_STATE.pack(*internal, gauss_next is not None, gauss_next or 0.0)
+
+def unpack_rng_state(data):
+    fields = RNG_STATE.unpack(data)
+    return 3, fields[:625], fields[626] if fields[625] else None
+
+def new_token():
+    """Unguessable match token for the resume URL"""
+    return secrets.token_urlsafe(12)
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints; a crash loses at most the last batch
+    conn.executescript(SCHEMA)
+    return conn
+
+class MatchHandle:
+    """One session's match and how much of its log has been saved"""
+
+    def __init__(self, token, seed, ai_player=None, saved=0, deltas=0):
+        self.token = token
+        self.seed = seed
+        self.ai_player = ai_player
+        self.saved = saved  # Bytes of the log already queued
+        self.deltas = deltas  # Deltas since the last snapshot
+
+class MatchStore:
+    """Match persistence with a background writer; share one per process"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._read = connect(path)
+        self._read_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = {}  # token -> saves queued but not yet written
+        self._written = threading.Condition()
+        self._writer = threading.Thread(target=self._write_loop, name="match-store", daemon=True)
+        self._writer.start()
+
+    def save(self, handle, replay_log, rng):
+        """Queue the log records written since the last save; returns immediately"""
+        size = len(replay_log.buffer)
+        if size == handle.saved:
+            return
+        rng_state = pack_rng_state(rng.getstate())
+        with self._written:
+            self._pending[handle.token] = self._pending.get(handle.token, 0) + 1
+        if handle.saved == 0 or handle.deltas >= SNAPSHOT_EVERY:
+            self._queue.put(("snapshot", handle.token, handle.seed, handle.ai_player,
+                             replay_log.getvalue(), rng_state, time.time()))
+            handle.deltas = 0
+        else:
+            self._queue.put(("delta", handle.token, handle.saved, replay_log.getvalue(handle.saved),
+                             rng_state, time.time()))
+            handle.deltas += 1
+        handle.saved = size
+
+    def load(self, token):
+        """SavedMatch for a token, or None if it is unknown"""
+        # A refresh can arrive before the last save was written
+        with self._written:
+            self._written.wait_for(lambda: token not in self._pending)
+        with self._read_lock:
+            row = self._read.execute("SELECT seed, ai_player, snapshot, rng FROM matches WHERE token = ?",
+                                     (token,)).fetchone()
+            if row is None:
+                return None
+            seed, ai_player, snapshot, rng = row
+            deltas = self._read.execute("SELECT offset, data FROM deltas WHERE token = ? ORDER BY offset",
+                                        (token,)).fetchall()
+        data = bytearray(snapshot)
+        count = 0
+        for offset, delta in deltas:
+            if offset != len(data):
+                # Only possible after a crash between transactions; the rest is unusable
+                log.warning("Match %s: gap in saved log at byte %d", token, len(data))
+                break
+            data += delta
+            count += 1
+        handle = MatchHandle(token, seed, ai_player, saved=len(data), deltas=count)
+        return SavedMatch(handle, bytes(data), unpack_rng_state(rng))
+
+    def matches(self):
+        """(token, seed, saved bytes, updated) of every written match, newest first"""
+        with self._read_lock:
+            return self._read.execute(
+                "SELECT m.token, m.seed, length(m.snapshot) + coalesce(sum(length(d.data)), 0), m.updated "
+                "FROM matches m LEFT JOIN deltas d ON d.token = m.token "
+                "GROUP BY m.token ORDER BY m.updated DESC").fetchall()
+
+    def flush(self):
+        """Block until every queued save is written"""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._read.close()
+
+    def _write_loop(self):
+        conn = connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + BATCH_WINDOW
+            while batch[-1] is not None and len(batch) < BATCH_SIZE:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for item in batch:
+                        if item is not None:
+                            self._apply(conn, item)
+            except sqlite3.Error:
+                log.exception("Failed to save %d match update(s)", len(batch))
+            finally:
+                self._mark_written(item[1] for item in batch if item is not None)
+                for _ in batch:
+                    self._queue.task_done()
+            if batch[-1] is None:
+                conn.close()
+                return
+
+    def _mark_written(self, tokens):
+        """Count a batch's saves as written (or failed) and wake the loads waiting for them"""
+        with self._written:
+            for token in tokens:
+                if self._pending[token] == 1:
+                    del self._pending[token]
+                else:
+                    self._pending[token] -= 1
+            self._written.notify_all()
+
+    @staticmethod
+    def _apply(conn, item):
+        if item[0] == "snapshot":
+            _, token, seed, ai_player, data, rng_state, updated = item
+            conn.execute("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?)",
+                         (token, seed, ai_player, data, rng_state, updated))
+            conn.execute("DELETE FROM deltas WHERE token = ?", (token,))
+        else:
+            _, token, offset, data, rng_state, updated = item
+            conn.execute("INSERT OR REPLACE INTO deltas VALUES (?, ?, ?)", (token, offset, data))
+            conn.execute("UPDATE matches SET rng = ?, updated = ? WHERE token = ?", (rng_state, updated, token))
+
+def main():
+    parser = argparse.ArgumentParser(description="List stored matches")
+    parser.add_argument("path", nargs="?", default=DB_PATH, help="match database")
+    args = parser.parse_args()
+
+    store = MatchStore(args.path)
+    for token, seed, size, updated in store.matches():
+        print(f"{token}  seed {seed:<20} {size:>7} bytes  {time.strftime('%Y-%m-%d %H:%M', time.localtime(updated))}")
+    store.close()
+
+if __name__ == "__main__":
+    main()
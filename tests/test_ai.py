@@ -0,0 +1,23 @@
+"""MCTS agent: searches stop at the move's deadline, and a fresh agent is ready to search."""
+import random
+import time
+
+from ai import MCTSAgent, _search_worker
+from battle_engine import new_battle
+
+def test_search_worker_skips_work_queued_past_the_deadline():
+    state = new_battle(random.Random(1))
+    assert _search_worker((state, time.monotonic() - 0.01, 0.1, 0, 1.4, 200)) == {}
+    stats = _search_worker((state, time.monotonic() + 0.05, 10.0, 0, 1.4, 200))
+    assert stats and set(stats) <= set(state.legal_actions())
+
+def test_first_move_is_searched_by_warm_workers():
+    agent = MCTSAgent(time_budget=0.15, workers=2)
+    try:
+        state = new_battle(random.Random(2))
+        start = time.perf_counter()
+        action = agent.choose(state)
+        assert time.perf_counter() - start < 0.3  # No wait for workers to start
+        assert action in state.legal_actions()
+    finally:
+        agent.close()
@@ -0,0 +1,118 @@
+"""Match server: the draft and battle are played on the server, and clients rebuild the same battle."""
+import threading
+import time
+
+import pytest
+
+from battle_engine import MAX_PER_ROLE, TEAM_SIZE
+from match_server import LocalMatchServer, MatchError, OnlineMatch
+
+def snapshot(state):
+    """Units, points, active effects, whose turn and the winner"""
+    return ([(w.name, w.hp, w.speed, w.power, w.guard) for player in state.players for w in player.waifus],
+            [(player.production_points, player.production_bonus) for player in state.players],
+            len(state.effects),
+            [(w.name, player_idx) for w, player_idx in state.turn_order.upcoming(10)],
+            state.actions_taken,
+            state.winner)
+
+def next_pick(catalog, view):
+    """First character the view's player may still take"""
+    taken = set(view.picks[0] + view.picks[1])
+    mine = [catalog.characters[i].specialty for i in view.picks[view.seat]]
+    return next(c.id for c in catalog.characters
+                if c.id not in taken and mine.count(c.specialty) < MAX_PER_ROLE)
+
+def drafted_match():
+    """(local server, both players' views) of a match whose battle has just started"""
+    local = LocalMatchServer()
+    host = OnlineMatch.create(local.client())
+    guest = OnlineMatch.join(local.client(), host.code.lower())
+    for _ in range(TEAM_SIZE):
+        for view in (host, guest):
+            view.sync()
+            view.pick(next_pick(local.server.catalog, view))
+    host.sync()
+    guest.sync()
+    return local, host, guest
+
+def actor(host, guest):
+    """The view whose unit acts next"""
+    return (host, guest)[host.state().current_actor()[1]]
+
+def test_create_join_pick_act_sync():
+    local, host, guest = drafted_match()
+    assert (host.seat, guest.seat) == (0, 1) and host.joined and guest.joined
+    assert host.picks == guest.picks and all(len(picks) == TEAM_SIZE for picks in host.picks)
+    server = local.server.matches[host.code]
+
+    for turn in range(20):
+        if server.state.is_over():
+            break
+        view = actor(host, guest)
+        view.act(view.state().legal_actions()[0])
+        other = guest if view is host else host
+        assert other.sync()
+        assert not other.sync()  # Nothing new since
+        assert host.state().actions_taken == guest.state().actions_taken == server.state.actions_taken == turn + 1
+
+def test_act_rejections():
+    local, host, guest = drafted_match()
+    view = actor(host, guest)
+    other = guest if view is host else host
+    with pytest.raises(MatchError, match="Not your turn"):
+        other.act(other.state().legal_actions()[0])
+    with pytest.raises(MatchError, match="Illegal action"):
+        view.act("no such action")
+
+    turn = view.state().actions_taken
+    view.act(view.state().legal_actions()[0])
+    response = view.client.request("act", match=view.code, token=view.token, cursor=view.cursor,
+                                   turn=turn, action=view.state().legal_actions()[0])
+    assert response == {"ok": False, "error": "That turn has already been played"}
+
+def test_join_and_seat_errors():
+    local = LocalMatchServer()
+    host = OnlineMatch.create(local.client())
+    OnlineMatch.join(local.client(), host.code)
+    with pytest.raises(MatchError, match="Match is full"):
+        OnlineMatch.join(local.client(), host.code)
+    with pytest.raises(MatchError, match="Unknown match"):
+        OnlineMatch.join(local.client(), "000000")  # 0 is never used in codes
+
+    client = local.client()
+    for token in ("not-a-token", None):
+        for op, fields in (("sync", {}), ("pick", {"character": 0})):
+            response = client.request(op, match=host.code, token=token, **fields)
+            assert response == {"ok": False, "error": "Not a player in this match"}
+
+def test_waiting_sync_wakes_on_the_opponents_act():
+    local, host, guest = drafted_match()
+    view = actor(host, guest)
+    other = guest if view is host else host
+    woke = []
+
+    def wait():
+        start = time.perf_counter()
+        woke.append((other.sync(wait=5.0), time.perf_counter() - start))
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.2)
+    view.act(view.state().legal_actions()[0])
+    waiter.join(5.0)
+    (changed, elapsed), = woke
+    assert changed and 0.1 < elapsed < 2.0
+    assert other.state().actions_taken == 1
+
+def test_online_view_rebuilds_the_server_battle():
+    local, host, guest = drafted_match()
+    server = local.server.matches[host.code]
+    assert snapshot(host.state()) == snapshot(guest.state()) == snapshot(server.state)
+    while not server.state.is_over() and server.state.actions_taken < 300:
+        view = actor(host, guest)
+        actions = view.state().legal_actions()
+        view.act(actions[server.state.actions_taken % len(actions)])
+        host.sync()
+        guest.sync()
+        assert snapshot(host.state()) == snapshot(guest.state()) == snapshot(server.state)
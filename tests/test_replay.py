@@ -0,0 +1,50 @@
+"""Replay log: what the engine writes rebuilds the same battle, turn by turn."""
+from battle_engine import BattleState, Player, build_roster, match_rng, random_policy, random_team, step
+from replay import ACTION, LogState, ReplayWriter, load_replay, rebuild_state
+
+def snapshot(state):
+    """What a player sees: units, points, status bonuses, active effects, whose turn and the winner"""
+    return ([(w.name, w.hp, w.speed, w.power, w.guard) for player in state.players for w in player.waifus],
+            [(player.production_points, player.production_bonus) for player in state.players],
+            len(state.effects),
+            [(w.name, player_idx) for w, player_idx in state.turn_order.upcoming(10)],
+            state.winner)
+
+def recorded_battle(seed):
+    """(writer, bytes of setup records, snapshot before every action and at the end) of a seeded battle"""
+    rng = match_rng(seed, "combat")
+    pool = build_roster(match_rng(seed, "setup"))
+    players = [Player("Player 1"), Player("Player 2")]
+    for player in players:
+        for waifu in random_team(pool, rng):
+            player.add_waifu(waifu)
+            pool.remove(waifu)
+    writer = ReplayWriter()
+    writer.start(seed, players)
+    setup = len(writer.buffer)
+    state = BattleState(players, rng, writer)
+    snapshots = [snapshot(state)]
+    while not state.is_over() and state.actions_taken < 1000:
+        step(state, random_policy(state))
+        snapshots.append(snapshot(state))
+    return writer, setup, snapshots
+
+def test_rebuild_state_matches_the_live_battle_at_every_turn():
+    for seed in range(5):
+        writer, _, snapshots = recorded_battle(seed)
+        replay = load_replay(writer.getvalue())
+        assert replay.seed == seed
+        for turn, expected in enumerate(snapshots):
+            assert snapshot(rebuild_state(replay, turn)) == expected, (seed, turn)
+
+def test_log_state_fed_in_chunks_matches_the_live_battle():
+    """As a spectator channel or match client sees the log: setup first, then appended records"""
+    writer, setup, snapshots = recorded_battle(11)
+    data = writer.getvalue()
+    state = LogState(load_replay(data[:setup]).units)
+    middle = setup + (len(data) - setup) // 2
+    middle -= (middle - setup) % ACTION.size  # Whole action records only
+    state.extend(data[setup:middle])
+    state.extend(data[middle:])
+    assert snapshot(state.state()) == snapshots[-1]
+    assert state.actions_taken == len(snapshots) - 1
@@ -0,0 +1,31 @@
+"""SpectatorHub: viewers only ever get a channel with a frame to draw."""
+import random
+
+from battle_engine import new_battle, random_policy, step
+from replay import ReplayWriter
+from spectate import SpectatorHub
+
+def test_channel_is_hidden_until_its_first_frame():
+    hub = SpectatorHub()
+    writer = ReplayWriter()
+    assert not hub.publish("ABCD", writer)  # Nothing written yet
+    assert hub.watch("abcd") is None
+
+    state = new_battle(random.Random(5))
+    writer.start(5, state.players)
+    assert hub.publish("ABCD", writer)
+    channel = hub.watch(" abcd ")
+    assert channel is not None and channel.frame.turn == 0
+
+def test_publish_takes_only_new_records():
+    hub = SpectatorHub()
+    state = new_battle(random.Random(6))
+    writer = ReplayWriter()
+    writer.start(6, state.players)
+    state.recorder = writer
+    hub.publish("WXYZ", writer)
+    for _ in range(10):
+        step(state, random_policy(state))
+    assert hub.publish("WXYZ", writer)
+    assert not hub.publish("WXYZ", writer)  # Repeating a publish is a no-op
+    assert hub.watch("WXYZ").frame.turn == 10
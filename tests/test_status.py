@@ -0,0 +1,39 @@
+"""StatusEffects: each application is reverted exactly once, at the turn it runs out."""
+from status import StatusEffects
+
+def test_nothing_expires_before_its_turn():
+    effects = StatusEffects()
+    effects.add(5, ("a",), "power", 10)
+    assert effects.expire(4) == ()
+    assert len(effects) == 1
+
+def test_expires_at_its_turn_and_only_once():
+    effects = StatusEffects()
+    effects.add(5, ("a",), "power", 10)
+    assert effects.expire(5) == [(("a",), "power", 10)]
+    assert effects.expire(5) == ()
+    assert len(effects) == 0
+
+def test_expire_catches_up_on_skipped_turns_in_order():
+    effects = StatusEffects()
+    effects.add(8, ("c",), "speed", 3)
+    effects.add(3, ("a",), "power", 10)
+    effects.add(6, ("b",), "guard", 5)
+    assert effects.expire(6) == [(("a",), "power", 10), (("b",), "guard", 5)]
+    assert effects.expire(7) == ()
+    assert effects.expire(8) == [(("c",), "speed", 3)]
+
+def test_stacked_applications_expire_separately():
+    effects = StatusEffects()
+    effects.add(4, ("a",), "power", 10)
+    effects.add(4, ("a",), "power", 10)
+    effects.add(9, ("a",), "power", 20)
+    assert effects.expire(4) == [(("a",), "power", 10), (("a",), "power", 10)]
+    assert len(effects) == 1
+
+def test_clone_maps_units():
+    effects = StatusEffects()
+    effects.add(2, ("a", "b"), "guard", 5)
+    copy = effects.clone({"a": "A", "b": "B"})
+    assert copy.expire(2) == [(("A", "B"), "guard", 5)]
+    assert len(effects) == 1
@@ -0,0 +1,100 @@
+"""MatchStore: a saved match loads back into the same battle and the same combat RNG stream."""
+import random
+import threading
+import time
+
+from battle_engine import BattleState, Player, build_roster, match_rng, random_policy, random_team, step
+from replay import ReplayWriter, load_replay, rebuild_state
+from storage import SNAPSHOT_EVERY, MatchHandle, MatchStore, new_token
+
+def board(state):
+    return ([(w.name, w.hp, w.power, w.guard) for player in state.players for w in player.waifus],
+            [player.production_points for player in state.players],
+            state.current_actor()[0].name if not state.is_over() else None, state.winner)
+
+def started_battle(seed):
+    rng = match_rng(seed, "combat")
+    pool = build_roster(match_rng(seed, "setup"))
+    players = [Player("Player 1"), Player("Player 2")]
+    for player in players:
+        for waifu in random_team(pool, rng):
+            player.add_waifu(waifu)
+            pool.remove(waifu)
+    writer = ReplayWriter()
+    writer.start(seed, players)
+    return BattleState(players, rng, writer), writer
+
+def test_save_flush_load_resumes_the_same_battle(tmp_path):
+    store = MatchStore(str(tmp_path / "matches.db"))
+    try:
+        state, writer = started_battle(3)
+        handle = MatchHandle(new_token(), 3, ai_player=1)
+        store.save(handle, writer, state.rng)
+        # Past one snapshot cycle, so the load joins a snapshot with deltas
+        for _ in range(SNAPSHOT_EVERY + 5):
+            step(state, random_policy(state))
+            store.save(handle, writer, state.rng)
+        store.flush()
+
+        saved = store.load(handle.token)
+        assert saved is not None
+        assert saved.log == writer.getvalue()
+        assert saved.handle.ai_player == 1
+        assert saved.handle.saved == len(writer.buffer)
+        resumed = rebuild_state(load_replay(saved.log))
+        assert board(resumed) == board(state)
+
+        # The restored RNG continues the combat stream exactly where the live battle is
+        rng = random.Random()
+        rng.setstate(saved.rng_state)
+        assert [rng.random() for _ in range(5)] == [state.rng.random() for _ in range(5)]
+    finally:
+        store.close()
+
+def test_unknown_token_loads_nothing(tmp_path):
+    store = MatchStore(str(tmp_path / "matches.db"))
+    try:
+        assert store.load("no-such-match") is None
+    finally:
+        store.close()
+
+def test_load_waits_only_for_its_own_saves(tmp_path):
+    store = MatchStore(str(tmp_path / "matches.db"))
+    release = threading.Event()
+    apply = store._apply
+
+    def slow_apply(conn, item):
+        if item[1] == "busy":
+            release.wait(10)  # Another session's save, stuck behind a slow disk
+        apply(conn, item)
+
+    try:
+        state, writer = started_battle(4)
+        mine = MatchHandle(new_token(), 4)
+        store.save(mine, writer, state.rng)
+        store.flush()
+
+        store._apply = slow_apply
+        other, other_writer = started_battle(5)
+        store.save(MatchHandle("busy", 5), other_writer, other.rng)
+        start = time.perf_counter()
+        saved = store.load(mine.token)
+        assert time.perf_counter() - start < 1
+        assert saved.log == writer.getvalue()
+    finally:
+        release.set()
+        store.close()
+
+def test_load_waits_for_a_queued_save(tmp_path):
+    store = MatchStore(str(tmp_path / "matches.db"))
+    try:
+        state, writer = started_battle(6)
+        handle = MatchHandle(new_token(), 6)
+        store.save(handle, writer, state.rng)
+        for _ in range(3):
+            step(state, random_policy(state))
+            store.save(handle, writer, state.rng)
+        # No flush: load itself must wait for this match's queued saves
+        assert store.load(handle.token).log == writer.getvalue()
+    finally:
+        store.close()
@@ -0,0 +1,25 @@
+"""Win probability: the background solver answers like win_probability() once its solve is done."""
+import random
+import time
+
+from battle_engine import new_battle, random_policy, step
+from winprob import BackgroundSolver, win_probability
+
+def test_background_solver_answers_once_solved():
+    state = new_battle(random.Random(3))
+    for _ in range(15):
+        step(state, random_policy(state))
+    solver = BackgroundSolver()
+    p1 = solver.win_probability(state.players, state.teams)
+    deadline = time.monotonic() + 30
+    while p1 is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+        p1 = solver.win_probability(state.players, state.teams)
+    assert p1 == win_probability(state.players, state.teams)
+
+def test_background_solver_keeps_the_latest_mixtures():
+    solver = BackgroundSolver(maxsize=2)
+    for seed in range(4):
+        state = new_battle(random.Random(seed))
+        solver.win_probability(state.players, state.teams)
+    assert len(solver._solutions) == 2
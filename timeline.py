@@ -0,0 +1,102 @@
+import heapq
+
+class ActionTimeline:
+    """Priority queue of upcoming actions.
+
+    Each living unit has exactly one entry keyed on (round, -speed, seq):
+    within a round faster units act first, ties keep their original order.
+    Acting re-queues the unit for the next round, so the order matches a
+    speed-sorted round robin without ever re-sorting the whole list.
+    Defeated units and speed changes invalidate the old entry in place
+    (lazy deletion) and cost O(log n).
+    """
+
+    def __init__(self, units):
+        self._heap = []
+        self._entries = {}  # waifu -> live heap entry
+        self._seq = {}  # waifu -> tie-break order
+        self._next_id = 0
+        self._version = 0
+        self._upcoming = (None, ())
+        self.last_player_idx = None  # Player who took the previous action
+        for seq, (waifu, player_idx) in enumerate(units):
+            self._seq[waifu] = seq
+            self._push(0, waifu, player_idx)
+
+    def _push(self, round_no, waifu, player_idx):
+        entry = [round_no, -waifu.speed, self._seq[waifu], self._next_id, waifu, player_idx, True]
+        self._next_id += 1
+        self._entries[waifu] = entry
+        heapq.heappush(self._heap, entry)
+        self._version += 1
+
+    def _top(self):
+        """Live entry at the top of the heap, discarding stale ones"""
+        heap = self._heap
+        while heap and not heap[0][-1]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, waifu):
+        return waifu in self._entries
+
+    def __iter__(self):
+        """Units in the order of their next action"""
+        return iter(self.upcoming(len(self._entries)))
+
+    def current(self):
+        """(waifu, player_idx) whose turn it is, or None if no units remain"""
+        entry = self._top()
+        return (entry[4], entry[5]) if entry else None
+
+    def advance(self):
+        """Finish the current unit's action and queue it for the next round"""
+        entry = self._top()
+        if entry is None:
+            return
+        heapq.heappop(self._heap)
+        round_no, _, _, _, waifu, player_idx, _ = entry
+        self.last_player_idx = player_idx
+        self._push(round_no + 1, waifu, player_idx)
+
+    def remove(self, waifu):
+        """Drop a unit (e.g. defeated) from the timeline"""
+        entry = self._entries.pop(waifu, None)
+        if entry is not None:
+            entry[-1] = False
+            self._version += 1
+
+    def set_speed(self, waifu, speed):
+        """Change a unit's speed; takes effect for its pending action"""
+        waifu.speed = speed
+        entry = self._entries.get(waifu)
+        if entry is not None:
+            entry[-1] = False
+            self._push(entry[0], waifu, entry[5])
+
+    def clone(self, mapping):
+        """Copy of the timeline with units replaced through `mapping` (old -> new)"""
+        copy = ActionTimeline.__new__(ActionTimeline)
+        copy._heap = [e[:4] + [mapping[e[4]], e[5], True] for e in self._heap if e[-1]]
+        heapq.heapify(copy._heap)
+        copy._entries = {e[4]: e for e in copy._heap}
+        copy._seq = {mapping[w]: seq for w, seq in self._seq.items()}
+        copy._next_id = self._next_id
+        copy._version = 0
+        copy._upcoming = (None, ())
+        copy.last_player_idx = self.last_player_idx
+        return copy
+
+    def upcoming(self, k):
+        """Next k actions as (waifu, player_idx); cached until the timeline changes"""
+        version, cached = self._upcoming
+        if version != self._version or len(cached) < k:
+            live = sorted(e for e in self._entries.values())
+            # After every live unit acts once the same order repeats
+            cycle = [(e[4], e[5]) for e in live]
+            cached = tuple((cycle * (k // len(cycle) + 1))[:k]) if cycle else ()
+            self._upcoming = (self._version, cached)
+        return cached[:k]
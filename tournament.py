@@ -0,0 +1,223 @@
+"""Round-robin tournament over every legal team composition.
+
+A team is identified by the bitmask of its roster ids, which is canonical
+(independent of pick order). Every pair of disjoint legal teams plays
+`--games` battles on the vectorized simulator, alternating seats, and the
+win counts go to a memory-mapped results file (.npy) with one fixed-size
+row per pairing. A JSON sidecar records each character's fingerprint;
+when a character or its role's abilities change, only pairings involving
+that character are reset, and a re-run plays just the missing games.
+
+Usage: python tournament.py --games 32 --workers 8
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from itertools import combinations
+from multiprocessing import Pool
+
+import numpy as np
+
+from batch_sim import BatchBattles, grid_order
+from battle_engine import ABILITY_DEFS, MAX_PER_ROLE, ROSTER, TEAM_SIZE
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tournament_results.npy")
+FORMAT_VERSION = 1
+
+# One row per pairing; key = team_a << 32 | team_b with team_a < team_b
+RESULT_DTYPE = np.dtype([("key", "<u8"), ("wins_a", "<u4"), ("wins_b", "<u4"), ("draws", "<u4")])
+
+def character_fingerprint(name, specialty):
+    """Hash of everything about a character that affects its battles"""
+    abilities = [list(d) for d in ABILITY_DEFS if d.role == specialty]
+    return hashlib.sha1(json.dumps([name, specialty, abilities]).encode()).hexdigest()[:16]
+
+def legal_teams(roster=ROSTER, size=TEAM_SIZE, max_per_role=MAX_PER_ROLE):
+    """Sorted bitmasks of every team that respects the per-role cap"""
+    if len(roster) > 32:
+        raise ValueError("Team masks support rosters of at most 32 characters")
+    masks = []
+    for team in combinations(range(len(roster)), size):
+        roles = [roster[i][1] for i in team]
+        if max(roles.count(r) for r in set(roles)) <= max_per_role:
+            masks.append(sum(1 << i for i in team))
+    return np.array(sorted(masks), dtype=np.uint64)
+
+def pairing_keys(teams):
+    """Sorted keys of every pair of disjoint teams"""
+    keys = []
+    for i, a in enumerate(teams):
+        partners = teams[i + 1:]
+        partners = partners[(partners & a) == 0]
+        keys.append((a << np.uint64(32)) | partners)
+    return np.concatenate(keys) if keys else np.zeros(0, dtype=np.uint64)
+
+def split_keys(keys):
+    return keys >> np.uint64(32), keys & np.uint64(0xFFFFFFFF)
+
+def mask_members(masks, size=TEAM_SIZE):
+    """Roster ids (n, size) of each team mask, ascending"""
+    bits = (masks[:, None] >> np.arange(32, dtype=np.uint64)) & np.uint64(1)
+    return np.nonzero(bits)[1].reshape(-1, size)
+
+def _metadata(roster):
+    return {
+        "version": FORMAT_VERSION,
+        "characters": [[name, specialty, character_fingerprint(name, specialty)] for name, specialty in roster],
+    }
+
+def _remap(keys, old_meta, new_meta):
+    """Translate old pairing keys to the current roster; unusable keys map to 0"""
+    new_ids = {(name, fp): i for i, (name, _, fp) in enumerate(new_meta["characters"])}
+    a, b = split_keys(keys)
+    new_a = np.zeros_like(a)
+    new_b = np.zeros_like(b)
+    valid = np.ones(len(keys), dtype=bool)
+    for j, (name, _, fp) in enumerate(old_meta["characters"]):
+        bit = np.uint64(1 << j)
+        in_a, in_b = (a & bit) != 0, (b & bit) != 0
+        target = new_ids.get((name, fp))
+        if target is None:
+            # Character removed or changed: every pairing it played in is stale
+            valid &= ~(in_a | in_b)
+            continue
+        new_bit = np.uint64(1 << target)
+        new_a[in_a] |= new_bit
+        new_b[in_b] |= new_bit
+    # Keep the canonical order (team_a < team_b), swapping the counts with it
+    swap = new_a > new_b
+    lo, hi = np.where(swap, new_b, new_a), np.where(swap, new_a, new_b)
+    return np.where(valid, (lo << np.uint64(32)) | hi, np.uint64(0)), swap
+
+def open_results(path=RESULTS_PATH, roster=ROSTER, rebuild=False):
+    """Memory-mapped results for the current roster, carrying over still-valid rows"""
+    meta_path = os.path.splitext(path)[0] + ".json"
+    meta = _metadata(roster)
+    old_meta = None
+    if not rebuild and os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            old_meta = json.load(f)
+        if old_meta == meta:
+            return np.lib.format.open_memmap(path, mode="r+")
+
+    keys = pairing_keys(legal_teams(roster))
+    if old_meta is not None and old_meta.get("version") == FORMAT_VERSION:
+        old = np.load(path)
+        played = old[(old["wins_a"] + old["wins_b"] + old["draws"]) > 0]
+    else:
+        played = np.zeros(0, dtype=RESULT_DTYPE)
+
+    tmp_path = path + ".tmp"
+    results = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=RESULT_DTYPE, shape=(len(keys),))
+    results["key"] = keys
+    if len(played):
+        new_keys, swap = _remap(played["key"], old_meta, meta)
+        rows = np.searchsorted(keys, new_keys)
+        found = (rows < len(keys)) & (keys[np.minimum(rows, len(keys) - 1)] == new_keys)
+        rows = rows[found]
+        results["wins_a"][rows] = np.where(swap, played["wins_b"], played["wins_a"])[found]
+        results["wins_b"][rows] = np.where(swap, played["wins_a"], played["wins_b"])[found]
+        results["draws"][rows] = played["draws"][found]
+        print(f"Kept {len(rows):,} of {len(played):,} previously played pairings")
+    results.flush()
+    del results
+    os.replace(tmp_path, path)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return np.lib.format.open_memmap(path, mode="r+")
+
+def play_pairings(args):
+    """Play `counts[i]` battles of pairing `keys[i]`, starting at seat parity `first[i]`.
+
+    Returns per-pairing (wins_a, wins_b, draws).
+    """
+    keys, counts, first, seed, max_actions = args
+    pair = np.repeat(np.arange(len(keys)), counts)
+    # Game index within the pairing decides the seats: even -> team A is Player 1
+    game = np.arange(len(pair)) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    a_first = game % 2 == 0
+    a, b = split_keys(keys)
+    members_a, members_b = mask_members(a)[pair], mask_members(b)[pair]
+    roster_id = np.where(a_first[:, None], np.hstack([members_a, members_b]), np.hstack([members_b, members_a]))
+
+    winner = BatchBattles(len(pair), np.random.default_rng(seed), grid_order(roster_id)).run(max_actions)
+    # Winner 0/1 is a seat; translate to team A/B
+    a_won = np.where(a_first, winner == 0, winner == 1)
+    b_won = np.where(a_first, winner == 1, winner == 0)
+    return (np.bincount(pair[a_won], minlength=len(keys)),
+            np.bincount(pair[b_won], minlength=len(keys)),
+            np.bincount(pair[winner == -1], minlength=len(keys)))
+
+def pending_tasks(results, games, chunk_battles, seed, max_actions, max_pairings=None):
+    """(rows, task) pairs covering every pairing with fewer than `games` results"""
+    played = (results["wins_a"] + results["wins_b"] + results["draws"]).astype(np.int64)
+    rows = np.nonzero(played < games)[0][:max_pairings]
+    tasks = []
+    per_task = max(1, chunk_battles // games)
+    for start in range(0, len(rows), per_task):
+        chunk = rows[start:start + per_task]
+        task_seed = np.random.SeedSequence([seed, int(chunk[0]), int(played[chunk[0]])])
+        tasks.append((chunk, (results["key"][chunk], games - played[chunk], played[chunk] % 2,
+                              task_seed, max_actions)))
+    return tasks
+
+def team_win_rates(results):
+    """(team masks, games, win rate) aggregated over every pairing"""
+    a, b = split_keys(results["key"])
+    teams, inverse = np.unique(np.concatenate([a, b]), return_inverse=True)
+    wins = np.bincount(inverse, np.concatenate([results["wins_a"], results["wins_b"]]), len(teams))
+    total = results["wins_a"].astype(np.int64) + results["wins_b"] + results["draws"]
+    games = np.bincount(inverse, np.concatenate([total, total]), len(teams))
+    return teams, games, np.divide(wins, games, out=np.zeros(len(teams)), where=games > 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Round-robin tournament over all legal teams")
+    parser.add_argument("--games", type=int, default=32, help="battles per pairing")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk", type=int, default=20000, help="battles per task")
+    parser.add_argument("--seed", type=int, default=0, help="base seed")
+    parser.add_argument("--max-actions", type=int, default=1000, help="actions before a battle is a draw")
+    parser.add_argument("--max-pairings", type=int, default=None, help="stop after this many pairings")
+    parser.add_argument("--results", default=RESULTS_PATH, help="results file (.npy)")
+    parser.add_argument("--rebuild", action="store_true", help="discard cached results")
+    parser.add_argument("--top", type=int, default=10, help="teams to list at each end")
+    args = parser.parse_args()
+
+    results = open_results(args.results, rebuild=args.rebuild)
+    tasks = pending_tasks(results, args.games, args.chunk, args.seed, args.max_actions, args.max_pairings)
+    pairings = sum(len(rows) for rows, _ in tasks)
+    print(f"{len(results):,} pairings, {pairings:,} to play")
+
+    start = time.perf_counter()
+    battles = 0
+    last_flush = start
+    with Pool(args.workers) as pool:
+        outcomes = pool.imap(play_pairings, [task for _, task in tasks])
+        for (rows, task), (wins_a, wins_b, draws) in zip(tasks, outcomes):
+            results["wins_a"][rows] += wins_a.astype(np.uint32)
+            results["wins_b"][rows] += wins_b.astype(np.uint32)
+            results["draws"][rows] += draws.astype(np.uint32)
+            battles += int(task[1].sum())
+            if time.perf_counter() - last_flush > 30:
+                results.flush()
+                last_flush = time.perf_counter()
+                print(f"  {battles:,} battles, {battles / (last_flush - start) * 60:,.0f}/min")
+    results.flush()
+    elapsed = time.perf_counter() - start
+    if battles:
+        print(f"Played {battles:,} battles in {elapsed:.1f}s ({battles / elapsed * 60:,.0f} battles/min)")
+
+    teams, games, rates = team_win_rates(results)
+    ranked = np.argsort(-rates[games > 0])
+    teams, games, rates = teams[games > 0][ranked], games[games > 0][ranked], rates[games > 0][ranked]
+    names = [name for name, _ in ROSTER]
+    shown = list(range(min(args.top, len(teams))))
+    shown += [i for i in range(max(len(shown), len(teams) - args.top), len(teams))]
+    for i in shown:
+        members = ", ".join(names[j] for j in mask_members(teams[i:i + 1])[0])
+        print(f"  {rates[i]:6.1%}  over {int(games[i]):>7} games  {members}")
+
+if __name__ == "__main__":
+    main()
@@ -1,158 +1,190 @@
-import streamlit as st
+import html
+import os
 import random
+import time
+from collections import deque
+from functools import lru_cache
 
-# Game classes from the original code
-ROLES = ["War", "Production", "Support"]
-
-class Ability:
-    def __init__(self, name, role, cost=1, effect_type="damage"):
-        self.name = name
-        self.role = role  # War, Production, or Support
-        self.cost = cost  # Production points required
-        self.effect_type = effect_type  # damage, buff, heal
-        self.value = random.randint(15, 25) if effect_type == "damage" else random.randint(1, 3)
-
-    def __str__(self):
-        return f"{self.role} ability: {self.name} (Cost: {self.cost})"
-
-class Waifu:
-    def __init__(self, name, specialty):
-        self.name = name
-        self.specialty = specialty  # One of the roles
-        self.stats = {"War": 8, "Production": 8, "Support": 8}
-        self.speed = random.randint(85, 115)  # Random speed for turn order
-        self.abilities = self._generate_abilities(name)
-        self.current_position = None  # Position in battle grid
-        self.hp = 100  # Health points
-        self.max_hp = 100
-    
-    def _generate_abilities(self, name):
-        """Generate unique abilities for each character"""
-        ability_templates = {
-            "War": [
-                ("Strike", "damage", 2), ("Defend", "heal", 1), 
-                ("Charge", "damage", 3), ("Rally", "buff", 2)
-            ],
-            "Production": [
-                ("Craft", "buff", 1), ("Build", "buff", 2), 
-                ("Gather", "buff", 1), ("Forge", "buff", 3)
-            ],
-            "Support": [
-                ("Heal", "heal", 2), ("Boost", "buff", 1), 
-                ("Shield", "buff", 2), ("Inspire", "buff", 3)
-            ]
-        }
-        
-        abilities = {}
-        for role in ROLES:
-            templates = ability_templates[role]
-            # Pick 2 random abilities for each role
-            selected = random.sample(templates, 2)
-            abilities[role] = [
-                Ability(f"{name}'s {selected[0][0]}", role, selected[0][2], selected[0][1]),
-                Ability(f"{name}'s {selected[1][0]}", role, selected[1][2], selected[1][1])
-            ]
-        return abilities
-
-    def get_stat(self, current_slot):
-        base = self.stats[current_slot]
-        if current_slot == self.specialty:
-            return base + 1
-        return base
-
-    def get_active_abilities(self, slot):
-        return self.abilities[slot]
-
-    def __str__(self):
-        return f"{self.name} ({self.specialty}) - W:{self.stats['War']} P:{self.stats['Production']} S:{self.stats['Support']}"
-
-class Player:
-    def __init__(self, name):
-        self.name = name
-        self.waifus = []
-        self.production_points = 5  # Start with some points
-        self.production_rate = 0  # Points per turn from production waifus
-
-    def add_waifu(self, waifu):
-        self.waifus.append(waifu)
-    
-    def calculate_production_rate(self):
-        """Calculate production points generated per turn"""
-        base_rate = 0
-        for waifu in self.waifus:
-            if waifu.specialty == "Production" and waifu.hp > 0:
-                base_rate += 2  # Base production per production waifu
-        self.production_rate = base_rate
-        return base_rate
-    
-    def generate_production_points(self):
-        """Generate production points at start of turn"""
-        generated = self.calculate_production_rate()
-        self.production_points += generated
-        return generated
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-# Initialize session state
-def init_session_state():
-    if 'game_phase' not in st.session_state:
-        st.session_state.game_phase = 'start'  # start, team_selection, gameplay, game_over
-    if 'current_player' not in st.session_state:
-        st.session_state.current_player = 1
-    if 'current_turn' not in st.session_state:
-        st.session_state.current_turn = 1
-    if 'max_turns' not in st.session_state:
-        st.session_state.max_turns = 5
-    if 'players' not in st.session_state:
-        st.session_state.players = [Player("Player 1"), Player("Player 2")]
-    if 'available_waifus' not in st.session_state:
-        st.session_state.available_waifus = [
-            # War specialists
-            Waifu("Mary", "War"),
-            Waifu("Ivy", "War"),
-            Waifu("Rei", "War"),
-            Waifu("Zara", "War"),
-            Waifu("Akira", "War"),
-            Waifu("Blade", "War"),
-            
-            # Production specialists
-            Waifu("Luna", "Production"),
-            Waifu("Kira", "Production"),
-            Waifu("Mira", "Production"),
-            Waifu("Sage", "Production"),
-            Waifu("Ava", "Production"),
-            Waifu("Echo", "Production"),
-            
-            # Support specialists
-            Waifu("Sora", "Support"),
-            Waifu("Nova", "Support"),
-            Waifu("Lily", "Support"),
-            Waifu("Rose", "Support"),
-            Waifu("Hope", "Support"),
-            Waifu("Grace", "Support")
-        ]
-    if 'role_counts' not in st.session_state:
-        st.session_state.role_counts = [
+from ai import MCTSAgent
+from battle_engine import (
+    BASIC_ATTACK, MAX_LARGE_TEAM_SIZE, MAX_PER_ROLE, MAX_TEAMS, SKIP_TURN, TEAM_SIZE, BattleState, Event, Player,
+    arrange_grid, build_teams, build_timeline, find_winner, expire_effects, finish_action, match_rng,
+    new_large_battle, production_due, random_policy, resolve_ability, resolve_basic_attack, step,
+)
+from battlefield import battlefield_height, encode_units, render_battlefield
+from catalog import SORT_KEYS, RosterOverlay, build_catalog
+from draft import Candidate, recommend
+from events import CombatStats, EventBus, describe_entry
+from flow import GameFlow
+from instrumentation import instrumented, rerun_metrics
+from ladder import Ladder, MatchResult
+from match_server import LocalMatchServer, MatchClient, MatchError, OnlineMatch
+from replay import PRODUCTION, ReplayWriter, load_replay, rebuild_state, replay_path
+from spectate import SpectatorHub, formation_cards, watch_code
+from status import StatusEffects
+from storage import MatchHandle, MatchStore, new_token
+from winprob import BackgroundSolver
+
+ROLE_EMOJI = {"War": "⚔️", "Production": "🏭", "Support": "🛡️"}
+ROLE_CLASS = {"War": "war", "Production": "production", "Support": "support"}
+PAGE_SIZE = 10  # Characters listed per team selection page
+ACTION_BAR_LENGTH = 10  # Upcoming actions shown in the action order bar
+COMBAT_LOG_LINES = 30  # Latest combat events shown in the combat log panel
+AI_TIME_BUDGET = 0.15  # Seconds the AI may think per move
+DRAFT_TIME_BUDGET = 0.08  # Seconds the draft advisor may search per new position
+MATCH_SERVER = os.environ.get("WAIFU_MATCH_SERVER")  # host:port; unset runs the match server in-process
+ONLINE_POLL_INTERVAL = 0.5  # Seconds between checks for the opponent's moves
+SPECTATE_POLL_INTERVAL = 1.0  # Seconds between a spectator's checks for new turns
+LADDER_ROWS = 10  # Standings shown on the start screen
+AI_LADDER_NAME = "🤖 AI"
+AUTO_PLAY_LIMIT = 100000  # Most actions a large battle auto-plays in one rerun
+
+@st.cache_resource
+def get_shared_catalog():
+    """Immutable roster catalog, built once per process"""
+    return build_catalog()
+
+@st.cache_resource
+def get_match_store():
+    """SQLite match store shared by all sessions; saves are written in the background"""
+    return MatchStore()
+
+@st.cache_resource
+def get_local_match_server():
+    """In-process match server, so sessions on this Streamlit server can play each other"""
+    return LocalMatchServer(get_shared_catalog())
+
+@st.cache_resource
+def get_ladder():
+    """SQLite Elo ladder shared by all sessions; results are written in the background"""
+    return Ladder()
+
+@st.cache_resource
+def get_spectator_hub():
+    """Broadcast channels of the matches played in this process, shared by all sessions"""
+    return SpectatorHub()
+
+def publish_match():
+    """Broadcast the turns played so far to this match's spectators"""
+    get_spectator_hub().publish(st.session_state.watch_code, st.session_state.replay_log)
+
+def open_match_client():
+    """New connection to the match server for this session"""
+    if MATCH_SERVER:
+        host, port = MATCH_SERVER.rsplit(":", 1)
+        return MatchClient(host, int(port))
+    return get_local_match_server().client()
+
+def resume_match(token):
+    """Restore a stored match into this session; False if the token is unknown"""
+    saved = get_match_store().load(token)
+    if saved is None:
+        return False
+    try:
+        replay = load_replay(saved.log)
+    except ValueError:
+        return False  # Saved by an older version with different rules
+    events, stats = new_combat_log()
+    state = rebuild_state(replay, events=events)
+    combat_rng = random.Random()
+    combat_rng.setstate(saved.rng_state)
+    flow = GameFlow()
+    flow.transition('battle')
+    flow.turn = state.actions_taken
+    last = replay.actions[-1] if replay.actions else None
+    if last is not None and last.action == PRODUCTION and last.turn == state.actions_taken:
+        flow.mark_done('production')  # Granted before the page went away; it is in the log
+    st.session_state.update(new_session_state(get_shared_catalog(), replay.seed))
+    st.session_state.update(
+        flow=flow, combat_rng=combat_rng,
+        players=state.players, battle_grid=state.battle_grid, teams=state.teams, turn_order=state.turn_order,
+        effects=state.effects, ai_player=saved.handle.ai_player, match=saved.handle,
+        replay_log=ReplayWriter.resume(saved.log, state.players, replay_path(replay.seed)),
+        watch_code=watch_code(saved.handle.token),
+        ladder_names=default_ladder_names(saved.handle.ai_player),
+    )
+    attach_combat_log(events, stats)
+    publish_match()
+    return True
+
+def default_ladder_names(ai_player=None):
+    """Ladder names of a match whose players did not enter any"""
+    return [AI_LADDER_NAME if i == ai_player else f"Player {i + 1}" for i in range(2)]
+
+def new_combat_log(players=2):
+    """Event bus for a new battle, with the running stats subscribed to it"""
+    events = EventBus()
+    stats = CombatStats(players)
+    events.subscribe(stats.record)
+    return events, stats
+
+def attach_combat_log(events, stats):
+    """Show `events` in the combat log panel, starting from its oldest retained entry"""
+    st.session_state.combat_log = events
+    st.session_state.combat_stats = stats
+    st.session_state.combat_log_seen = 0
+    st.session_state.combat_log_lines = deque(maxlen=COMBAT_LOG_LINES)
+
+def new_session_state(catalog, seed):
+    """Every key a session starts with, for a new match with `seed`; no Streamlit calls,
+    so benchmarks build their sessions from it too"""
+    return {
+        "flow": GameFlow(),  # Phase and battle turn; see flow.py
+        "current_player": 1,
+        "current_turn": 1,
+        "max_turns": 5,
+        "players": [Player("Player 1"), Player("Player 2")],
+        # Every random roll in the match derives from this seed, so it can be replayed
+        "match_seed": seed,
+        "draft_rng": match_rng(seed, "draft"),
+        "combat_rng": match_rng(seed, "combat"),
+        # Only the per-session overlay is stored; the catalog is shared by all sessions
+        "roster": RosterOverlay(catalog, match_rng(seed, "setup")),
+        "role_counts": [
             {"War": 0, "Production": 0, "Support": 0},
             {"War": 0, "Production": 0, "Support": 0}
-        ]
-    if 'battle_grid' not in st.session_state:
-        st.session_state.battle_grid = {
-            'player1': [None, None, None, None, None],  # 5 positions for each player
-            'player2': [None, None, None, None, None]
-        }
-    if 'turn_order' not in st.session_state:
-        st.session_state.turn_order = []
-    if 'current_battle_turn' not in st.session_state:
-        st.session_state.current_battle_turn = 0
-    if 'battle_phase' not in st.session_state:
-        st.session_state.battle_phase = 'position'  # position, battle
+        ],
+        "battle_grid": {
+            'player1': [None] * TEAM_SIZE,  # TEAM_SIZE positions for each player
+            'player2': [None] * TEAM_SIZE,
+        },
+        "draft_advice": None,  # (picked ids per player, Recommendation) of the last advisor search
+        "teams": None,  # Alive/injured index per player, built with the grid
+        "turn_order": None,  # ActionTimeline once the battle grid is set up
+        "effects": StatusEffects(),  # Timed buffs of the battle, expiring by turn
+        "replay_log": None,  # ReplayWriter, started with the battle
+        "match": None,  # MatchHandle once the battle starts; its token is in the URL
+        "online": None,  # OnlineMatch when playing against another session
+        "ladder_names": default_ladder_names(),  # Who the result counts for on the ladder
+        "watch_code": None,  # Spectator code of the battle this session broadcasts
+        "spectating": None,  # spectate.MatchChannel this session watches
+        "spectating_version": None,
+        "combat_log": None,  # EventBus of the current battle (see events.py)
+        "combat_stats": None,
+        "large_battle": None,  # BattleState of a large battle; it has no replay
+        "large_battle_player": None,  # Team the user commands, or None to watch
+        "replay_turn": 0,
+        "ai_player": None,  # Index of the player controlled by the AI, if any
+        "win_estimate": None,  # Last win meter value, shown while a new one is solved
+    }
 
-def get_available_waifus_for_player(player_idx):
-    """Get waifus not selected by any player"""
-    selected_waifus = []
-    for player in st.session_state.players:
-        selected_waifus.extend([w.name for w in player.waifus])
-    
-    return [w for w in st.session_state.available_waifus if w.name not in selected_waifus]
+# Initialize session state
+@instrumented
+def init_session_state():
+    if 'flow' not in st.session_state and 'match' in st.query_params:
+        # A refreshed or reopened page: pick the stored match back up
+        if not resume_match(st.query_params['match']):
+            del st.query_params['match']
+    if 'flow' not in st.session_state:
+        # Sessions are only ever cleared as a whole, so a missing flow means every key is missing
+        st.session_state.update(new_session_state(get_shared_catalog(), random.SystemRandom().getrandbits(63)))
+
+def get_available_waifus_for_player(player_idx, specialty=None, sort="Roster", query="", page=0):
+    """Get one page of waifus not selected by any player"""
+    return st.session_state.roster.page(page, PAGE_SIZE, specialty, sort, query)
 
 def display_waifu_list(waifus, current_player, current_player_idx, role_count, tab_prefix=""):
     """Display a list of waifus with selection buttons"""
@@ -165,9 +197,7 @@ def display_waifu_list(waifus, current_player, current_player_idx, role_count, t
         with col1:
             st.write(f"**{waifu.name}**")
         with col2:
-            # Role emoji
-            role_emoji = {"War": "⚔️", "Production": "🏭", "Support": "🛡️"}
-            st.write(f"{role_emoji[waifu.specialty]} {waifu.specialty}")
+            st.write(f"{ROLE_EMOJI[waifu.specialty]} {waifu.specialty}")
         with col3:
             stat = waifu.get_stat(waifu.specialty)
             st.write(f"Stat: {stat}")
@@ -175,48 +205,55 @@ def display_waifu_list(waifus, current_player, current_player_idx, role_count, t
             # Check if player can select this role
             can_select = role_count[waifu.specialty] < 3
             if st.button(f"Select", key=f"select_{tab_prefix}_{waifu.name}_{current_player_idx}", disabled=not can_select):
-                current_player.add_waifu(waifu)
-                st.session_state.role_counts[current_player_idx][waifu.specialty] += 1
+                pick_character(current_player_idx, waifu.id)
                 st.rerun()
             
             if not can_select:
                 st.caption("Max 3 per role")
 
+def pick_character(player_idx, character_id):
+    """Add a roster character to a player's team; online, the match server must accept it first"""
+    if st.session_state.online is not None:
+        try:
+            st.session_state.online.pick(character_id)
+        except MatchError as e:
+            st.toast(f"⚠️ {e}")
+            return
+    character = st.session_state.roster.catalog.characters[character_id]
+    st.session_state.players[player_idx].add_waifu(st.session_state.roster.take(character_id))
+    st.session_state.role_counts[player_idx][character.specialty] += 1
+
+def display_waifu_tab(specialty, title, current_player, current_player_idx, role_count, tab_prefix, sort, query):
+    """Display one paginated tab of available waifus"""
+    roster = st.session_state.roster
+    if query:
+        total = sum(1 for _ in roster.available(specialty, sort, query))
+    else:
+        total = roster.count_available(specialty)
+    st.markdown(f"**{title} ({total} available):**")
+    
+    page = 1
+    pages = max(1, -(-total // PAGE_SIZE))
+    if pages > 1:
+        page_key = f"page_{tab_prefix}_{current_player_idx}"
+        # Picks shrink the pool, so keep a remembered page in range
+        if st.session_state.get(page_key, 1) > pages:
+            st.session_state[page_key] = pages
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, key=page_key)
+    
+    waifus = get_available_waifus_for_player(current_player_idx, specialty, sort, query, page - 1)
+    display_waifu_list(waifus, current_player, current_player_idx, role_count, tab_prefix)
+
 def setup_battle_grid():
     """Initialize battle positions for both players in FIFA-style formation"""
     # Place waifus organized by role for formation display
     for i, player in enumerate(st.session_state.players):
-        player_key = f'player{i+1}'
-        
-        # Group waifus by role
-        waifus_by_role = {"War": [], "Production": [], "Support": []}
-        for waifu in player.waifus:
-            waifus_by_role[waifu.specialty].append(waifu)
-        
-        # Flatten back to grid in role order for storage
-        grid_waifus = []
-        for role in ["War", "Production", "Support"]:
-            grid_waifus.extend(waifus_by_role[role])
-        
-        # Fill the grid
-        for j, waifu in enumerate(grid_waifus):
-            st.session_state.battle_grid[player_key][j] = waifu
-            waifu.current_position = j
-        
-        # Fill remaining slots with None
-        for j in range(len(grid_waifus), 5):
-            st.session_state.battle_grid[player_key][j] = None
+        st.session_state.battle_grid[f'player{i+1}'] = arrange_grid(player.waifus)
+    st.session_state.teams = build_teams(st.session_state.battle_grid)
 
 def calculate_turn_order():
-    """Calculate turn order based on speed"""
-    all_waifus = []
-    for player_idx, player in enumerate(st.session_state.players):
-        for waifu in player.waifus:
-            all_waifus.append((waifu, player_idx))
-    
-    # Sort by speed (highest first)
-    all_waifus.sort(key=lambda x: x[0].speed, reverse=True)
-    st.session_state.turn_order = all_waifus
+    """Build the action timeline from speed-based turn order"""
+    st.session_state.turn_order = build_timeline(st.session_state.players)
 
 def get_waifu_color(specialty):
     """Get color for waifu based on specialty"""
@@ -227,6 +264,7 @@ def get_waifu_color(specialty):
     }
     return colors.get(specialty, "#888888")
 
+@instrumented
 def start_screen():
     # Custom title with styling
     st.markdown('<h1 class="main-title">🎮 WAIFU BATTLE ARENA</h1>', unsafe_allow_html=True)
@@ -283,16 +321,159 @@ def start_screen():
     </div>
     """, unsafe_allow_html=True)
     
+    vs_ai = st.checkbox("🤖 Play against the AI (it controls Player 2)")
+    col1, col2 = st.columns(2)
+    with col1:
+        name1 = st.text_input("🏷️ Player 1 ladder name", key="ladder_name_1", placeholder="Player 1").strip()
+    with col2:
+        name2 = st.text_input("🏷️ Player 2 ladder name", key="ladder_name_2", placeholder="Player 2",
+                              disabled=vs_ai).strip()
+    
     # Start button
     if st.button("🚀 ENTER BATTLE", use_container_width=True):
-        st.session_state.game_phase = 'team_selection'
+        st.session_state.flow.transition('team_selection')
         st.session_state.current_player = 1
+        st.session_state.ai_player = 1 if vs_ai else None
+        if vs_ai:
+            get_ai_agent()  # Warm its workers now rather than on the AI's first move
+        names = default_ladder_names(st.session_state.ai_player)
+        st.session_state.ladder_names = [name1 or names[0], names[1] if vs_ai else name2 or names[1]]
         st.rerun()
+    
+    with st.expander("🏆 Ladder"):
+        display_ladder()
+    
+    # Networked play: each player uses their own browser session
+    st.markdown("### 🌐 Online Match")
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        create = st.button("🆕 Create Match", use_container_width=True)
+    with col2:
+        code = st.text_input("Match code", key="join_code", placeholder="Match code",
+                             label_visibility="collapsed").strip()
+    with col3:
+        join = st.button("🔗 Join Match", disabled=not code, use_container_width=True)
+    if create or join:
+        client = open_match_client()
+        try:
+            online = OnlineMatch.create(client) if create else OnlineMatch.join(client, code)
+        except (MatchError, ConnectionError) as e:
+            st.error(f"Could not {'create' if create else 'join'} the match: {e}")
+        else:
+            start_online_match(online)
+            st.rerun()
+    
+    # Read-only view of a match played in another session
+    st.markdown("### 👀 Watch a Match")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        spectate = st.text_input("Spectator code", key="watch_code_input", placeholder="Spectator or match code",
+                                 label_visibility="collapsed").strip()
+    with col2:
+        if st.button("👀 Watch", disabled=not spectate, use_container_width=True):
+            channel = get_spectator_hub().watch(spectate)
+            if channel is None:
+                st.error("No match with that code is being broadcast")
+            else:
+                st.session_state.spectating = channel
+                attach_combat_log(channel.events, channel.stats)
+                st.session_state.flow.transition('spectate')
+                st.rerun()
+    
+    # Raid-style battles: many teams of generated waifus on one field
+    st.markdown("### 🏟️ Large Battle")
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col1:
+        team_count = st.number_input("Teams", min_value=2, max_value=MAX_TEAMS, value=2)
+    with col2:
+        team_size = st.slider("Waifus per team", min_value=TEAM_SIZE, max_value=MAX_LARGE_TEAM_SIZE,
+                              value=MAX_LARGE_TEAM_SIZE)
+    with col3:
+        command = st.checkbox("🎮 Command Team 1 yourself", value=True)
+    if st.button("🏟️ START LARGE BATTLE", use_container_width=True):
+        start_large_battle(team_count, team_size, 0 if command else None)
+        st.rerun()
+
+def display_ladder():
+    """Top standings, character pick and win rates, and a character's best players (see ladder.py)"""
+    ladder = get_ladder()
+    standings = ladder.leaderboard(LADDER_ROWS)
+    if not standings:
+        st.caption("No ranked matches yet. Finish a local match to get on the ladder.")
+        return
+    st.dataframe([{"Player": s.name, "Rating": round(s.rating), "Won": s.wins, "Played": s.games}
+                  for s in standings], hide_index=True, use_container_width=True)
+    characters = ladder.characters()
+    st.dataframe([{"Character": c.name, "Pick rate": f"{c.pick_rate:.0%}", "Win rate": f"{c.win_rate:.0%}",
+                   "Picks": c.picks} for c in characters], hide_index=True, use_container_width=True)
+    character = st.selectbox("Best players with", [c.name for c in characters], key="ladder_character")
+    for player, picks, wins in ladder.top_players(character, LADDER_ROWS):
+        st.caption(f"{player}: {wins} wins in {picks} matches")
+
+def start_large_battle(team_count, team_size, player_idx):
+    """Switch this session to a large battle; the other teams are played automatically"""
+    events, stats = new_combat_log(team_count)
+    st.session_state.large_battle = new_large_battle(
+        team_count, team_size, match_rng(st.session_state.match_seed, "combat"), events)
+    st.session_state.large_battle_player = player_idx
+    attach_combat_log(events, stats)
+    st.session_state.flow.transition('large_battle')
+
+def start_online_match(online):
+    """Switch this session to a networked match; the seed shared by the server fixes the roster"""
+    st.session_state.online = online
+    st.session_state.match_seed = online.seed
+    st.session_state.roster = RosterOverlay(get_shared_catalog(), match_rng(online.seed, "setup"))
+    st.session_state.current_player = online.seat + 1
+    st.session_state.ai_player = None
+    st.session_state.flow.transition('team_selection')
+
+def sync_online_draft(online):
+    """Fetch the server's view of the draft and copy in the opponent's new picks"""
+    online.sync()
+    opponent_idx = 1 - online.seat
+    opponent = st.session_state.players[opponent_idx]
+    for character_id in online.opponent_picks[len(opponent.waifus):]:
+        character = st.session_state.roster.catalog.characters[character_id]
+        opponent.add_waifu(st.session_state.roster.take(character_id))
+        st.session_state.role_counts[opponent_idx][character.specialty] += 1
+
+@st.fragment(run_every=ONLINE_POLL_INTERVAL)
+def wait_for_opponent():
+    """Poll the match server; rerun the whole app once the opponent has done something"""
+    if st.session_state.online.sync():
+        st.rerun()
+    st.caption("⏳ Waiting for your opponent...")
 
+def auto_pick_team(player_idx):
+    """Fill an AI-controlled player's team with random legal picks"""
+    player = st.session_state.players[player_idx]
+    role_count = st.session_state.role_counts[player_idx]
+    candidates = list(st.session_state.roster.available())
+    st.session_state.draft_rng.shuffle(candidates)
+    for character in candidates:
+        if len(player.waifus) == TEAM_SIZE:
+            break
+        if role_count[character.specialty] < MAX_PER_ROLE:
+            player.add_waifu(st.session_state.roster.take(character.id))
+            role_count[character.specialty] += 1
+
+@instrumented
 def team_selection_screen():
+    online = st.session_state.online
+    if online is not None:
+        sync_online_draft(online)
+        if online.log_state is not None:
+            # Both teams are complete and the server has started the battle
+            st.session_state.flow.transition('battle')
+            st.rerun()
+    
     current_player_idx = st.session_state.current_player - 1
     current_player = st.session_state.players[current_player_idx]
     
+    if current_player_idx == st.session_state.ai_player and len(current_player.waifus) < TEAM_SIZE:
+        auto_pick_team(current_player_idx)
+    
     player_color = "🔵" if current_player_idx == 0 else "🔴"
     st.markdown(f'<h1 class="main-title">{player_color} {current_player.name.upper()} - TEAM SELECTION</h1>', unsafe_allow_html=True)
     
@@ -303,6 +484,10 @@ def team_selection_screen():
     </div>
     """, unsafe_allow_html=True)
     
+    if online is not None:
+        status = "opponent joined" if online.joined else "share this code with your opponent"
+        st.caption(f"🌐 Online match **{online.code}** · {status}")
+    
     # Show current team
     if current_player.waifus:
         st.markdown("### 🌟 Your Team:")
@@ -328,252 +513,350 @@ def team_selection_screen():
     
     # Show available waifus
     if len(current_player.waifus) < 5:
+        display_draft_advice(current_player, current_player_idx)
         st.markdown("### 📋 Available Waifus:")
-        available = get_available_waifus_for_player(current_player_idx)
+        
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            query = st.text_input("🔍 Search by name", key="roster_search").strip()
+        with col2:
+            sort = st.selectbox("Sort by", list(SORT_KEYS), key="roster_sort")
         
         # Filter by role tabs
         tab1, tab2, tab3, tab4 = st.tabs(["All", "⚔️ War", "🏭 Production", "🛡️ Support"])
         
         with tab1:
-            st.markdown("**All Available Characters:**")
-            display_waifu_list(available, current_player, current_player_idx, role_count, "all")
+            display_waifu_tab(None, "All Available Characters", current_player, current_player_idx, role_count, "all", sort, query)
         
         with tab2:
-            war_waifus = [w for w in available if w.specialty == "War"]
-            st.markdown(f"**War Specialists ({len(war_waifus)} available):**")
-            display_waifu_list(war_waifus, current_player, current_player_idx, role_count, "war")
+            display_waifu_tab("War", "War Specialists", current_player, current_player_idx, role_count, "war", sort, query)
         
         with tab3:
-            prod_waifus = [w for w in available if w.specialty == "Production"]
-            st.markdown(f"**Production Specialists ({len(prod_waifus)} available):**")
-            display_waifu_list(prod_waifus, current_player, current_player_idx, role_count, "prod")
+            display_waifu_tab("Production", "Production Specialists", current_player, current_player_idx, role_count, "prod", sort, query)
         
         with tab4:
-            support_waifus = [w for w in available if w.specialty == "Support"]
-            st.markdown(f"**Support Specialists ({len(support_waifus)} available):**")
-            display_waifu_list(support_waifus, current_player, current_player_idx, role_count, "support")
+            display_waifu_tab("Support", "Support Specialists", current_player, current_player_idx, role_count, "support", sort, query)
     
     # Progress to next phase
     if len(current_player.waifus) == 5:
-        if st.session_state.current_player == 1:
+        if online is not None:
+            st.info("✅ Team locked in. The battle starts when your opponent's team is complete.")
+            wait_for_opponent()
+        elif st.session_state.current_player == 1:
             if st.button("✅ Confirm Team & Continue to Player 2", use_container_width=True):
                 st.session_state.current_player = 2
                 st.rerun()
         else:
             if st.button("🎮 Start Battle!", use_container_width=True):
-                st.session_state.game_phase = 'battle_setup'
-                st.session_state.current_player = 1
-                st.session_state.battle_phase = 'position'
-                setup_battle_grid()
+                st.session_state.flow.transition('battle_setup', enter=prepare_battle)
                 st.rerun()
 
+def prepare_battle():
+    """team_selection -> battle_setup: place both teams and build the turn order"""
+    st.session_state.current_player = 1
+    setup_battle_grid()
+    calculate_turn_order()
+
+def display_draft_advice(current_player, current_player_idx):
+    """Suggest the best next pick (see draft.py) with a button to take it"""
+    roster = st.session_state.roster
+    players = st.session_state.players
+    # The search is time-bounded, so it would cost CPU and could change its answer on every
+    # rerun; it runs again only when a pick changes the position
+    picked_ids = {id(waifu): character_id for character_id, waifu in roster.waifus.items()}
+    picks = tuple(tuple(picked_ids[id(w)] for w in player.waifus) for player in players)
+    cached = st.session_state.draft_advice
+    if cached is not None and cached[0] == picks:
+        advice = cached[1]
+    else:
+        candidates = [Candidate(c.id, c.name, c.specialty, roster.speed(c.id)) for c in roster.available()]
+        teams = [[(w.specialty, w.speed) for w in player.waifus] for player in players]
+        advice = recommend(candidates, teams, DRAFT_TIME_BUDGET)
+        st.session_state.draft_advice = (picks, advice)
+    if advice is None:
+        return
+    pick = advice.candidate
+    edge = advice.score if current_player_idx == 0 else -advice.score
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.info(f"💡 Advisor: pick **{pick.name}** ({ROLE_EMOJI[pick.specialty]} {pick.specialty}, "
+                f"speed {pick.speed}) · draft score {edge:+.2f}")
+    with col2:
+        if st.button("✅ Take Suggestion", key=f"take_advice_{current_player_idx}", use_container_width=True):
+            pick_character(current_player_idx, pick.id)
+            st.rerun()
+
+@instrumented
 def battle_setup_screen():
     """Screen for positioning waifus before battle"""
     st.markdown('<h1 class="main-title">⚔️ BATTLE SETUP</h1>', unsafe_allow_html=True)
     
-    if st.session_state.battle_phase == 'position':
-        st.markdown("### 📋 Team Positioning")
-        st.markdown("Your waifus are automatically positioned by role. Ready to battle?")
-        
-        # Display battle formation and action order
-        st.markdown("### ⚔️ Battle Formation")
-        
-        col_battle, col_action_bar = st.columns([3, 1])
-        
-        with col_battle:
-            display_battle_grid_vertical()
-        
-        with col_action_bar:
-            calculate_turn_order()
-            display_action_order_bar()
-        
-        # Start battle button
-        if st.button("🚀 Start Battle!", use_container_width=True):
-            st.session_state.battle_phase = 'battle'
-            st.session_state.current_battle_turn = 0
-            st.session_state.game_phase = 'battle'
-            st.rerun()
+    st.markdown("### 📋 Team Positioning")
+    st.markdown("Your waifus are automatically positioned by role. Ready to battle?")
+    
+    # Display battle formation and action order
+    st.markdown("### ⚔️ Battle Formation")
+    
+    col_battle, col_action_bar = st.columns([3, 1])
+    
+    with col_battle:
+        display_battle_grid_vertical()
+    
+    with col_action_bar:
+        display_action_order_bar()
+    
+    # Start battle button
+    if st.button("🚀 Start Battle!", use_container_width=True):
+        st.session_state.flow.transition('battle', enter=start_battle)
+        st.rerun()
+
+def start_battle():
+    """battle_setup -> battle: start the replay log and the stored match"""
+    st.session_state.flow.turn = 0
+    seed = st.session_state.match_seed
+    st.session_state.replay_log = ReplayWriter(replay_path(seed))
+    st.session_state.replay_log.start(seed, st.session_state.players)
+    st.session_state.match = MatchHandle(new_token(), seed, st.session_state.ai_player)
+    get_match_store().save(st.session_state.match, st.session_state.replay_log, st.session_state.combat_rng)
+    st.query_params['match'] = st.session_state.match.token
+    st.session_state.watch_code = watch_code(st.session_state.match.token)
+    attach_combat_log(*new_combat_log())
+    publish_match()
+    get_win_solver().win_probability(st.session_state.players, st.session_state.teams)  # Start the first solve
 
-def display_battle_grid_vertical():
+def display_battle_grid_vertical(battle_grid=None):
     """Display the vertical battle grid with FIFA-style formation layout"""
+    battle_grid = battle_grid or st.session_state.battle_grid
+    display_formations(formation_cards(battle_grid['player1']), formation_cards(battle_grid['player2']))
+
+def display_formations(cards1, cards2):
+    """Both formations from their card tuples (see spectate.formation_cards)"""
     # Player 2 at top (opponent) - reversed formation
     st.markdown("#### 🔴 Player 2")
-    grid2 = st.session_state.battle_grid['player2']
-    display_formation_layout(grid2, player_idx=1, reverse=True)
+    display_formation_layout(cards2, reverse=True)
     
     # Empty space between formations
     st.markdown("<div style='height: 40px;'></div>", unsafe_allow_html=True)
     
     # Player 1 at bottom (you)
     st.markdown("#### 🔵 Player 1")
-    grid1 = st.session_state.battle_grid['player1']
-    display_formation_layout(grid1, player_idx=0, reverse=False)
+    display_formation_layout(cards1, reverse=False)
 
-def display_formation_layout(grid, player_idx, reverse=False):
-    """Display waifus in FIFA-style formation based on roles"""
-    # Get waifus and group by role
-    waifus_by_role = {"War": [], "Production": [], "Support": []}
-    for waifu in grid:
-        if waifu:
-            waifus_by_role[waifu.specialty].append(waifu)
-    
+def display_formation_layout(cards, reverse=False):
+    """Display waifus in FIFA-style formation based on roles, as a single element"""
+    st.markdown(render_formation(cards, reverse), unsafe_allow_html=True)
+
+@lru_cache(maxsize=4096)
+def render_formation(cards, reverse):
+    """HTML for one formation: a centered row of cards per role, or an empty-row marker"""
     # Define formation order (normal or reversed)
     role_order = ["Support", "Production", "War"] if reverse else ["War", "Production", "Support"]
     
+    rows = []
     for role in role_order:
-        waifus_in_role = waifus_by_role[role]
-        if waifus_in_role:
-            # Display role row with centering
-            cols = st.columns([1, 2, 1])  # Add padding columns for centering
-            with cols[1]:
-                role_cols = st.columns(len(waifus_in_role))
-                for i, waifu in enumerate(waifus_in_role):
-                    with role_cols[i]:
-                        display_waifu_card(waifu, waifu.specialty)
+        row = [render_waifu_card(*card) for card in cards if card[4] == role]
+        if row:
+            rows.append(f'<div class="formation-row">{"".join(row)}</div>')
         else:
-            # Display empty role indication
-            display_empty_role_row(role)
+            rows.append(render_empty_role_row(role))
+    return "".join(rows)
 
-def display_waifu_card(waifu, slot):
-    """Display a waifu card with role-specific styling"""
-    if not waifu:
-        return
-    
-    # Get role-specific colors and emojis
-    role_colors = {
-        "War": "#ff4444",      # Red
-        "Production": "#ff8844", # Orange
-        "Support": "#4444ff"    # Blue
-    }
-    
-    role_emoji = {"War": "⚔️", "Production": "🏭", "Support": "🛡️"}
-    
-    color = role_colors.get(slot, "#888888")
-    emoji = role_emoji.get(slot, "❓")
+@lru_cache(maxsize=4096)
+def render_waifu_card(name, hp, max_hp, speed, slot, power=0, guard=0):
+    """HTML for a waifu card; cached on the values that change between reruns"""
+    role_class = ROLE_CLASS.get(slot, "unknown")
+    emoji = ROLE_EMOJI.get(slot, "❓")
     
     # Health bar color
-    hp_percentage = (waifu.hp / waifu.max_hp) * 100
+    hp_percentage = (hp / max_hp) * 100
     if hp_percentage > 60:
-        health_color = "#4CAF50"
+        health_class = "hp-high"
     elif hp_percentage > 30:
-        health_color = "#FF9800"
+        health_class = "hp-mid"
     else:
-        health_color = "#F44336"
+        health_class = "hp-low"
     
-    st.markdown(f"""
-    <div style="
-        background: linear-gradient(145deg, {color}, {color}cc);
-        border: 2px solid #333;
-        border-radius: 15px;
-        padding: 15px;
-        text-align: center;
-        color: white;
-        font-weight: bold;
-        font-family: 'Courier New', monospace;
-        box-shadow: 0 4px 8px rgba(0,0,0,0.3);
-        margin: 8px;
-        min-height: 120px;
-    ">
-        <div style="font-size: 20px; margin-bottom: 5px;">{emoji}</div>
-        <div style="font-size: 14px; margin-bottom: 5px;">{waifu.name}</div>
-        <div style="font-size: 12px; margin-bottom: 5px;">SPD: {waifu.speed}</div>
-        <div style="background: #333; border-radius: 10px; height: 8px; margin: 5px 0;">
-            <div style="background: {health_color}; height: 100%; width: {hp_percentage}%; border-radius: 10px;"></div>
-        </div>
-        <div style="font-size: 10px;">{waifu.hp}/{waifu.max_hp} HP</div>
-    </div>
-    """, unsafe_allow_html=True)
+    return (
+        f'<div class="waifu-card {role_class}">'
+        f'<div class="wc-emoji">{emoji}</div>'
+        f'<div class="wc-name">{name}</div>'
+        f'<div class="wc-speed">SPD: {speed}</div>'
+        f'{render_status_badges(power, guard)}'
+        f'<div class="hp-bar"><div class="hp-fill {health_class}" style="width: {hp_percentage}%;"></div></div>'
+        f'<div class="wc-hp">{hp}/{max_hp} HP</div>'
+        f'</div>'
+    )
+
+def render_status_badges(power, guard):
+    """HTML for a card's active attack and shield bonuses, if any"""
+    badges = []
+    if power:
+        badges.append(f"🔥+{power}%")
+    if guard:
+        badges.append(f"🛡️{guard}")
+    return f'<div class="wc-status">{" ".join(badges)}</div>' if badges else ''
+
+def render_empty_role_row(role):
+    """HTML for an empty row for a role with no waifus"""
+    return (
+        f'<div class="empty-role">'
+        f'<div class="er-emoji">{ROLE_EMOJI[role]}</div>'
+        f'<div>No {role} Units</div>'
+        f'</div>'
+    )
 
-def display_empty_role_row(role):
-    """Display an empty row for a role with no waifus"""
-    role_emoji = {"War": "⚔️", "Production": "🏭", "Support": "🛡️"}
+@lru_cache(maxsize=4096)
+def render_action_entry(name, speed, specialty, player_idx, is_current):
+    """HTML for one action order entry; cached on the values that change between reruns"""
+    player_class = "p1" if player_idx == 0 else "p2"
+    player_symbol = "🔵" if player_idx == 0 else "🔴"
+    current_class = " current" if is_current else ""
+    active = '<div class="ae-active">◄ ACTIVE</div>' if is_current else ''
     
-    st.markdown(f"""
-    <div style="
-        background: linear-gradient(145deg, #2a2a2a, #1e1e1e);
-        border: 2px dashed #444;
-        border-radius: 15px;
-        padding: 20px;
-        text-align: center;
-        color: #666;
-        margin: 8px;
-        font-family: 'Courier New', monospace;
-    ">
-        <div style="font-size: 20px;">{role_emoji[role]}</div>
-        <div>No {role} Units</div>
-    </div>
-    """, unsafe_allow_html=True)
+    return (
+        f'<div class="action-entry {player_class}{current_class}">'
+        f'<div class="ae-emoji">{ROLE_EMOJI[specialty]}</div>'
+        f'<div class="ae-name">{name}</div>'
+        f'<div class="ae-small">SPD: {speed}</div>'
+        f'<div class="ae-small">{player_symbol}</div>'
+        f'{active}'
+        f'</div>'
+    )
 
 def display_action_order_bar():
     """Display the vertical action order bar like HSR"""
-    st.markdown("""
-    <div style="text-align: center; color: #ff6b6b; font-weight: bold; 
-                font-family: 'Courier New', monospace; margin-bottom: 15px;">
-        ⚡ ACTION ORDER
-    </div>
-    """, unsafe_allow_html=True)
-    
     # Get current turn order
-    if not st.session_state.turn_order:
+    if st.session_state.turn_order is None:
         calculate_turn_order()
     
-    # Display each character in turn order
-    for i, (waifu, player_idx) in enumerate(st.session_state.turn_order):
-        player_color = "#4488ff" if player_idx == 0 else "#ff4444"
-        player_symbol = "🔵" if player_idx == 0 else "🔴"
-        role_emoji = {"War": "⚔️", "Production": "🏭", "Support": "🛡️"}
-        
-        # Highlight current turn
-        is_current = i == st.session_state.current_battle_turn
-        border_color = "#ffff00" if is_current else "#333"
-        glow = "box-shadow: 0 0 15px rgba(255, 255, 0, 0.8);" if is_current else ""
-        
-        st.markdown(f"""
-        <div style="
-            background: linear-gradient(145deg, {player_color}, {player_color}cc);
-            border: 2px solid {border_color};
-            border-radius: 10px;
-            padding: 8px;
-            margin: 5px 0;
-            text-align: center;
-            color: white;
-            font-weight: bold;
-            font-family: 'Courier New', monospace;
-            font-size: 11px;
-            {glow}
-            {'transform: scale(1.05);' if is_current else ''}
-        ">
-            <div style="font-size: 14px;">{role_emoji[waifu.specialty]}</div>
-            <div style="font-size: 12px;">{waifu.name}</div>
-            <div style="font-size: 10px;">SPD: {waifu.speed}</div>
-            <div style="font-size: 10px;">{player_symbol}</div>
-            {'<div style="color: #ffff00; font-size: 10px;">◄ ACTIVE</div>' if is_current else ''}
-        </div>
-        """, unsafe_allow_html=True)
+    upcoming = st.session_state.turn_order.upcoming(ACTION_BAR_LENGTH)
+    display_action_entries([(waifu.name, waifu.speed, waifu.specialty, player_idx) for waifu, player_idx in upcoming])
+
+def display_action_entries(upcoming):
+    """Action order bar from (name, speed, specialty, player_idx) tuples, highlighting the current turn"""
+    entries = [render_action_entry(*action, i == 0) for i, action in enumerate(upcoming)]
+    st.markdown('<div class="action-title">⚡ ACTION ORDER</div>' + "".join(entries),
+                unsafe_allow_html=True)
+
+def display_combat_log():
+    """Latest combat events, newest first; only entries not shown before are formatted"""
+    if st.session_state.combat_log is None:
+        return
+    entries, _ = st.session_state.combat_log.since(st.session_state.combat_log_seen)
+    lines = st.session_state.combat_log_lines
+    for entry in entries:
+        lines.appendleft(render_log_entry(entry))
+    st.session_state.combat_log_seen = st.session_state.combat_log.next_seq
+    st.markdown('<div class="action-title">📜 COMBAT LOG</div>'
+                f'<div class="combat-log">{"".join(lines)}</div>', unsafe_allow_html=True)
+
+def render_log_entry(entry):
+    """HTML for one combat log line"""
+    player_class = "p1" if entry.player_idx == 0 else "p2"
+    return (
+        f'<div class="log-entry {player_class}">'
+        f'<span class="log-turn">{entry.turn + 1}</span> {html.escape(describe_entry(entry))}'
+        f'</div>'
+    )
 
+@instrumented
 def battle_screen():
     """Main battle screen with turn-based combat"""
     st.markdown('<h1 class="main-title">⚔️ BATTLE IN PROGRESS</h1>', unsafe_allow_html=True)
-    
+    battle_turn()
+
+@st.fragment
+def battle_turn():
+    """Everything that changes from turn to turn. Actions rerun only this fragment,
+    so the page shell (styles, title) is not rebuilt and re-sent on every click."""
+    # A fragment rerun does not go through main(), so it is measured on its own
+    with rerun_metrics(st.session_state) as metrics:
+        metrics.phase = 'battle'
+        play_turn()
+
+@instrumented
+def play_turn():
+    """Grant production, show the turn and take the current actor's action"""
     # Check for game over
     if check_game_over():
         return
     
     # Get current turn info
-    current_waifu, current_player_idx = st.session_state.turn_order[st.session_state.current_battle_turn]
+    current_waifu, current_player_idx = st.session_state.turn_order.current()
     current_player = st.session_state.players[current_player_idx]
     
-    # Generate production points at start of turn
-    if st.session_state.current_battle_turn == 0 or \
-       st.session_state.turn_order[st.session_state.current_battle_turn - 1][1] != current_player_idx:
-        generated = current_player.generate_production_points()
-        if generated > 0:
-            st.success(f"💰 {current_player.name} generated {generated} production points!")
+    # Generate production points at start of turn, once however often the turn is redrawn
+    if production_due(st.session_state.turn_order):
+        st.session_state.flow.once('production', grant_production, current_player, current_player_idx)
+    
+    display_turn_status(current_waifu, current_player, current_player_idx)
+    
+    # The AI plays its own turns; the rerun shows the result
+    if current_player_idx == st.session_state.ai_player:
+        play_ai_turn(current_waifu, current_player_idx)
+        return
+    
+    display_action_buttons(current_waifu, current_player,
+                           lambda action: perform_action(action, current_waifu, current_player_idx))
+
+def grant_production(player, player_idx):
+    """Start-of-turn production for the player about to act"""
+    turn = st.session_state.flow.turn
+    generated = player.generate_production_points()
+    if generated > 0:
+        st.session_state.replay_log.production(turn, player_idx, generated)
+        st.session_state.combat_log.publish(turn, player_idx, Event("production", player, None, None, generated))
+        publish_match()
+
+@instrumented
+def online_battle_screen():
+    """Battle screen of a networked match: the server resolves actions, this session renders them"""
+    online = st.session_state.online
+    online.sync()
+    log_state = online.log_state
+    st.session_state.players = log_state.players
+    st.session_state.battle_grid = log_state.battle_grid
+    st.session_state.teams = log_state.teams
+    st.session_state.turn_order = log_state.turn_order
+    st.session_state.effects = log_state.effects
+    st.session_state.flow.turn = log_state.actions_taken
+    st.session_state.replay_log = online.log
+    if st.session_state.combat_log is not online.events:
+        attach_combat_log(online.events, online.stats)
+    st.session_state.watch_code = online.code
+    if online.seat == 0:
+        publish_match()  # One broadcast per match: the creator's session sends it
     
+    st.markdown('<h1 class="main-title">⚔️ BATTLE IN PROGRESS</h1>', unsafe_allow_html=True)
+    if check_game_over():
+        return
+    
+    current_waifu, current_player_idx = st.session_state.turn_order.current()
+    current_player = st.session_state.players[current_player_idx]
+    display_turn_status(current_waifu, current_player, current_player_idx)
+    
+    if current_player_idx != online.seat:
+        wait_for_opponent()
+        return
+    display_action_buttons(current_waifu, current_player, play_online_action)
+
+def play_online_action(action):
+    """Send an action to the match server; its result arrives with the next sync"""
+    try:
+        st.session_state.online.act(action)
+    except MatchError as e:
+        st.error(str(e))
+        return
+    st.rerun()
+
+def display_turn_status(current_waifu, current_player, current_player_idx):
+    """Whose turn it is, production, win meter, battle grid and action order"""
     # Display current turn info
     player_color = "🔵" if current_player_idx == 0 else "🔴"
     st.markdown(f"### {player_color} {current_player.name}'s Turn")
     st.markdown(f"**Active Waifu:** {current_waifu.name} ({current_waifu.specialty})")
+    if st.session_state.watch_code:
+        st.caption(f"👀 Spectator code: **{st.session_state.watch_code}**")
     
     # Display production points
     col1, col2 = st.columns(2)
@@ -581,6 +864,7 @@ def battle_screen():
         st.metric("💰 Production Points", current_player.production_points)
     with col2:
         st.metric("⚡ Production Rate", f"{current_player.calculate_production_rate()}/turn")
+    display_win_meter()
     
     # Display battle grid and turn order side by side
     st.markdown("---")
@@ -591,9 +875,12 @@ def battle_screen():
     
     with col_action_bar:
         display_action_order_bar()
+        display_combat_log()
     
     st.markdown("---")
-    
+
+def display_action_buttons(current_waifu, current_player, act):
+    """Ability, attack and skip buttons; `act(action)` performs the chosen action"""
     # Show available abilities for current waifu
     abilities = current_waifu.get_active_abilities(current_waifu.specialty)
     st.markdown(f"### ⚡ {current_waifu.name}'s Abilities:")
@@ -607,25 +894,83 @@ def battle_screen():
                         key=f"ability_{i}", 
                         disabled=not can_afford,
                         use_container_width=True):
-                use_ability(ability, current_waifu, current_player_idx)
+                act(i)
     
     with col2:
         if st.button("🔄 Basic Attack", use_container_width=True):
-            basic_attack(current_waifu, current_player_idx)
+            act(BASIC_ATTACK)
     
     with col3:
         if st.button("⏭️ Skip Turn", use_container_width=True):
-            next_turn()
+            act(SKIP_TURN)
     
     # Show ability details
     st.markdown("#### Ability Details:")
     for ability in abilities:
         cost_color = "🟢" if current_player.production_points >= ability.cost else "🔴"
-        st.markdown(f"{cost_color} **{ability.name}** - Cost: {ability.cost} - Type: {ability.effect_type}")
+        duration = f" for {ability.definition.duration} turns" if ability.definition.duration else ""
+        st.markdown(f"{cost_color} **{ability.name}** - Cost: {ability.cost} - "
+                    f"Type: {ability.effect.replace('_', ' ')} {ability.strength}{duration}")
+
+@st.cache_resource
+def get_win_solver():
+    """Win-probability solver shared by all sessions; new team mixtures are solved off the render path"""
+    return BackgroundSolver()
+
+def display_win_meter():
+    """Estimated win probability for both players (random-play model, see winprob.py).
+
+    While a new team mixture is being solved, the last estimate stays up.
+    """
+    p1 = get_win_solver().win_probability(st.session_state.players, st.session_state.teams)
+    if p1 is None:
+        p1 = st.session_state.win_estimate
+    else:
+        st.session_state.win_estimate = p1
+    if p1 is None:
+        st.progress(0.5, text="🔵 Player 1 · estimating... · Player 2 🔴")
+    else:
+        st.progress(p1, text=f"🔵 Player 1 ≈{p1:.0%} · ≈{1 - p1:.0%} Player 2 🔴")
+    st.caption("Estimate under random play; active status effects (attack up, shields, speed) are not counted.")
+
+@st.cache_resource
+def get_ai_agent():
+    """MCTS agent shared by all sessions; building it starts and warms its worker pool"""
+    return MCTSAgent(time_budget=AI_TIME_BUDGET)
 
-def use_ability(ability, current_waifu, current_player_idx):
-    """Use an ability in battle"""
+@instrumented
+def play_ai_turn(current_waifu, current_player_idx):
+    """Let the AI choose and perform the current action"""
+    st.markdown(f"### 🤖 {current_waifu.name} is thinking...")
+    state = BattleState.from_parts(
+        st.session_state.players, st.session_state.battle_grid,
+        st.session_state.teams, st.session_state.turn_order,
+        actions_taken=st.session_state.flow.turn, effects=st.session_state.effects,
+    )
+    perform_action(get_ai_agent().choose(state), current_waifu, current_player_idx)
+
+def current_battle():
+    """BattleState view of the session's battle, sharing its objects"""
+    return BattleState.from_parts(
+        st.session_state.players, st.session_state.battle_grid,
+        st.session_state.teams, st.session_state.turn_order, st.session_state.combat_rng,
+        st.session_state.flow.turn, st.session_state.effects,
+    )
+
+def perform_action(action, current_waifu, current_player_idx):
+    """Resolve an action (ability index, BASIC_ATTACK or SKIP_TURN) for the current waifu"""
+    if action == BASIC_ATTACK:
+        basic_attack(current_waifu, current_player_idx)
+    elif action == SKIP_TURN:
+        next_turn(current_waifu, current_player_idx, SKIP_TURN)
+    else:
+        use_ability(action, current_waifu, current_player_idx)
+
+@instrumented
+def use_ability(index, current_waifu, current_player_idx):
+    """Use one of the current waifu's active abilities in battle"""
     current_player = st.session_state.players[current_player_idx]
+    ability = current_waifu.get_ability(current_waifu.specialty, index)
     
     # Check cost
     if current_player.production_points < ability.cost:
@@ -636,71 +981,244 @@ def use_ability(ability, current_waifu, current_player_idx):
     current_player.production_points -= ability.cost
     
     # Apply ability effect
-    if ability.effect_type == "damage":
-        # Target enemy team
-        enemy_player_idx = 1 - current_player_idx
-        enemy_grid = st.session_state.battle_grid[f'player{enemy_player_idx + 1}']
-        
-        # Find alive enemies
-        alive_enemies = [w for w in enemy_grid if w and w.hp > 0]
-        if alive_enemies:
-            target = random.choice(alive_enemies)
-            damage = ability.value
-            target.hp = max(0, target.hp - damage)
-            st.success(f"💥 {current_waifu.name} used {ability.name}! {target.name} takes {damage} damage!")
-    
-    elif ability.effect_type == "heal":
-        # Target ally team
-        ally_grid = st.session_state.battle_grid[f'player{current_player_idx + 1}']
-        injured_allies = [w for w in ally_grid if w and w.hp > 0 and w.hp < w.max_hp]
-        if injured_allies:
-            target = random.choice(injured_allies)
-            heal = ability.value * 10  # Scale healing
-            target.hp = min(target.max_hp, target.hp + heal)
-            st.success(f"💚 {current_waifu.name} used {ability.name}! {target.name} heals {heal} HP!")
-    
-    elif ability.effect_type == "buff":
-        st.success(f"✨ {current_waifu.name} used {ability.name}! Team receives buff!")
-    
-    next_turn()
+    event = resolve_ability(ability, current_waifu, current_player_idx, current_battle())
+    
+    next_turn(current_waifu, current_player_idx, index, event)
 
+@instrumented
 def basic_attack(current_waifu, current_player_idx):
     """Perform a basic attack"""
-    enemy_player_idx = 1 - current_player_idx
-    enemy_grid = st.session_state.battle_grid[f'player{enemy_player_idx + 1}']
-    
-    # Find alive enemies
-    alive_enemies = [w for w in enemy_grid if w and w.hp > 0]
-    if alive_enemies:
-        target = random.choice(alive_enemies)
-        damage = random.randint(10, 20)
-        target.hp = max(0, target.hp - damage)
-        st.success(f"⚔️ {current_waifu.name} attacks {target.name} for {damage} damage!")
-    
-    next_turn()
-
-def next_turn():
-    """Advance to next turn"""
-    st.session_state.current_battle_turn = (st.session_state.current_battle_turn + 1) % len(st.session_state.turn_order)
-    st.rerun()
+    event = resolve_basic_attack(current_waifu, current_player_idx, st.session_state.teams,
+                                 st.session_state.combat_rng)
+    
+    next_turn(current_waifu, current_player_idx, BASIC_ATTACK, event)
+
+@instrumented
+def next_turn(current_waifu, current_player_idx, action, event=None):
+    """Log the finished action and advance to next turn"""
+    flow = st.session_state.flow
+    st.session_state.replay_log.action(flow.turn, current_waifu, current_player_idx, action, event)
+    st.session_state.combat_log.publish(flow.turn, current_player_idx,
+                                        event or Event("skip", current_waifu, None, None, None))
+    finish_action(st.session_state.turn_order, event)
+    flow.end_turn()
+    expire_effects(st.session_state.effects, flow.turn, st.session_state.turn_order)
+    get_match_store().save(st.session_state.match, st.session_state.replay_log, st.session_state.combat_rng)
+    publish_match()
+    rerun_turn()
+
+def rerun_turn():
+    """Rerun only battle_turn() when the action came from a fragment rerun (a click in it).
+
+    Streamlit refuses fragment-scoped reruns during a full run, e.g. an AI
+    move made while the whole page is being drawn; those rerun the app.
+    """
+    ctx = get_script_run_ctx()
+    st.rerun(scope="fragment" if ctx is not None and ctx.fragment_ids_this_run else "app")
 
 def check_game_over():
     """Check if the game is over"""
-    for player_idx, player in enumerate(st.session_state.players):
-        alive_count = sum(1 for w in player.waifus if w.hp > 0)
-        if alive_count == 0:
-            winner_idx = 1 - player_idx
-            winner = st.session_state.players[winner_idx]
-            st.success(f"🏆 {winner.name} WINS!")
-            
-            if st.button("🔄 Play Again"):
-                # Reset game state
-                for key in list(st.session_state.keys()):
-                    del st.session_state[key]
-                st.rerun()
-            return True
+    winner_idx = find_winner(st.session_state.teams)
+    if winner_idx is not None:
+        if st.session_state.online is None and st.session_state.match is not None:
+            st.session_state.flow.once('ladder', record_result, winner_idx)
+        winner = st.session_state.players[winner_idx]
+        st.success(f"🏆 {winner.name} WINS!")
+        st.caption(f"Match seed: {st.session_state.match_seed}")
+        display_combat_stats()
+        display_combat_log()
+        
+        if st.button("📼 Watch Replay"):
+            st.session_state.replay_turn = 0
+            st.session_state.flow.transition('replay')
+            st.rerun()
+        
+        play_again_button()
+        return True
     return False
 
+def record_result(winner_idx):
+    """Queue the finished match for the ladder; it counts once per match token"""
+    names = st.session_state.ladder_names
+    if names[0] == names[1]:
+        return  # Nobody to rate: the same name on both sides
+    teams = [tuple(w.name for w in player.waifus) for player in st.session_state.players]
+    loser_idx = 1 - winner_idx
+    get_ladder().record(MatchResult(st.session_state.match.token, names[winner_idx], names[loser_idx],
+                                    teams[winner_idx], teams[loser_idx], time.time()))
+
+def play_again_button():
+    if st.button("🔄 Play Again"):
+        # Reset game state
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.query_params.clear()
+        st.rerun()
+
+def display_combat_stats(names=None):
+    """Per-player totals of the finished battle"""
+    stats = st.session_state.combat_stats
+    if stats is None:
+        return
+    names = names or [player.name for player in st.session_state.players]
+    for col, player_idx in zip(st.columns(len(names)), range(len(names))):
+        with col:
+            st.markdown(f"**{names[player_idx]}**")
+            st.caption(f"⚔️ {stats.damage[player_idx]} damage · 💚 {stats.healing[player_idx]} healed · "
+                       f"💰 {stats.production[player_idx]} produced · {stats.actions[player_idx]} actions")
+
+@instrumented
+def large_battle_screen():
+    """Large battle: the whole field is one canvas, the other teams play automatically"""
+    st.markdown('<h1 class="main-title">🏟️ LARGE BATTLE</h1>', unsafe_allow_html=True)
+    large_battle_turn()
+
+@st.fragment
+def large_battle_turn():
+    """Like battle_turn(): actions rerun only this fragment"""
+    with rerun_metrics(st.session_state) as metrics:
+        metrics.phase = 'large_battle'
+        play_large_turn()
+
+@instrumented
+def play_large_turn():
+    """Play the automatic teams up to the user's next turn, then show the field and actions"""
+    state = st.session_state.large_battle
+    commander = st.session_state.large_battle_player
+    if commander is not None:
+        auto_play(state, AUTO_PLAY_LIMIT, stop_at=commander)
+    
+    if state.is_over():
+        st.success(f"🏆 {state.players[state.winner].name} WINS!")
+        st.caption(f"{state.actions_taken} actions")
+        display_battlefield(state)
+        display_combat_stats([player.name for player in state.players])
+        display_combat_log()
+        play_again_button()
+        return
+    
+    current_waifu, current_player_idx = state.current_actor()
+    current_player = state.players[current_player_idx]
+    st.markdown(f"### {current_player.name}'s Turn")
+    st.markdown(f"**Active Waifu:** {current_waifu.name} ({current_waifu.specialty}) · "
+                f"💰 {current_player.production_points} production points · action {state.actions_taken + 1}")
+    
+    col_battle, col_log = st.columns([3, 1])
+    with col_battle:
+        display_battlefield(state)
+    with col_log:
+        display_combat_log()
+    st.markdown("---")
+    
+    if current_player_idx == commander:
+        display_action_buttons(current_waifu, current_player, lambda action: play_large_actions(step, action))
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if commander is None and st.button("▶️ Next Action", use_container_width=True):
+            play_large_actions(auto_play, 1)
+    with col2:
+        if st.button("⏩ Auto-play Round", use_container_width=True):
+            play_large_actions(auto_play, len(state.turn_order))
+    with col3:
+        if st.button("⏭️ Auto-play to the End", use_container_width=True):
+            play_large_actions(auto_play, AUTO_PLAY_LIMIT)
+
+def auto_play(state, actions, stop_at=None):
+    """Play up to `actions` random actions, stopping early when team `stop_at` is to act"""
+    for _ in range(actions):
+        if state.is_over() or state.current_actor()[1] == stop_at:
+            return
+        step(state, random_policy(state))
+
+def play_large_actions(play, arg):
+    """Apply `play(state, arg)` to the large battle and rerun the fragment"""
+    play(st.session_state.large_battle, arg)
+    rerun_turn()
+
+def display_battlefield(state):
+    """Every unit of every team in one canvas, fed a compact state array (see battlefield.py)"""
+    grids = [state.battle_grid[f'player{i + 1}'] for i in range(len(state.players))]
+    current = state.current_actor()[0] if not state.is_over() else None
+    names = [player.name for player in state.players]
+    page = render_battlefield(names, len(grids[0]), encode_units(grids, current))
+    st.iframe(page, height=battlefield_height(len(names), len(grids[0])))
+
+@instrumented
+def spectate_screen():
+    """Read-only view of a broadcast match, drawn from the channel's latest frame"""
+    channel = st.session_state.spectating
+    st.session_state.spectating_version = channel.version
+    frame = channel.frame
+    st.markdown('<h1 class="main-title">👀 SPECTATING</h1>', unsafe_allow_html=True)
+    
+    if frame.winner is not None:
+        st.success(f"🏆 {frame.players[frame.winner][0]} WINS!")
+    else:
+        name, _, specialty, player_idx = frame.upcoming[0]
+        player_color = "🔵" if player_idx == 0 else "🔴"
+        st.markdown(f"### {player_color} {frame.players[player_idx][0]}'s Turn")
+        st.markdown(f"**Active Waifu:** {name} ({specialty}) · action {frame.turn + 1}")
+    
+    for col, (name, points) in zip(st.columns(len(frame.players)), frame.players):
+        with col:
+            st.metric(f"💰 {name}", points)
+    
+    col_battle, col_action_bar = st.columns([3, 1])
+    with col_battle:
+        display_formations(*frame.formations)
+    with col_action_bar:
+        display_action_entries(frame.upcoming)
+        display_combat_log()
+    
+    if frame.winner is not None:
+        display_combat_stats([name for name, _ in frame.players])
+    else:
+        watch_for_turns()
+    if st.button("⬅️ Stop Watching"):
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.rerun()
+
+@st.fragment(run_every=SPECTATE_POLL_INTERVAL)
+def watch_for_turns():
+    """Poll the watched channel; rerun the whole app once a new turn has been broadcast"""
+    if st.session_state.spectating.version != st.session_state.spectating_version:
+        st.rerun()
+    st.caption("🔴 Live")
+
+@instrumented
+def replay_screen():
+    """Step through the finished match; each turn is rebuilt from the replay log"""
+    st.markdown('<h1 class="main-title">📼 REPLAY</h1>', unsafe_allow_html=True)
+    replay = load_replay(st.session_state.replay_log.getvalue())
+    last_turn = replay.actions[-1].turn + 1 if replay.actions else 0
+    st.caption(f"Match seed: {replay.seed}")
+    
+    turn = st.slider("Turn", min_value=0, max_value=max(last_turn, 1), key="replay_turn")
+    # Only the selected turn is rendered; intermediate turns are applied without any UI
+    state = rebuild_state(replay, turn)
+    
+    col1, col2 = st.columns(2)
+    for col, player in zip((col1, col2), state.players):
+        with col:
+            st.metric(f"💰 {player.name}", player.production_points)
+    
+    col_battle, col_info = st.columns([3, 1])
+    with col_battle:
+        display_battle_grid_vertical(state.battle_grid)
+    with col_info:
+        if state.winner is not None:
+            st.success(f"🏆 {state.players[state.winner].name} WINS!")
+        else:
+            waifu, player_idx = state.current_actor()
+            st.markdown(f"**Next:** {waifu.name} ({state.players[player_idx].name})")
+    
+    if st.button("⬅️ Back to Results"):
+        st.session_state.flow.transition('battle')
+        st.rerun()
+
+@instrumented
 def apply_custom_css():
     """Apply custom dark theme CSS"""
     st.markdown("""
@@ -744,6 +1262,137 @@ def apply_custom_css():
             color: #ff6b6b;
         }
         
+        /* Waifu cards */
+        .waifu-card {
+            border: 2px solid #333;
+            border-radius: 15px;
+            padding: 15px;
+            text-align: center;
+            color: white;
+            font-weight: bold;
+            font-family: 'Courier New', monospace;
+            box-shadow: 0 4px 8px rgba(0,0,0,0.3);
+            margin: 8px;
+            min-height: 120px;
+            background: linear-gradient(145deg, #888888, #888888cc);
+        }
+        
+        .waifu-card.war {
+            background: linear-gradient(145deg, #ff4444, #ff4444cc);
+        }
+        
+        .waifu-card.production {
+            background: linear-gradient(145deg, #ff8844, #ff8844cc);
+        }
+        
+        .waifu-card.support {
+            background: linear-gradient(145deg, #4444ff, #4444ffcc);
+        }
+        
+        .formation-row {
+            display: flex;
+            justify-content: center;
+            margin: 0 25%;
+        }
+        
+        .formation-row .waifu-card {
+            flex: 1;
+        }
+        
+        .empty-role {
+            background: linear-gradient(145deg, #2a2a2a, #1e1e1e);
+            border: 2px dashed #444;
+            border-radius: 15px;
+            padding: 20px;
+            text-align: center;
+            color: #666;
+            margin: 8px;
+            font-family: 'Courier New', monospace;
+        }
+        
+        .er-emoji {font-size: 20px;}
+        
+        .wc-emoji {font-size: 20px; margin-bottom: 5px;}
+        .wc-name {font-size: 14px; margin-bottom: 5px;}
+        .wc-speed {font-size: 12px; margin-bottom: 5px;}
+        .wc-status {font-size: 11px; color: #ffd54f; margin-bottom: 5px;}
+        .wc-hp {font-size: 10px;}
+        
+        .hp-bar {
+            background: #333;
+            border-radius: 10px;
+            height: 8px;
+            margin: 5px 0;
+        }
+        
+        .hp-fill {
+            height: 100%;
+            border-radius: 10px;
+        }
+        
+        .hp-high {background: #4CAF50;}
+        .hp-mid {background: #FF9800;}
+        .hp-low {background: #F44336;}
+        
+        /* Action order bar */
+        .action-title {
+            text-align: center;
+            color: #ff6b6b;
+            font-weight: bold;
+            font-family: 'Courier New', monospace;
+            margin-bottom: 15px;
+        }
+        
+        .action-entry {
+            border: 2px solid #333;
+            border-radius: 10px;
+            padding: 8px;
+            margin: 5px 0;
+            text-align: center;
+            color: white;
+            font-weight: bold;
+            font-family: 'Courier New', monospace;
+            font-size: 11px;
+        }
+        
+        .action-entry.p1 {
+            background: linear-gradient(145deg, #4488ff, #4488ffcc);
+        }
+        
+        .action-entry.p2 {
+            background: linear-gradient(145deg, #ff4444, #ff4444cc);
+        }
+        
+        .action-entry.current {
+            border-color: #ffff00;
+            box-shadow: 0 0 15px rgba(255, 255, 0, 0.8);
+            transform: scale(1.05);
+        }
+        
+        .ae-emoji {font-size: 14px;}
+        .ae-name {font-size: 12px;}
+        .ae-small {font-size: 10px;}
+        .ae-active {color: #ffff00; font-size: 10px;}
+        
+        /* Combat log */
+        .combat-log {
+            max-height: 320px;
+            overflow-y: auto;
+            margin-top: 5px;
+            font-family: 'Courier New', monospace;
+            font-size: 11px;
+        }
+        
+        .log-entry {
+            padding: 4px 6px;
+            margin: 3px 0;
+            border-left: 3px solid #4488ff;
+            color: #dddddd;
+        }
+        
+        .log-entry.p2 {border-left-color: #ff4444;}
+        .log-turn {color: #888888;}
+        
         /* Hide Streamlit branding */
         #MainMenu {visibility: hidden;}
         footer {visibility: hidden;}
@@ -784,21 +1433,32 @@ def main():
         initial_sidebar_state="collapsed"
     )
     
-    # Apply custom styling
-    apply_custom_css()
-    
-    # Initialize session state
-    init_session_state()
-    
-    # Route to appropriate screen based on game phase
-    if st.session_state.game_phase == 'start':
-        start_screen()
-    elif st.session_state.game_phase == 'team_selection':
-        team_selection_screen()
-    elif st.session_state.game_phase == 'battle_setup':
-        battle_setup_screen()
-    elif st.session_state.game_phase == 'battle':
-        battle_screen()
+    with rerun_metrics(st.session_state) as metrics:
+        # Apply custom styling
+        apply_custom_css()
+        
+        # Initialize session state
+        init_session_state()
+        phase = st.session_state.flow.phase
+        metrics.phase = phase
+        
+        # Route to appropriate screen based on game phase
+        if phase == 'start':
+            start_screen()
+        elif phase == 'team_selection':
+            team_selection_screen()
+        elif phase == 'battle_setup':
+            battle_setup_screen()
+        elif phase == 'battle' and st.session_state.online is not None:
+            online_battle_screen()
+        elif phase == 'battle':
+            battle_screen()
+        elif phase == 'replay':
+            replay_screen()
+        elif phase == 'large_battle':
+            large_battle_screen()
+        elif phase == 'spectate':
+            spectate_screen()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,290 @@
+"""Win probability of a battle by solving a Markov chain over quantized HP.
+
+Both sides are assumed to play the uniform random policy (as in
+simulate.py and the AI rollouts). The chain keeps, per team, the multiset
+of living units' HP levels (LEVEL_HP); per action:
+
+* the acting team is drawn in proportion to living units (one action per
+  unit per round),
+* it deals damage to a uniformly chosen living enemy, heals a uniformly
+  chosen injured ally, or does nothing, with the mixture of its living
+  units' legal actions (10-20 attack damage, and damage and heal
+  abilities of their strength: rolled value times the ability's scale),
+* HP that falls between two levels is split between them so the expected
+  HP is preserved.
+
+Each team's damage and heal kernels are small matrices over its multiset
+states, so value iteration over all (team 0, team 1) states is a few
+matrix products per sweep. The solve is exact for this chain, but the
+chain is a model of the engine, not the engine itself. Against random
+playouts of the real engine (which has a fixed turn order and per-unit
+abilities) it is typically within a few percent.
+
+Status effects (see status.py) are not modelled. Buff abilities
+(attack_up, shield, speed_up, production_up) count as doing nothing, and
+the power and guard bonuses active on units are ignored when damage is
+applied. While buffs are up, the value is an approximation that can be
+further off.
+
+Solved tables are cached per team mixture, so repeated queries are
+lookups. A new mixture costs a solve (tens to hundreds of ms);
+BackgroundSolver runs those on a worker thread for callers that cannot
+wait, such as the app's win meter.
+
+Usage: python winprob.py --battles 20 --playouts 500
+"""
+import argparse
+import math
+import random
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import combinations_with_replacement, product
+
+import numpy as np
+
+from battle_engine import TEAM_SIZE, new_battle, play_battle, random_policy, step
+
+# HP represented by each level of a living unit; level 0 is defeated.
+# Finer near zero, where one hit decides whether a unit survives.
+LEVEL_HP = (0, 8, 30, 65, 100)
+MAX_HP = 100
+ATTACK_DAMAGE = range(10, 21)
+TOLERANCE = 1e-7
+
+def team_states(size=TEAM_SIZE, levels=len(LEVEL_HP) - 1):
+    """All multisets of living units' HP levels as non-increasing tuples; index 0 is the empty team"""
+    states = [()]
+    for n in range(1, size + 1):
+        states.extend(combinations_with_replacement(range(levels, 0, -1), n))
+    return states
+
+def _split(hp, level_hp):
+    """((level, probability), ...) for a living unit's HP, interpolating between adjacent
+    levels so that the expected HP is preserved"""
+    if hp <= level_hp[1]:
+        return ((1, 1.0),)
+    if hp >= level_hp[-1]:
+        return ((len(level_hp) - 1, 1.0),)
+    upper = bisect_right(level_hp, hp)
+    frac = (hp - level_hp[upper - 1]) / (level_hp[upper] - level_hp[upper - 1])
+    return ((upper - 1, 1.0 - frac), (upper, frac)) if frac else ((upper - 1, 1.0),)
+
+def _unit_kernel(amounts, level_hp, sign):
+    """Square matrix over levels: before -> distribution after a hit (sign -1) or heal (+1)"""
+    kernel = np.zeros((len(level_hp), len(level_hp)))
+    for level in range(1, len(level_hp)):
+        for amount, p in amounts.items():
+            hp = min(MAX_HP, level_hp[level] + sign * amount)
+            if hp <= 0:
+                kernel[level, 0] += p
+                continue
+            for after, q in _split(hp, level_hp):
+                kernel[level, after] += p * q
+    return kernel
+
+def _team_kernel(states, index, unit_kernel, eligible):
+    """Team-state transition matrix for one hit/heal on a uniformly chosen eligible unit"""
+    matrix = np.zeros((len(states), len(states)))
+    for i, state in enumerate(states):
+        targets = [j for j, level in enumerate(state) if eligible(level)]
+        if not targets:
+            matrix[i, i] = 1.0
+            continue
+        for j in targets:
+            rest = state[:j] + state[j + 1:]
+            for after, p in enumerate(unit_kernel[state[j]]):
+                if p:
+                    new = tuple(sorted(rest + ((after,) if after else ()), reverse=True))
+                    matrix[i, index[new]] += p / len(targets)
+    return matrix
+
+def action_mixture(units):
+    """(p_damage, damage amounts, p_heal, heal amounts) for a team's living units.
+
+    `units` is a tuple of per-unit ability tuples ((effect_type, strength), ...).
+    Each unit picks uniformly among its abilities, a basic attack and a skip.
+    """
+    damage, heal = {}, {}
+    share = 1.0 / len(units)
+    for abilities in units:
+        p = share / (len(abilities) + 2)
+        for effect_type, strength in abilities:
+            if effect_type == "damage":
+                damage[strength] = damage.get(strength, 0.0) + p
+            elif effect_type == "heal":
+                heal[strength] = heal.get(strength, 0.0) + p
+        for amount in ATTACK_DAMAGE:
+            damage[amount] = damage.get(amount, 0.0) + p / len(ATTACK_DAMAGE)
+    p_damage, p_heal = sum(damage.values()), sum(heal.values())
+    return (p_damage, {a: p / p_damage for a, p in damage.items()},
+            p_heal, {a: p / p_heal for a, p in heal.items()} if p_heal else {})
+
+@lru_cache(maxsize=64)
+def solve(team0, team1, size=TEAM_SIZE, level_hp=LEVEL_HP):
+    """Win probability of team 0 for every (team 0 state, team 1 state).
+
+    team0/team1 are tuples of living units' ability tuples (see
+    action_mixture). Returns (states, index, V) with V[a, b].
+    """
+    levels = len(level_hp) - 1
+    states = team_states(size, levels)
+    index = {s: i for i, s in enumerate(states)}
+    alive = np.array([len(s) for s in states], dtype=float)
+
+    kernels = []
+    for team in (team0, team1):
+        p_damage, damage, p_heal, heal = action_mixture(team)
+        hit = _team_kernel(states, index, _unit_kernel(damage, level_hp, -1), lambda level: True)
+        mend = (_team_kernel(states, index, _unit_kernel(heal, level_hp, 1), lambda level: level < levels)
+                if heal else np.eye(len(states)))
+        kernels.append((p_damage, hit, p_heal, mend, 1.0 - p_damage - p_heal))
+    (pd0, hit0, ph0, mend0, pn0), (pd1, hit1, ph1, mend1, pn1) = kernels
+
+    total = alive[:, None] + alive[None, :]
+    w0 = np.divide(alive[:, None], total, out=np.zeros_like(total), where=total > 0)
+    w1 = 1.0 - w0
+    # Probability of staying put, eliminated analytically to speed up convergence
+    stay = (w0 * (pd0 * np.diag(hit0)[None, :] + ph0 * np.diag(mend0)[:, None] + pn0)
+            + w1 * (pd1 * np.diag(hit1)[:, None] + ph1 * np.diag(mend1)[None, :] + pn1))
+    move = np.maximum(1.0 - stay, 1e-12)
+
+    V = np.full((len(states), len(states)), 0.5)
+    while True:
+        V[0, :] = 0.0  # Team 0 wiped out
+        V[1:, 0] = 1.0  # Team 1 wiped out
+        expected = (w0 * (pd0 * (V @ hit0.T) + ph0 * (mend0 @ V) + pn0 * V)
+                    + w1 * (pd1 * (hit1 @ V) + ph1 * (V @ mend1.T) + pn1 * V))
+        new = (expected - stay * V) / move
+        new[0, :] = 0.0
+        new[1:, 0] = 1.0
+        delta = np.abs(new - V).max()
+        V = new
+        if delta < TOLERANCE:
+            return states, index, V
+
+def _abilities(waifu, points, income):
+    """(effect_type, strength) of the abilities the random policy can choose from.
+
+    A team without a living producer only gets the points it has now, so
+    abilities it cannot pay for drop out (and attacks become more likely).
+    """
+    return tuple((a.effect_type, a.strength) for a in waifu.get_active_abilities(waifu.specialty)
+                 if income or a.cost <= points)
+
+def win_probability(players, teams, level_hp=LEVEL_HP):
+    """Estimated probability that Player 1 (index 0) wins from the current HP and points.
+
+    Active status effects are ignored (see the module docstring).
+    """
+    if not teams[1].alive:
+        return 1.0
+    if not teams[0].alive:
+        return 0.0
+    key, hp = _position(players, teams)
+    return _value(solve(*key, level_hp), hp, level_hp)
+
+def _position(players, teams):
+    """(solve() arguments without level_hp, living units' HP per team) of a battle both teams are still in"""
+    mixtures, hp = [], []
+    for player, team in zip(players, teams):
+        units = sorted(team.alive, key=lambda w: w.name)
+        income = any(w.specialty == "Production" for w in units)
+        mixtures.append(tuple(_abilities(w, player.production_points, income) for w in units))
+        hp.append(tuple(w.hp for w in units))
+    return (mixtures[0], mixtures[1], max(TEAM_SIZE, *(len(h) for h in hp))), hp
+
+def _value(solution, hp, level_hp):
+    """Player 1's win probability from exact HP values, given solve()'s tables"""
+    states, index, V = solution
+    dist0 = _team_distribution(index, hp[0], level_hp)
+    dist1 = _team_distribution(index, hp[1], level_hp)
+    rows, p0 = list(dist0), np.fromiter(dist0.values(), float)
+    cols, p1 = list(dist1), np.fromiter(dist1.values(), float)
+    return float(p0 @ V[np.ix_(rows, cols)] @ p1)
+
+class BackgroundSolver:
+    """win_probability() that never waits for a solve.
+
+    A position whose team mixtures have not been solved yet gets None
+    back, and its solve is queued on a worker thread; later queries find
+    it done. The last `maxsize` mixtures queried are kept.
+    """
+
+    def __init__(self, maxsize=64, level_hp=LEVEL_HP):
+        self.maxsize = maxsize
+        self.level_hp = level_hp
+        self._solutions = OrderedDict()  # solve() arguments -> Future of its tables, least recently used first
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="winprob")
+
+    def win_probability(self, players, teams):
+        """Like win_probability(), or None while the position's mixtures are being solved"""
+        if not teams[1].alive:
+            return 1.0
+        if not teams[0].alive:
+            return 0.0
+        key, hp = _position(players, teams)
+        with self._lock:
+            future = self._solutions.get(key)
+            if future is None:
+                future = self._solutions[key] = self._executor.submit(solve, *key, self.level_hp)
+                if len(self._solutions) > self.maxsize:
+                    self._solutions.popitem(last=False)
+            else:
+                self._solutions.move_to_end(key)
+        if not future.done():
+            return None
+        return _value(future.result(), hp, self.level_hp)
+
+def _team_distribution(index, hp, level_hp):
+    """{team state index: probability} for exact HP values"""
+    dist = {}
+    for combo in product(*(_split(h, level_hp) for h in hp)):
+        key = index[tuple(sorted((level for level, _ in combo), reverse=True))]
+        dist[key] = dist.get(key, 0.0) + math.prod(p for _, p in combo)
+    return dist
+
+def _monte_carlo(state, playouts, rng):
+    wins = 0
+    for _ in range(playouts):
+        wins += play_battle(state.clone(random.Random(rng.random())), random_policy) == 0
+    return wins / playouts
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare DP win probabilities with random playouts")
+    parser.add_argument("--battles", type=int, default=20, help="mid-battle states to check")
+    parser.add_argument("--playouts", type=int, default=500, help="playouts per state")
+    parser.add_argument("--levels", default=",".join(map(str, LEVEL_HP[1:])), help="HP of each level, ascending")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    level_hp = (0,) + tuple(int(hp) for hp in args.levels.split(","))
+    rng = random.Random(args.seed)
+    errors = []
+    for _ in range(args.battles):
+        state = new_battle(random.Random(rng.random()))
+        for _ in range(rng.randrange(20, 150)):
+            if state.is_over():
+                break
+            step(state, random_policy(state))
+        if state.is_over():
+            continue
+        start = time.perf_counter()
+        p = win_probability(state.players, state.teams, level_hp)
+        solved = time.perf_counter() - start
+        start = time.perf_counter()
+        win_probability(state.players, state.teams, level_hp)
+        cached = time.perf_counter() - start
+        mc = _monte_carlo(state, args.playouts, rng)
+        errors.append(abs(p - mc))
+        print(f"turn {state.actions_taken:>3}: DP {p:6.1%}  playouts {mc:6.1%}  "
+              f"(solve {solved * 1000:.0f} ms, cached {cached * 1e6:.0f} us)")
+    if errors:
+        print(f"Mean absolute difference: {sum(errors) / len(errors):.1%}")
+
+if __name__ == "__main__":
+    main()